@@ -1,771 +1,694 @@
 import streamlit as st
 import pandas as pd
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 import plotly.express as px
-from supabase import create_client, Client
-import schedule
-import threading
-import time as tiempo
-import uuid
-import requests
-from dotenv import load_dotenv
 import os
-import json
-import folium
 from streamlit_folium import st_folium
 
-st.set_page_config(page_title="Red Eléctrica", layout="centered")
-
-# Constantes de configuración de la API REE
-BASE_URL = "https://apidatos.ree.es/es/datos/"
-
-HEADERS = {
-    "accept": "application/json",
-    "content-type": "application/json"
-}
-
-ENDPOINTS = {
-    "demanda": ("demanda/evolucion", "hour"),
-    "balance": ("balance/balance-electrico", "day"),
-    "generacion": ("generacion/evolucion-renovable-no-renovable", "day"),
-    "intercambios": ("intercambios/todas-fronteras-programados", "day"),
-    "intercambios_baleares": ("intercambios/enlace-baleares", "day"),
-}
-
-# Cargar las variables de entorno desde el archivo .env
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
+# La configuración de la API, el cliente de Supabase y toda la ingesta viven en `ingesta_ree.py`, que se ejecuta
+# como proceso independiente (ver README). El dashboard solo consulta, a través de `consulta_ree.py`.
+from ingesta_ree import ENDPOINTS, INGESTA_CADA_MINUTOS, GEO_PREDETERMINADO, ambitos_endpoint
+import consulta_ree
+from consulta_ree import get_data_from_supabase, consultar_agregado, consultar_anomalias, resolucion_rollup
+from transformaciones_ree import alinear_por_dia_del_anio, remuestrear_serie
+from mapa_ree import cargar_geojson_intercambios, mapa_intercambios, saldos_por_pais
+from perfil_ree import Perfilador, leer_log
 
-# ------------------------------ UTILIDADES ------------------------------
-
-# Función para consultar un endpoint, según los parámetros dados, de la API de REE
-def get_data(endpoint_name, endpoint_info, params):
-    path, time_trunc = endpoint_info
-    params["time_trunc"] = time_trunc
-    url = BASE_URL + path
+st.set_page_config(page_title="Red Eléctrica", layout="centered")
 
+# Las consultas se memorizan como mucho un ciclo de ingesta (los datos no cambian entre dos sincronizaciones)
+# y con un número máximo de entradas, descartando las menos usadas
+CONSULTA_TTL_SEGUNDOS = int(os.getenv("CONSULTA_TTL_SEGUNDOS", str(INGESTA_CADA_MINUTOS * 60)))
+CONSULTA_MAX_ENTRADAS = int(os.getenv("CONSULTA_MAX_ENTRADAS", "32"))
+# Con CONSULTA_COMPARTIDA=1 todas las sesiones reciben el mismo DataFrame en memoria (una copia por consulta en
+# el proceso, en lugar de una por llamada). Ese DataFrame es de solo lectura: el dashboard nunca lo modifica y las
+# columnas derivadas se calculan sobre copias o filtrados.
+CONSULTA_COMPARTIDA = os.getenv("CONSULTA_COMPARTIDA", "0") == "1"
+# Figuras memorizadas (ver MODELO DE VISTA): como mucho FIGURAS_MAX_ENTRADAS por tipo de figura
+FIGURAS_MAX_ENTRADAS = int(os.getenv("FIGURAS_MAX_ENTRADAS", "16"))
+# Perfilado del dashboard (ver `perfil_ree.py`): con PERFIL_DASHBOARD=1, o añadiendo ?perfil=1 a la URL, se miden
+# los tiempos de cada etapa y se muestra un panel de rendimiento en la barra lateral
+PERFIL_DASHBOARD = os.getenv("PERFIL_DASHBOARD", "0") == "1"
+
+# Vistas del dashboard: solo se ejecuta la elegida (a diferencia de st.tabs, que ejecuta todas en cada rerun)
+VISTAS = ["Descripción", "Consulta de datos", "Visualización", "Extras"]
+
+# Perfilador de la ejecución actual del script; `main` lo sustituye en cada rerun
+perfil = Perfilador()
+
+# ------------------------------ CACHÉ DE CONSULTAS ------------------------------
+
+# Recursos compartidos por todas las sesiones del proceso. El cliente de Supabase ya lo es: se crea al importar
+# `ingesta_ree`, una vez por proceso, y no en cada rerun del script. El GeoJSON del mapa (solo los países de los
+# intercambios, recortado y simplificado; ver `mapa_ree.py`) se carga una sola vez.
+@st.cache_resource
+def cargar_geojson_mapa():
+    return cargar_geojson_intercambios()
+
+# La versión de cada tabla (última escritura del worker) se comprueba como mucho una vez por minuto.
+# Forma parte de la clave de las consultas, así que cuando el worker escribe datos nuevos dejan de usarse
+# las entradas antiguas sin esperar al TTL.
+@st.cache_data(ttl=60, show_spinner=False)
+def version_datos(tabla, geo=GEO_PREDETERMINADO):
     try:
-        response = requests.get(url, headers=HEADERS, params=params)
-        # Si la búsqueda no fue bien, se devuelve una lista vacía
-        if response.status_code != 200:
-            return []
-        response_data = response.json()
+        return consulta_ree.version_datos(tabla, geo)
     except Exception:
-        return []
-
-    data = []
-
-    # Verificamos si el item tiene "content" y asumimos que es una estructura compleja
-    for item in response_data.get("included", []):
-        attrs = item.get("attributes", {})
-        category = attrs.get("title")
-
-        if "content" in attrs:
-            for sub in attrs["content"]:
-                sub_attrs = sub.get("attributes", {})
-                sub_cat = sub_attrs.get("title")
-                for entry in sub_attrs.get("values", []):
-                    entry["primary_category"] = category
-                    entry["sub_category"] = sub_cat
-                    data.append(entry)
-        else:
-            # Procesamos las estructuras más simples (demanda, generacion, intercambios_baleares), asumiendo que no hay subcategorías
-            for entry in attrs.get("values", []):
-                entry["primary_category"] = category
-                entry["sub_category"] = None
-                data.append(entry)
-
-    return data
-
-# Función para insertar cada DataFrame en Supabase
-def insertar_en_supabase(nombre_tabla, df):
-    df = df.copy()
-
-    # Generamos IDs únicos
-    df["record_id"] = [str(uuid.uuid4()) for _ in range(len(df))]
-
-    # Convertimos fechas a string ISO
-    for col in ["datetime", "extraction_timestamp"]:
-        if col in df.columns:
-            df[col] = df[col].astype(str)
-
-    # Reemplazamos NaN por None
-    #df = df.where(pd.notnull(df), None)
-
-    # Convertir a lista de diccionarios e insertar
-    data = df.to_dict(orient="records")
-
+        return None
+
+# `st.cache_data` devuelve una copia nueva en cada llamada; `st.cache_resource` devuelve siempre el mismo objeto.
+# El DataFrame llega ya en formato compacto (ver `consulta_ree.compactar_frame`).
+def consultar_tabla_sin_cache(tabla, start_date, end_date, geo, version):
+    return get_data_from_supabase(tabla, start_date, end_date, geo=geo)
+
+if CONSULTA_COMPARTIDA:
+    consultar_tabla = st.cache_resource(ttl=CONSULTA_TTL_SEGUNDOS, max_entries=CONSULTA_MAX_ENTRADAS,
+                                        show_spinner=False)(consultar_tabla_sin_cache)
+else:
+    consultar_tabla = st.cache_data(ttl=CONSULTA_TTL_SEGUNDOS, max_entries=CONSULTA_MAX_ENTRADAS,
+                                    show_spinner=False)(consultar_tabla_sin_cache)
+
+@st.cache_data(ttl=CONSULTA_TTL_SEGUNDOS, max_entries=CONSULTA_MAX_ENTRADAS, show_spinner=False)
+def consultar_agregado_memo(nombre_rpc, start_date, end_date, version, **params):
+    return consultar_agregado(nombre_rpc, start_date, end_date, **params)
+
+# Anomalías que guarda el worker de ingesta (ver `anomalias_ree.py`): se leen ya calculadas, con la misma versión
+# que los datos. Si la tabla `anomalias` aún no existe, no hay anomalías que mostrar.
+@st.cache_data(ttl=CONSULTA_TTL_SEGUNDOS, max_entries=CONSULTA_MAX_ENTRADAS, show_spinner=False)
+def consultar_anomalias_memo(tabla, start_date, end_date, geo, version):
     try:
-        supabase.table(nombre_tabla).insert(data).execute()
-        print(f"✅ Insertados en '{nombre_tabla}': {len(data)} filas")
-    except Exception as e:
-        print(f"❌ Error al insertar en '{nombre_tabla}': {e}")
-
-# ------------------------------ FUNCIONES DE DESCARGA ------------------------------
-# Función de extracción de datos de los últimos x años, devuelve DataFrame. Ejecutar una vez al inicio para poblar la base de datos.
-def get_data_for_last_x_years(num_years=3):
-    all_dfs = []
-    current_date = datetime.now()
-    # Calculamos el año de inicio a partir del año actual
-    start_year_limit = current_date.year - num_years
-
-    # Iteramos sobre cada año y mes
-    for year in range(start_year_limit, current_date.year + 1):
-        for month in range(1, 13):
-            # Si el mes es mayor al mes actual y el año es el actual, lo saltamos
-            month_start = datetime(year, month, 1)
-            if month_start > current_date:
-                continue
-            # Calculamos el final del mes, asegurándonos de no exceder la fecha actual
-            month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(minutes=1)
-            end_date_for_request = min(month_end, current_date)
-
-            monthly_data = []  # para acumular todos los dfs del mes
-
-            # Iteramos sobre cada endpoint y sacamos los datos
-            for name, (path, granularity) in ENDPOINTS.items():
-                params = {
-                    "start_date": month_start.strftime("%Y-%m-%dT%H:%M"),
-                    "end_date": end_date_for_request.strftime("%Y-%m-%dT%H:%M"),
-                    "geo_trunc": "electric_system",
-                    "geo_limit": "peninsular",
-                    "geo_ids": "8741"
-                }
-
-                data = get_data(name, (path, granularity), params)
-
-                if data:
-                    df = pd.DataFrame(data)
-                    #Lidiamos con problemas de zona horaria en la columna "datetime"
-                    try:
-                        df['datetime'] = pd.to_datetime(df['datetime'], utc=True)
-                    except Exception:
-                        continue
-
-                    # Obtenemos nuevas columnas y las reordenamos
-                    df['year'] = df['datetime'].dt.year
-                    df['month'] = df['datetime'].dt.month
-                    df['day'] = df['datetime'].dt.day
-                    df['hour'] = df['datetime'].dt.hour
-                    df['extraction_timestamp'] = datetime.utcnow()
-                    df['endpoint'] = name
-                    df['record_id'] = [str(uuid.uuid4()) for _ in range(len(df))]
-                    df = df[['record_id', 'value', 'percentage', 'datetime',
-                             'primary_category', 'sub_category', 'year', 'month',
-                             'day', 'hour', 'endpoint', 'extraction_timestamp']]
-
-                    monthly_data.append(df)
-                    tiempo.sleep(1)
-
-            # Generamos los dataframes individuales
-            if monthly_data:
-                df_nuevo = pd.concat(monthly_data, ignore_index=True)
-                all_dfs.append(df_nuevo)
-
-                tablas_dfs = {
-                    "demanda": df_nuevo[df_nuevo["endpoint"] == "demanda"].drop(columns=["endpoint", "sub_category"], errors='ignore'),
-                    "balance": df_nuevo[df_nuevo["endpoint"] == "balance"].drop(columns=["endpoint"], errors='ignore'),
-                    "generacion": df_nuevo[df_nuevo["endpoint"] == "generacion"].drop(columns=["endpoint", "sub_category"], errors='ignore'),
-                    "intercambios": df_nuevo[df_nuevo["endpoint"] == "intercambios"].drop(columns=["endpoint"], errors='ignore'),
-                    "intercambios_baleares": df_nuevo[df_nuevo["endpoint"] == "intercambios_baleares"].drop(columns=["endpoint", "sub_category"], errors='ignore'),
-                }
-
-                for tabla, df_tabla in tablas_dfs.items():
-                    if not df_tabla.empty:
-                        insertar_en_supabase(tabla, df_tabla)
-
-    return pd.concat(all_dfs, ignore_index=True) if all_dfs else pd.DataFrame()
-
-# Función para actualizar los datos desde la API cada 24 horas
-def actualizar_datos_desde_api():
-    print(f"[{datetime.now()}] ⏳ Ejecutando extracción desde API...")
-    current_date = datetime.now()
-    start_date = current_date - timedelta(days=1)
-
-    all_dfs = []
-
-    for name, (path, granularity) in ENDPOINTS.items():
-        params = {
-            "start_date": start_date.strftime("%Y-%m-%dT%H:%M"),
-            "end_date": current_date.strftime("%Y-%m-%dT%H:%M"),
-            "geo_trunc": "electric_system",
-            "geo_limit": "peninsular",
-            "geo_ids": "8741"
-        }
-
-        datos = get_data(name, (path, granularity), params)
-
-        if datos:
-            df = pd.DataFrame(datos)
-            try:
-                df['datetime'] = pd.to_datetime(df['datetime'], utc=True)
-            except Exception:
-                continue
-
-            df['year'] = df['datetime'].dt.year
-            df['month'] = df['datetime'].dt.month
-            df['day'] = df['datetime'].dt.day
-            df['hour'] = df['datetime'].dt.hour
-            df['extraction_timestamp'] = datetime.utcnow()
-            df['endpoint'] = name
-            df['record_id'] = [str(uuid.uuid4()) for _ in range(len(df))]
-
-            df = df[['record_id', 'value', 'percentage', 'datetime',
-                     'primary_category', 'sub_category', 'year', 'month',
-                     'day', 'hour', 'endpoint', 'extraction_timestamp']]
-
-            all_dfs.append(df)
-            tiempo.sleep(1)
-        else:
-            print(f"⚠️ No se obtuvieron datos de '{name}'")
-
-    if all_dfs:
-        df_nuevo = pd.concat(all_dfs, ignore_index=True)
-
-        tablas_dfs = {
-            "demanda": df_nuevo[df_nuevo["endpoint"] == "demanda"].drop(columns=["endpoint", "sub_category"]),
-            "balance": df_nuevo[df_nuevo["endpoint"] == "balance"].drop(columns=["endpoint"]),
-            "generacion": df_nuevo[df_nuevo["endpoint"] == "generacion"].drop(columns=["endpoint", "sub_category"]),
-            "intercambios": df_nuevo[df_nuevo["endpoint"] == "intercambios"].drop(columns=["endpoint"]),
-            "intercambios_baleares": df_nuevo[df_nuevo["endpoint"] == "intercambios_baleares"].drop(columns=["endpoint", "sub_category"]),
-        }
-
-        for tabla, df in tablas_dfs.items():
-            if not df.empty:
-                insertar_en_supabase(tabla, df)
-
-# Programador para actualizar datos desde la API cada 24 horas
-def iniciar_programador_api():
-    schedule.every(24).hours.do(actualizar_datos_desde_api)
-    while True:
-        schedule.run_pending()
-        tiempo.sleep(60)
-
-threading.Thread(target=iniciar_programador_api, daemon=True).start()
-
-# ------------------------------ CONSULTA SUPABASE ------------------------------
-
-def get_data_from_supabase(table_name, start_date, end_date, page_size=1000):
-    end_date += timedelta(days=1)
-    start_iso = start_date.isoformat()
-    end_iso = end_date.isoformat()
-
-    all_data = []
-    offset = 0
-    while True:
-        response = (
-            supabase.table(table_name)
-            .select("*")
-            .gte("datetime", start_iso)
-            .lte("datetime", end_iso)
-            .range(offset, offset + page_size - 1)
-            .execute()
+        return consultar_anomalias(tabla, start_date, end_date, geo)
+    except Exception:
+        return pd.DataFrame(columns=["datetime", "primary_category", "sub_category", "value", "esperado", "metodos",
+                                     "sentido"])
+
+# Agregaciones del servidor que trabajan sobre una tabla fija y no reciben el parámetro `tabla`
+AGREGADOS_SIN_TABLA = {"demanda_media_dia_hora", "saldo_intercambios"}
+
+# Nombre de cada resolución de los rollups en los títulos de las gráficas
+NOMBRES_RESOLUCION = {"dia": "diaria", "mes": "mensual", "anio": "anual"}
+
+# Función auxiliar para las agregaciones del servidor: la versión se toma de la tabla y el ámbito consultados
+def agregado(nombre_rpc, rango, tabla="demanda", geo=GEO_PREDETERMINADO, **params):
+    if nombre_rpc not in AGREGADOS_SIN_TABLA:
+        params["tabla"] = tabla
+    params["geo"] = geo
+    with perfil.etapa(f"agregado: {nombre_rpc}"):
+        return consultar_agregado_memo(nombre_rpc, *rango, version_datos(tabla, geo), **params)
+
+# ------------------------------ MODELO DE VISTA ------------------------------
+# Cada vista se dibuja solo cuando está seleccionada y sus figuras se construyen bajo demanda, memorizadas por
+# (consulta, versión de los datos): un rerun hace solo el trabajo de lo que hay en pantalla y, si la consulta no ha
+# cambiado, ni siquiera eso. Las figuras memorizadas (`st.cache_resource`) se comparten entre sesiones y son de
+# solo lectura. El perfilado solo registra las etapas de las figuras que se construyen de nuevo.
+
+# Parámetros de la consulta elegida en la barra lateral: son la clave de los datos, los agregados y las figuras
+@dataclass(frozen=True)
+class Consulta:
+    tabla: str
+    geo: str
+    modo: str
+    inicio: datetime
+    fin: datetime
+    anio: int = None
+
+    @property
+    def rango(self):
+        return self.inicio, self.fin
+
+    def version(self):
+        return version_datos(self.tabla, self.geo)
+
+    def datos(self, version=None):
+        version = self.version() if version is None else version
+        with perfil.etapa(f"consulta: {self.tabla}"):
+            return consultar_tabla(self.tabla, self.inicio, self.fin, self.geo, version)
+
+    def anomalias(self, version=None):
+        version = self.version() if version is None else version
+        with perfil.etapa(f"anomalías: {self.tabla}"):
+            return consultar_anomalias_memo(self.tabla, self.inicio, self.fin, self.geo, version)
+
+memorizar_figura = st.cache_resource(ttl=CONSULTA_TTL_SEGUNDOS, max_entries=FIGURAS_MAX_ENTRADAS, show_spinner=False)
+
+# Número de filas, último dato y años presentes en los datos de la consulta (para los mensajes y los selectores)
+@st.cache_data(ttl=CONSULTA_TTL_SEGUNDOS, max_entries=CONSULTA_MAX_ENTRADAS, show_spinner=False)
+def resumen_datos(consulta, version):
+    df = consulta.datos(version)
+    if df.empty:
+        return 0, None, []
+    return len(df), df["datetime"].max(), sorted(int(year) for year in df["datetime"].dt.year.unique())
+
+# --- Visualización ---
+
+@memorizar_figura
+def figura_demanda(consulta, version):
+    df = consulta.datos(version)
+    # LTTB mantiene los picos y valles (p. ej. el apagón) aunque se envíen pocos puntos
+    with perfil.etapa("remuestreo: demanda"):
+        df_grafico, resolucion = remuestrear_serie(df, x="datetime", y="value")
+    with perfil.etapa("figura: demanda"):
+        fig = px.area(df_grafico, x="datetime", y="value", title="Demanda Eléctrica", labels={"value": "MW"})
+        # Las anomalías se marcan todas (son pocas), aunque la serie esté remuestreada
+        anomalias = consulta.anomalias(version)
+        for sentido, color in (("alta", "red"), ("baja", "orange")):
+            puntos = anomalias[anomalias["sentido"] == sentido]
+            if not puntos.empty:
+                fig.add_scatter(x=puntos["datetime"], y=puntos["value"], mode="markers", name=f"Anomalía ({sentido})",
+                                marker={"color": color, "size": 6})
+    return fig, len(df), len(df_grafico), resolucion
+
+# Histograma de demanda del año de la consulta con las anomalías detectadas por el worker de ingesta (respecto a su
+# hora de la semana, no a los cuantiles del año); None si no hay datos del año
+@memorizar_figura
+def histograma_anual(consulta, version):
+    df = consulta.datos(version)
+    # Filtra el DataFrame para el año seleccionado (df ya debe estar filtrado por el año, pero esto es por seguridad)
+    df_año = df[df['datetime'].dt.year == consulta.anio].copy()
+    if df_año.empty:
+        return None
+
+    # Marcar los valores anómalos según su sentido respecto al valor esperado
+    sentidos = consulta.anomalias(version).drop_duplicates("datetime").set_index("datetime")["sentido"]
+    df_año['is_outlier'] = df_año['datetime'].map(sentidos).map(
+        {'baja': 'Atípico (bajo)', 'alta': 'Atípico (alto)'}).fillna('Normal')
+
+    # Crear el histograma
+    with perfil.etapa("figura: histograma anual"):
+        fig_hist_outliers = px.histogram(
+            df_año,
+            x="value",
+            color="is_outlier",
+            title=f"Distribución Horaria de Demanda para {consulta.anio}",
+            labels={"value": "Demanda (MW)", "is_outlier": "Tipo de Valor"},
+            category_orders={"is_outlier": ["Atípico (bajo)", "Normal", "Atípico (alto)"]},
+            color_discrete_map={'Normal': 'skyblue', 'Atípico (bajo)': 'orange',
+                                'Atípico (alto)': 'red'},
+            nbins=50  # Ajusta el número de bins según la granularidad deseada
+        )
+        fig_hist_outliers.update_layout(bargap=0.1)  # Espacio entre barras
+
+    num_outliers_low = (df_año['is_outlier'] == 'Atípico (bajo)').sum()
+    num_outliers_high = (df_año['is_outlier'] == 'Atípico (alto)').sum()
+    return fig_hist_outliers, num_outliers_low, num_outliers_high
+
+@memorizar_figura
+def figura_comparativa_horaria(consulta, version, anios):
+    df = consulta.datos(version)
+    # Alineamos los años por día del año y hora sobre un eje común (año 2000, bisiesto),
+    # de forma vectorizada y respetando el 29 de febrero
+    with perfil.etapa("alineación: comparativa horaria"):
+        df_filtered_comparison = alinear_por_dia_del_anio(df, anios=list(anios))
+        df_filtered_comparison = df_filtered_comparison.sort_values('sort_key')
+
+    with perfil.etapa("remuestreo: comparativa horaria"):
+        df_comp_grafico, resolucion = remuestrear_serie(df_filtered_comparison, x="sort_key", y="value", color="year")
+    with perfil.etapa("figura: comparativa horaria"):
+        fig_comp_hourly = px.line(
+            df_comp_grafico,
+            x="sort_key",  # Usamos la 'sort_key' que es datetime
+            y="value",
+            color="year",
+            title="Demanda Horaria - Comparativa",
+            labels={"sort_key": "Mes y Día", "value": "Demanda (MW)", "year": "Año"},
+            hover_data={"year": True, "datetime": "|%Y-%m-%d %H:%M"}
+        )
+        fig_comp_hourly.update_xaxes(tickformat="%b %d")  # Formato para mostrar Mes y Día en el eje X
+    return fig_comp_hourly, len(df_filtered_comparison), len(df_comp_grafico), resolucion
+
+# Gráficos de comparación de métricas diarias (media, mediana, mínima y máxima): una figura por métrica
+@memorizar_figura
+def figuras_metricas_diarias(consulta, version, anios):
+    # Las métricas diarias se calculan en el servidor (función `estadisticas_diarias`)
+    metrics_comp = agregado("estadisticas_diarias", consulta.rango, tabla="demanda", geo=consulta.geo)
+    metrics_comp = metrics_comp.rename(columns={'media': 'mean', 'mediana': 'median',
+                                                'minimo': 'min', 'maximo': 'max'})
+    metrics_comp['fecha'] = pd.to_datetime(metrics_comp['fecha'])
+    # Misma alineación que el gráfico horario
+    with perfil.etapa("alineación: métricas diarias"):
+        metrics_comp = alinear_por_dia_del_anio(metrics_comp, x="fecha", anios=list(anios))
+        metrics_comp = metrics_comp.sort_values('sort_key')
+
+    metric_names = {
+        'mean': 'Media diaria de demanda',
+        'median': 'Mediana diaria de demanda',
+        'min': 'Mínima diaria de demanda',
+        'max': 'Máxima diaria de demanda',
+    }
+
+    figuras = []
+    for metric in ['mean', 'median', 'min', 'max']:
+        with perfil.etapa(f"figura: {metric} diaria"):
+            fig = px.line(
+                metrics_comp,
+                x="sort_key",  # Usar 'sort_key' (tipo datetime) para el eje X
+                y=metric,
+                color="year",
+                title=metric_names[metric],
+                labels={"sort_key": "Fecha (Mes-Día)", metric: "Demanda (MW)", "year": "Año"},
+            )
+            fig.update_xaxes(tickformat="%b %d")  # Formato para mostrar solo Mes y Día
+        # Si las líneas siguen entrecortadas, considera añadir `connectgaps=True`
+        # fig.update_traces(connectgaps=True)
+        figuras.append((metric, fig))
+    return figuras
+
+# Número de horas anómalas de demanda por año y sentido, leídas de las anomalías guardadas: (figura o None, conteo)
+@memorizar_figura
+def figura_anomalias_anuales(consulta, version):
+    anomalias = consulta.anomalias(version)
+    conteo = (anomalias.assign(year=anomalias['datetime'].dt.year)
+              .groupby(['year', 'sentido']).size().reset_index(name='anomalias'))
+    if conteo.empty:
+        return None, conteo
+
+    with perfil.etapa("figura: anomalías por año"):
+        fig = px.bar(
+            conteo,
+            x='year',
+            y='anomalias',
+            color='sentido',
+            title='Horas con demanda anómala por año',
+            labels={'anomalias': 'Horas anómalas', 'year': 'Año', 'sentido': 'Sentido'},
+            color_discrete_map={'baja': 'orange', 'alta': 'red'}
+        )
+        fig.update_xaxes(type='category')
+    return fig, conteo
+
+@memorizar_figura
+def figura_balance(consulta, version):
+    df = consulta.datos(version)
+    with perfil.etapa("figura: balance"):
+        return px.bar(df, x="datetime", y="value", color="primary_category", barmode="group", title="Balance Eléctrico")
+
+@memorizar_figura
+def figura_generacion(consulta, version):
+    # Suma por tipo de generación leída de los rollups del servidor, por días o por meses según el rango
+    resolucion = resolucion_rollup(*consulta.rango)
+    df_grouped = agregado("serie_rollup", consulta.rango, tabla="generacion", geo=consulta.geo, resolucion=resolucion)
+    df_grouped = df_grouped.rename(columns={"periodo": "date", "suma": "value"})
+
+    with perfil.etapa("figura: generación"):
+        return px.line(
+            df_grouped,
+            x="date",
+            y="value",
+            color="primary_category",
+            title=f"Generación {NOMBRES_RESOLUCION[resolucion]} agregada por tipo"
         )
-        data = response.data
-        if not data:
-            break
-        all_data.extend(data)
-        offset += page_size
-        if len(data) < page_size:
-            break
-
-    if not all_data:
-        return pd.DataFrame()
-    df = pd.DataFrame(all_data)
-    df["datetime"] = pd.to_datetime(df["datetime"])
-    return df
 
-# ------------------------------ INTERFAZ ------------------------------
+@memorizar_figura
+def mapa_saldos(consulta, version):
+    # Saldo neto por país en el periodo consultado, calculado en el servidor (una fila por país)
+    saldos = saldos_por_pais(agregado("saldo_intercambios", consulta.rango, tabla="intercambios", geo=consulta.geo))
+
+    # GeoJSON reducido a los países del mapa (una sola vez por proceso)
+    geo_mapa = cargar_geojson_mapa()
+
+    with perfil.etapa("figura: mapa"):
+        return mapa_intercambios(geo_mapa, saldos)
+
+@memorizar_figura
+def figura_baleares(consulta, version):
+    df = consulta.datos(version)
+    # Filtramos las dos categorías
+    df_ib = df[df['primary_category'].isin(['Entradas', 'Salidas'])].copy()
+
+    # Agregamos por fecha para evitar múltiples por hora si fuera el caso
+    df_ib_grouped = df_ib.groupby(['datetime', 'primary_category'], observed=True)['value'].sum().reset_index()
+
+    df_ib_grouped['value'] = df_ib_grouped['value'].abs()
+
+    # Las áreas apiladas necesitan que ambas series compartan instantes: se agregan por intervalos
+    with perfil.etapa("remuestreo: baleares"):
+        df_ib_grafico, resolucion = remuestrear_serie(
+            df_ib_grouped, x="datetime", y="value", color="primary_category", metodo="agregado")
+    with perfil.etapa("figura: baleares"):
+        fig = px.area(
+            df_ib_grafico,
+            x="datetime",
+            y="value",
+            color="primary_category",
+            labels={"value": "Energía (MWh)", "datetime": "Fecha"},
+            title="Intercambios con Baleares - Área Apilada (Magnitud)"
+        )
+    return fig, len(df_ib_grouped), len(df_ib_grafico), resolucion
+
+# Resto de tablas del registro de endpoints (precios, emisiones, estructura de la generación...): una serie por
+# categoría, reducida como las demás series largas
+@memorizar_figura
+def figura_serie(consulta, version):
+    df = consulta.datos(version)
+    with perfil.etapa("remuestreo: serie"):
+        df_grafico, resolucion = remuestrear_serie(df, x="datetime", y="value", color="primary_category")
+    with perfil.etapa("figura: serie"):
+        fig = px.line(df_grafico, x="datetime", y="value", color="primary_category", title="Visualización")
+    return fig, len(df), len(df_grafico), resolucion
+
+# --- Extras ---
+
+@memorizar_figura
+def figura_heatmap(consulta, version):
+    # Media por día de la semana y hora calculada en el servidor (7 x 24 filas como máximo)
+    df_heatmap = agregado("demanda_media_dia_hora", consulta.rango, geo=consulta.geo)
+
+    days_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    df_heatmap['weekday'] = df_heatmap['dia_semana'].map(lambda d: days_order[d - 1])
+
+    heatmap_data = (
+        df_heatmap.pivot(index='weekday', columns='hora', values='media')
+        .reindex(days_order)
+    )
+    with perfil.etapa("figura: mapa de calor"):
+        fig1 = px.imshow(
+            heatmap_data,
+            labels=dict(x="Hora del día", y="Día de la semana", color="Demanda promedio (MW)"),
+            x=heatmap_data.columns,
+            y=heatmap_data.index,
+            color_continuous_scale="YlGnBu",
+            aspect="auto",
+        )
+        fig1.update_layout(title="Demanda promedio por día y hora")
+    return fig1
+
+@memorizar_figura
+def figura_boxplot(consulta, version):
+    df = consulta.datos(version)
+    # Solo las columnas del gráfico, sin copiar el DataFrame de la consulta
+    df_box = df[["datetime", "value"]].assign(month=df["datetime"].dt.month)
+    with perfil.etapa("figura: boxplot mensual"):
+        return px.box(
+            df_box,
+            x="month",
+            y="value",
+            title="Distribución de Demanda por mes",
+            labels={"value": "Demanda (MWh)", "hour": "Hora del Día"}
+        )
 
-def main():
-    st.title("Análisis de la Red Eléctrica Española")
+# ------------------------------ INTERFAZ ------------------------------
 
-    tab1, tab2, tab3, tab4 = st.tabs(["Descripción", "Consulta de datos", "Visualización", "Extras"])
-
-    with tab2:  # Mueve el contexto de la tab2 aquí para que `modo` se defina antes de usarse en session_state
-        st.subheader("Consulta de datos")
-
-        modo = st.radio("Tipo de consulta:", ["Últimos días", "Año específico", "Histórico"], horizontal=True,
-                        key="query_mode_radio")
-        st.session_state["modo_seleccionado"] = modo  # Guardar el modo en session_state
-
-        tabla = st.selectbox("Selecciona la tabla:", list(ENDPOINTS.keys()), key="query_table_select")
-
-        df = pd.DataFrame()  # Inicializamos el DataFrame para evitar errores
-
-        if modo == "Últimos días":
-            dias = st.selectbox("¿Cuántos días atrás?", [7, 14, 30], key="query_days_select")
-            end_date_query = datetime.now(timezone.utc)
-            start_date_query = end_date_query - timedelta(days=dias)
-            st.session_state["selected_year_for_viz"] = None  # Reset year if not in "Año específico" mode
-        elif modo == "Año específico":
-            current_year = datetime.now().year
-            # Se usa `key` para que el selectbox mantenga su estado
-            año = st.selectbox("Selecciona el año:", [current_year - i for i in range(3)], index=0,
-                               key="query_year_select")
-            st.session_state["selected_year_for_viz"] = año  # Store the selected year
-            start_date_query = datetime(año, 1, 1, tzinfo=timezone.utc)
-            end_date_query = datetime(año, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc)
-        elif modo == "Histórico":
-            # Si quieres cargar datos históricos de muchos años, ten cuidado con el rendimiento
-            start_date_query = datetime(2022, 1, 1, 0, 0, 0, tzinfo=timezone.utc)  # Ejemplo de fecha inicial
-            end_date_query = datetime.now(timezone.utc)
-            st.session_state["selected_year_for_viz"] = None  # Reset year if not in "Año específico" mode
-
-        with st.spinner("Consultando Supabase..."):
-            st.session_state["tabla_seleccionada_en_tab2"] = tabla
-            df = get_data_from_supabase(tabla, start_date_query, end_date_query)
-
-        # Mostrar resultados después de la consulta de cualquier modo
-        if not df.empty:
-            st.session_state["ree_data"] = df
-            st.session_state["tabla"] = tabla  # Esto es redundante si usas tabla_seleccionada_en_tab2, pero lo mantengo por seguridad
-            st.write(f"Datos recuperados: {len(df)} filas")
-            st.write("Último dato:", df['datetime'].max())
-            st.success("Datos cargados correctamente desde Supabase.")
+# Indica bajo la gráfica cuando se ha reducido el número de puntos enviados al navegador
+def nota_remuestreo(n_original, n_grafico, descripcion):
+    if descripcion != "original":
+        st.caption(f"Mostrando {n_grafico} de {n_original} puntos ({descripcion}).")
+
+# Envía una figura de Plotly al navegador midiendo el tiempo de envío y el tamaño del JSON de la figura
+def mostrar_grafico(fig, nombre):
+    with perfil.etapa(f"envío: {nombre}") as registro:
+        st.plotly_chart(fig, use_container_width=True)
+    perfil.medir_envio(registro, fig)
+
+# Panel de rendimiento (solo con el perfilado activo): etapas de esta ejecución y evolución según el log
+def mostrar_panel_rendimiento(**contexto):
+    perfil.guardar_log(**contexto)
+    with st.sidebar.expander("⏱️ Rendimiento", expanded=True):
+        resumen = perfil.resumen()
+        st.dataframe(resumen.style.format({"segundos": "{:.3f}", "bytes": "{:,.0f}"}, na_rep="-"),
+                     use_container_width=True, hide_index=True)
+        historial = leer_log()
+        if not historial.empty:
+            st.caption(f"Histórico del log ({historial['momento'].nunique()} ejecuciones), en segundos")
+            evolucion = historial.groupby("etapa")["segundos"].agg(["count", "median", "max"])
+            st.dataframe(evolucion.sort_values("median", ascending=False).round(3), use_container_width=True)
+
+# Controles de la consulta, en la barra lateral: se dibujan en cada rerun, así que mantienen su estado sea cual sea
+# la vista elegida. Devuelve la Consulta elegida.
+def controles_consulta():
+    st.sidebar.subheader("Consulta de datos")
+
+    modo = st.sidebar.radio("Tipo de consulta:", ["Últimos días", "Año específico", "Histórico"],
+                            key="query_mode_radio")
+
+    tabla = st.sidebar.selectbox("Selecciona la tabla:", list(ENDPOINTS.keys()), key="query_table_select")
+    # Ámbito geográfico: solo se pregunta si el worker ingiere más de uno para esta tabla (INGESTA_GEOS)
+    geos_tabla = ambitos_endpoint(tabla) or [GEO_PREDETERMINADO]
+    if len(geos_tabla) > 1:
+        geo = st.sidebar.selectbox("Sistema eléctrico:", geos_tabla, key="query_geo_select")
+    else:
+        geo = geos_tabla[0]
+
+    año = None
+    if modo == "Últimos días":
+        dias = st.sidebar.selectbox("¿Cuántos días atrás?", [7, 14, 30], key="query_days_select")
+        # Redondeamos a la hora para que la clave de la caché no cambie en cada rerun
+        end_date_query = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        start_date_query = end_date_query - timedelta(days=dias)
+    elif modo == "Año específico":
+        current_year = datetime.now().year
+        # Se usa `key` para que el selectbox mantenga su estado
+        año = st.sidebar.selectbox("Selecciona el año:", [current_year - i for i in range(3)], index=0,
+                                   key="query_year_select")
+        start_date_query = datetime(año, 1, 1, tzinfo=timezone.utc)
+        end_date_query = datetime(año, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc)
+    else:
+        # Si quieres cargar datos históricos de muchos años, ten cuidado con el rendimiento
+        start_date_query = datetime(2022, 1, 1, 0, 0, 0, tzinfo=timezone.utc)  # Ejemplo de fecha inicial
+        end_date_query = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    return Consulta(tabla, geo, modo, start_date_query, end_date_query, año)
+
+def vista_descripcion():
+    st.subheader("¿Qué es esta app?")
+    st.markdown("""
+    Este proyecto explora los datos públicos de la **Red Eléctrica de España (REE)** a través de su API.
+    Se analizan aspectos como:
+
+    - La **demanda eléctrica** por hora.
+    - El **balance eléctrico** por día.
+    - La **generación** por mes.
+    - Los **intercambios programados** con otros países.
+
+    Estos datos permiten visualizar la evolución energética de España y generar análisis útiles para planificación y sostenibilidad.
+    """)
+
+def vista_consulta(consulta, version):
+    st.subheader("Consulta de datos")
+    with st.spinner("Consultando Supabase..."):
+        df = consulta.datos(version)
+
+    # Mostrar resultados después de la consulta de cualquier modo
+    if not df.empty:
+        st.write(f"Datos recuperados: {len(df)} filas")
+        st.write("Último dato:", df['datetime'].max())
+        st.success("Datos cargados correctamente desde Supabase.")
+        with st.expander("Ver datos en tabla"):
+            st.dataframe(df, use_container_width=True)
+    else:
+        st.warning("No se encontraron datos para ese período.")
+
+def vista_demanda(consulta, version):
+    fig, n_original, n_grafico, resolucion = figura_demanda(consulta, version)
+    mostrar_grafico(fig, "demanda")
+    nota_remuestreo(n_original, n_grafico, resolucion)
+
+    # --- Histograma de demanda con outliers para año específico ---
+    if consulta.modo == "Año específico":
+        st.subheader(f"Distribución de Demanda y Valores Atípicos para el año {consulta.anio}")
+        histograma = histograma_anual(consulta, version)
+        if histograma is None:
+            st.warning(f"No hay datos de demanda para el año {consulta.anio} para generar el histograma.")
         else:
-            st.warning("No se encontraron datos para ese período.")
-
-    with tab1:  # Reordeno esto para que la tab2 se cargue primero y defina el estado
-        st.subheader("¿Qué es esta app?")
-        st.markdown("""
-        Este proyecto explora los datos públicos de la **Red Eléctrica de España (REE)** a través de su API.
-        Se analizan aspectos como:
-
-        - La **demanda eléctrica** por hora.
-        - El **balance eléctrico** por día.
-        - La **generación** por mes.
-        - Los **intercambios programados** con otros países.
-
-        Estos datos permiten visualizar la evolución energética de España y generar análisis útiles para planificación y sostenibilidad.
-        """)
-
-    with tab3:
-        st.subheader("Visualización")
-        if "ree_data" in st.session_state and not st.session_state["ree_data"].empty:
-            # Recuperamos el DataFrame principal de la sesión para el primer gráfico
-            df = st.session_state["ree_data"]
-            tabla = st.session_state["tabla_seleccionada_en_tab2"]  # Usamos la tabla seleccionada en tab2
-            modo_actual = st.session_state.get("modo_seleccionado", "Últimos días")  # Obtener el modo
-
-            if tabla == "demanda":
-                fig = px.area(df, x="datetime", y="value", title="Demanda Eléctrica", labels={"value": "MW"})
-                st.plotly_chart(fig, use_container_width=True)
-
-                # --- Nuevo gráfico: Histograma de demanda con outliers para año específico ---
-                if modo_actual == "Año específico":
-                    año_seleccionado = st.session_state.get("selected_year_for_viz")
-                    if año_seleccionado is None:
-                        st.warning(
-                            "Por favor, selecciona un año en la pestaña 'Consulta de datos' para ver el histograma de demanda.")
-                    else:
-                        st.subheader(f"Distribución de Demanda y Valores Atípicos para el año {año_seleccionado}")
-
-                        # Filtra el DataFrame para el año seleccionado (df ya debe estar filtrado por el año, pero esto es por seguridad)
-                        df_año = df[df['year'] == año_seleccionado].copy()
-
-                        if not df_año.empty:
-                            # Calcular Q1, Q3 y el IQR para la columna 'value' (demanda)
-                            Q1 = df_año['value'].quantile(0.25)
-                            Q3 = df_año['value'].quantile(0.75)
-                            IQR = Q3 - Q1
-
-                            # Calcular los límites de Tukey's Fence
-                            lower_bound = Q1 - 1.5 * IQR
-                            upper_bound = Q3 + 1.5 * IQR
-
-                            # Identificar valores atípicos
-                            df_año['is_outlier'] = 'Normal'
-                            df_año.loc[df_año['value'] < lower_bound, 'is_outlier'] = 'Atípico (bajo)'
-                            df_año.loc[df_año['value'] > upper_bound, 'is_outlier'] = 'Atípico (alto)'
-
-                            # Crear el histograma
-                            fig_hist_outliers = px.histogram(
-                                df_año,
-                                x="value",
-                                color="is_outlier",
-                                title=f"Distribución Horaria de Demanda para {año_seleccionado}",
-                                labels={"value": "Demanda (MW)", "is_outlier": "Tipo de Valor"},
-                                category_orders={"is_outlier": ["Atípico (bajo)", "Normal", "Atípico (alto)"]},
-                                color_discrete_map={'Normal': 'skyblue', 'Atípico (bajo)': 'orange',
-                                                    'Atípico (alto)': 'red'},
-                                nbins=50  # Ajusta el número de bins según la granularidad deseada
-                            )
-                            fig_hist_outliers.update_layout(bargap=0.1)  # Espacio entre barras
-                            st.plotly_chart(fig_hist_outliers, use_container_width=True)
-
-                            # Mostrar información sobre outliers
-                            num_outliers_low = (df_año['is_outlier'] == 'Atípico (bajo)').sum()
-                            num_outliers_high = (df_año['is_outlier'] == 'Atípico (alto)').sum()
-
-                            if num_outliers_low > 0 or num_outliers_high > 0:
-                                st.warning(
-                                    f"Se han identificado {num_outliers_low} valores atípicos por debajo y {num_outliers_high} por encima (método IQR).")
-                                st.info(f"Rango normal de demanda (IQR): {lower_bound:.2f} MW - {upper_bound:.2f} MW")
-                            else:
-                                st.info(
-                                    "No se han identificado valores atípicos de demanda significativos (método IQR).")
-                        else:
-                            st.warning(
-                                f"No hay datos de demanda para el año {año_seleccionado} para generar el histograma.")
-
-                # --- Condición para mostrar la comparativa de años (mantenida de antes) ---
-                if modo_actual == "Histórico":
-                    st.subheader("Comparativa de Demanda entre años")
-
-                    # Definir los dos años específicos para la comparación: el año pasado y el anterior
-                    current_year = datetime.now().year
-
-                    # Los años que queremos comparar: el año anterior al actual y el año anterior a ese
-                    target_years_for_comparison = [current_year - 2, current_year - 1]
-
-                    # Obtener todos los años disponibles en el DataFrame del modo histórico
-                    all_available_years_in_df = sorted(list(df['year'].unique()))
-
-                    # Filtrar solo los años que queremos comparar y que realmente están disponibles en el df
-                    years_for_comparison = [
-                        year for year in target_years_for_comparison
-                        if year in all_available_years_in_df
-                    ]
-
-                    if len(years_for_comparison) == 2:
-                        # Asegurarse de que están en el orden deseado (ej. [2023, 2024])
-                        years_for_comparison.sort()
-                    elif len(years_for_comparison) == 1:
-                        st.info(
-                            f"Solo se encontró un año de los deseados ({years_for_comparison[0]}) en modo histórico para la comparación. Se necesitan ambos años ({target_years_for_comparison[0]} y {target_years_for_comparison[1]}).")
-                        years_for_comparison = []  # Vaciar para no intentar graficar
-                    else:  # len(years_for_comparison) == 0
-                        st.info(
-                            f"No se encontraron datos para los años {target_years_for_comparison[0]} y {target_years_for_comparison[1]} en modo histórico para la comparación.")
-                        years_for_comparison = []  # Vaciar para no intentar graficar
-
-                    if years_for_comparison:  # Solo procede si tenemos al menos dos años para comparar
-                        df_comparison_demanda = df.copy()  # Usamos el df ya cargado en modo histórico
-
-                        # Nos aseguramos de que solo tengamos los años que queremos comparar
-                        df_filtered_comparison = df_comparison_demanda[
-                            df_comparison_demanda['year'].isin(years_for_comparison)].copy()
-
-                        # Convertimos la columna 'datetime' a una fecha sin el año, para comparar día a día
-                        # Esta 'sort_key' se usa para el gráfico horario
-                        df_filtered_comparison['sort_key'] = df_filtered_comparison['datetime'].apply(
-                            lambda dt: dt.replace(year=2000)  # Usar un año base para ordenar correctamente
-                        )
-                        df_filtered_comparison = df_filtered_comparison.sort_values('sort_key')
-
-                        # --- Gráfico de Demanda Horaria General Comparativa ---
-                        fig_comp_hourly = px.line(
-                            df_filtered_comparison,
-                            x="sort_key",  # Usamos la 'sort_key' que es datetime
-                            y="value",
-                            color="year",
-                            title="Demanda Horaria - Comparativa",
-                            labels={"sort_key": "Mes y Día", "value": "Demanda (MW)", "year": "Año"},
-                            hover_data={"year": True, "datetime": "|%Y-%m-%d %H:%M"}
-                        )
-                        fig_comp_hourly.update_xaxes(tickformat="%b %d")  # Formato para mostrar Mes y Día en el eje X
-                        st.plotly_chart(fig_comp_hourly, use_container_width=True)
-
-                        # --- Gráficos de Comparación de Métricas Diarias (Media, Mediana, Mínima, Máxima) ---
-                        # Agrupar por 'year' y 'month-day' para obtener las métricas diarias para cada año
-                        metrics_comp = df_filtered_comparison.groupby(
-                            ['year', df_filtered_comparison['datetime'].dt.strftime('%m-%d')])['value'].agg(
-                            ['mean', 'median', 'min', 'max']).reset_index()
-                        metrics_comp.columns = ['year', 'month_day', 'mean', 'median', 'min', 'max']
-
-                        # La corrección para el ValueError: day is out of range for month está aquí
-                        metrics_comp['sort_key'] = pd.to_datetime('2000-' + metrics_comp['month_day'],
-                                                                  format='%Y-%m-%d')
-                        metrics_comp = metrics_comp.sort_values('sort_key')
-
-                        metric_names = {
-                            'mean': 'Media diaria de demanda',
-                            'median': 'Mediana diaria de demanda',
-                            'min': 'Mínima diaria de demanda',
-                            'max': 'Máxima diaria de demanda',
-                        }
-
-                        for metric in ['mean', 'median', 'min', 'max']:
-                            fig = px.line(
-                                metrics_comp,
-                                x="sort_key",  # <--- CAMBIO CLAVE: Usar 'sort_key' (tipo datetime) para el eje X
-                                y=metric,
-                                color="year",
-                                title=metric_names[metric],
-                                labels={"sort_key": "Fecha (Mes-Día)", metric: "Demanda (MW)", "year": "Año"},
-                                # <--- CAMBIO EN ETIQUETA
-                            )
-                            fig.update_xaxes(tickformat="%b %d")  # Formato para mostrar solo Mes y Día
-                            # Si las líneas siguen entrecortadas, considera añadir `connectgaps=True`
-                            # fig.update_traces(connectgaps=True)
-                            st.plotly_chart(fig, use_container_width=True)
-
-
-                    else:
-                        st.warning(f"No hay suficientes datos de Demanda disponibles para la comparación.")
-
-                    # --- Gráfico de Identificación de años outliers (mantenida de antes) ---
-                    st.subheader("Identificación de Años Outliers (Demanda Anual Total)")
-
-                    st.markdown(
-                        "**Este gráfico muestra los años identificados como outliers en la demanda total anual.**\n\n"
-                        "En este caso, solo se detecta como outlier el año **2025**, lo cual es esperable ya que todavía no ha finalizado "
-                        "y su demanda acumulada es significativamente menor.\n\n"
-                        "Los años **2022, 2023 y 2024** presentan una demanda anual muy similar, en torno a los **700 MW**, por lo que "
-                        "no se consideran outliers según el criterio del rango intercuartílico (IQR)."
-                    )
-
-
-                    # Asegurarse de que el df tiene la columna 'year'
-                    if 'year' not in df.columns:
-                        df['year'] = df['datetime'].dt.year
-
-                    # Agrupar por año para obtener la demanda total anual
-                    df_annual_summary = df.groupby('year')['value'].sum().reset_index()
-                    df_annual_summary.rename(columns={'value': 'total_demand_MW'}, inplace=True)
-
-                    if not df_annual_summary.empty and len(df_annual_summary) > 1:
-                        # Calcular Q1, Q3 y el IQR
-                        Q1 = df_annual_summary['total_demand_MW'].quantile(0.25)
-                        Q3 = df_annual_summary['total_demand_MW'].quantile(0.75)
-                        IQR = Q3 - Q1
-
-                        # Calcular los límites para los outliers
-                        lower_bound = Q1 - 1.5 * IQR
-                        upper_bound = Q3 + 1.5 * IQR
-
-                        # Identificar los años que son outliers
-                        df_annual_summary['is_outlier'] = (
-                                (df_annual_summary['total_demand_MW'] < lower_bound) |
-                                (df_annual_summary['total_demand_MW'] > upper_bound)
-                        )
-
-                        # Crear el gráfico de barras
-                        fig_outliers = px.bar(
-                            df_annual_summary,
-                            x='year',
-                            y='total_demand_MW',
-                            color='is_outlier',  # Colorear las barras si son outliers
-                            title='Demanda Total Anual y Años Outlier',
-                            labels={'total_demand_MW': 'Demanda Total Anual (MW)', 'year': 'Año',
-                                    'is_outlier': 'Es Outlier'},
-                            color_discrete_map={False: 'skyblue', True: 'red'}  # Definir colores
-                        )
-
-                        st.plotly_chart(fig_outliers, use_container_width=True)
-
-                        # Mostrar los años identificados como outliers
-                        outlier_years = df_annual_summary[df_annual_summary['is_outlier']]['year'].tolist()
-                        if outlier_years:
-                            st.warning(
-                                f"Se han identificado los siguientes años como outliers: {', '.join(map(str, outlier_years))}")
-                        else:
-                            st.info("No se han identificado años outliers significativos (según el método IQR).")
-                    elif not df_annual_summary.empty and len(df_annual_summary) <= 1:
-                        st.info("Se necesitan al menos 2 años de datos para calcular outliers de demanda anual.")
-                    else:
-                        st.warning("No hay datos anuales disponibles para calcular outliers.")
-                # El siguiente 'else' se aplica si modo_actual NO es "Histórico"
-                elif modo_actual != "Histórico" and modo_actual != "Año específico":
-                    st.info(
-                        "Selecciona el modo 'Histórico' para ver la comparativa de años y la identificación de outliers anuales, o 'Año específico' para el histograma de demanda con outliers.")
-
-            elif tabla == "balance":
-                fig = px.bar(df, x="datetime", y="value", color="primary_category", barmode="group", title="Balance Eléctrico")
-                st.plotly_chart(fig, use_container_width=True)
-                st.markdown(
-                    "**Balance eléctrico diario por categoría**\n\n"
-                    "Este gráfico representa el balance energético entre las distintas fuentes y usos diarios. Cada barra agrupa los componentes "
-                    "principales del sistema: generación, consumo, pérdidas y exportaciones.\n\n"
-                    "Es útil para entender si hay superávit, déficit o equilibrio en la red cada día, y cómo se distribuye el uso de energía entre sectores."
-                )
-            
-            elif tabla == "generacion":
-                df['date'] = df['datetime'].dt.date  # Para reducir a nivel diario (si no lo tienes)
-
-                df_grouped = df.groupby(['date', 'primary_category'])['value'].sum().reset_index()
-
-                fig = px.line(
-                    df_grouped,
-                    x="date",
-                    y="value",
-                    color="primary_category",
-                    title="Generación diaria agregada por tipo"
-                )
-                st.plotly_chart(fig, use_container_width=True)
-                st.markdown(
-                    "**Generación diaria agregada por tipo**\n\n"
-                    "Se visualiza la evolución de la generación eléctrica por fuente: renovables (eólica, solar, hidroeléctrica) y no renovables "
-                    "(gas, nuclear, etc.).\n\n"
-                    "Esta gráfica permite observar patrones como aumentos de producción renovable en días soleados o ventosos, así como la estabilidad "
-                    "de tecnologías de base como la nuclear. Es clave para analizar la transición energética."
-                )
-
-            
-            elif tabla == "intercambios":
-                st.subheader("Mapa Coroplético de Intercambios Eléctricos")
-
-                st.markdown(
-                    "**Intercambios eléctricos internacionales**\n\n"
-                    "Este mapa muestra el **saldo neto de energía** (exportaciones menos importaciones) entre España y los países vecinos: "
-                    "**Francia, Portugal, Marruecos y Andorra**.\n\n"
-                    "Los valores positivos indican que **España exporta más energía de la que importa**, mientras que los negativos reflejan lo contrario.\n\n"
-                    "Este análisis es clave para comprender el papel de España como nodo energético regional, identificar dependencias o excedentes, "
-                    "y analizar cómo varían los flujos en situaciones especiales como picos de demanda o apagones."
-                )
-
-                    # Agrupamos y renombramos columnas
-                df_map = df.groupby("primary_category")["value"].sum().reset_index()
-                df_map.columns = ["pais_original", "Total"]
-
-
-                # Mapeo de nombres a inglés (para coincidir con el GeoJSON)
-                nombre_map = {
-                    "francia": "France",
-                    "portugal": "Portugal",
-                    "andorra": "Andorra",
-                    "marruecos": "Morocco"
-                }
-                df_map["Country"] = df_map["pais_original"].map(nombre_map)
-
-                df_map = df_map.dropna(subset=["Country"])
-
-                # Cargar el archivo GeoJSON
-                with open("world_countries_with_andorra.json", "r", encoding="utf-8") as f:
-                    world_geo = json.load(f)
-
-                # Crear el mapa
-                world_map = folium.Map(location=[40, 20], zoom_start=4)
-
-                folium.Choropleth(
-                    geo_data=world_geo,
-                    data=df_map,
-                    columns=["Country", "Total"],
-                    key_on="feature.properties.name",
-                    fill_color="RdBu",
-                    fill_opacity=0.7,
-                    line_opacity=0.2,
-                    legend_name="Saldo neto de energía (MWh)"
-                ).add_to(world_map)
-
-                st.markdown(
-                    "**Mapa de intercambios internacionales de energía – Contexto del apagón del 28 de abril de 2025**\n\n"
-                    "Este mapa revela cómo se comportaron los **flujos internacionales de energía** en torno al **apagón del 28 de abril de 2025**.\n\n"
-                    "Una **disminución en los intercambios con Francia o Marruecos** podría indicar una disrupción en el suministro internacional "
-                    "o un corte de emergencia.\n\n"
-                    "Si **España aparece como exportadora neta incluso durante el apagón**, esto sugiere que el problema no fue de generación, "
-                    "sino posiblemente **interno** (fallo en la red o desconexión de carga).\n\n"
-                    "La inclusión de **Andorra y Marruecos** proporciona un contexto más completo del comportamiento eléctrico en la península "
-                    "y el norte de África.\n\n"
-                    "Este gráfico es crucial para analizar si los intercambios internacionales actuaron de forma inusual, lo cual puede dar pistas "
-                    "sobre causas externas o coordinación regional durante el evento."
-                )
-
-                # Mostrar en Streamlit
-                st_folium(world_map, width=1285)
-
-            elif tabla == "intercambios_baleares":
-                # Filtramos las dos categorías
-                df_ib = df[df['primary_category'].isin(['Entradas', 'Salidas'])].copy()
-
-                # Agregamos por fecha para evitar múltiples por hora si fuera el caso
-                df_ib_grouped = df_ib.groupby(['datetime', 'primary_category'])['value'].sum().reset_index()
-
-                df_ib_grouped['value'] = df_ib_grouped['value'].abs()
-                st.markdown(
-                    "**Intercambios de energía con Baleares (Primer semestre 2025)**\n\n"
-                    "Durante el primer semestre de **2025**, las **salidas de energía hacia Baleares** superan consistentemente a las entradas, "
-                    "lo que indica que el sistema peninsular actúa mayormente como **exportador neto de energía**.\n\n"
-                    "Ambos flujos muestran una **tendencia creciente hacia junio**, especialmente las salidas, lo que podría reflejar un aumento "
-                    "en la demanda en Baleares o una mejora en la capacidad exportadora del sistema."
-                )
-                
-                fig = px.area(
-                    df_ib_grouped,
-                    x="datetime",
-                    y="value",
-                    color="primary_category",
-                    labels={"value": "Energía (MWh)", "datetime": "Fecha"},
-                    title="Intercambios con Baleares - Área Apilada (Magnitud)"
-                )
-
-                st.plotly_chart(fig, use_container_width=True)
+            fig_hist_outliers, num_outliers_low, num_outliers_high = histograma
+            mostrar_grafico(fig_hist_outliers, "histograma anual")
+
+            # Mostrar información sobre outliers
+            if num_outliers_low > 0 or num_outliers_high > 0:
+                st.warning(
+                    f"Se han identificado {num_outliers_low} valores atípicos por debajo y {num_outliers_high} por encima "
+                    "de lo esperado para su hora de la semana.")
             else:
-                fig = px.line(df, x="datetime", y="value", title="Visualización")
-                st.plotly_chart(fig, use_container_width=True)
-
-
-            with st.expander("Ver datos en tabla"):
-                st.dataframe(df, use_container_width=True)
+                st.info("No se han identificado valores atípicos de demanda en este año.")
+
+    # --- Comparativa de años e identificación de años outliers ---
+    elif consulta.modo == "Histórico":
+        st.subheader("Comparativa de Demanda entre años")
+
+        # Por defecto se comparan los dos últimos años completos, pero se puede elegir cualquier
+        # número de años de los disponibles en los datos del modo histórico
+        current_year = datetime.now().year
+        all_available_years_in_df = resumen_datos(consulta, version)[2]
+        target_years_for_comparison = [
+            year for year in (current_year - 2, current_year - 1) if year in all_available_years_in_df
+        ]
+        years_for_comparison = tuple(sorted(st.multiselect(
+            "Años a comparar:", all_available_years_in_df, default=target_years_for_comparison,
+            key="comparison_years_select")))
+
+        if len(years_for_comparison) >= 2:  # Solo procede si tenemos al menos dos años para comparar
+            # --- Gráfico de Demanda Horaria General Comparativa ---
+            fig_comp_hourly, n_original, n_grafico, resolucion = figura_comparativa_horaria(
+                consulta, version, years_for_comparison)
+            mostrar_grafico(fig_comp_hourly, "comparativa horaria")
+            nota_remuestreo(n_original, n_grafico, resolucion)
+
+            # --- Gráficos de Comparación de Métricas Diarias (Media, Mediana, Mínima, Máxima) ---
+            for metric, fig in figuras_metricas_diarias(consulta, version, years_for_comparison):
+                mostrar_grafico(fig, f"{metric} diaria")
         else:
-            st.info("Consulta primero los datos desde la pestaña anterior.")
+            st.warning("Selecciona al menos dos años con datos de Demanda para la comparación.")
 
-    with tab4:
-        if tabla == "demanda":
+        # --- Gráfico de anomalías por año ---
+        st.subheader("Anomalías de Demanda por Año")
 
-            # --- HEATMAP ---
-            df_heatmap = df.copy()
-            df_heatmap['weekday'] = df_heatmap['datetime'].dt.day_name()
-            df_heatmap['hour'] = df_heatmap['datetime'].dt.hour
+        st.markdown(
+            "**Este gráfico muestra cuántas horas de cada año tienen una demanda anómala.**\n\n"
+            "Cada hora se compara con la misma hora de la semana de las semanas anteriores, así que una hora es anómala "
+            "por lo inusual que es en su contexto y no por estar en los extremos del año. Las anomalías las calcula el "
+            "worker de ingesta al escribir los datos."
+        )
 
-            days_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+        fig_outliers, conteo = figura_anomalias_anuales(consulta, version)
+        if fig_outliers is not None:
+            mostrar_grafico(fig_outliers, "anomalías por año")
 
-            heatmap_data = (
-                df_heatmap.groupby(['weekday', 'hour'])['value']
-                .mean()
-                .reset_index()
-                .pivot(index='weekday', columns='hour', values='value')
-                .reindex(days_order)
-            )
-            st.markdown(
-                "**Demanda promedio por día y hora**\n\n"
-                "La demanda eléctrica promedio es más alta entre semana, especialmente de **lunes a viernes**, "
-                "con picos concentrados entre las **7:00 y 21:00 horas**. El máximo se registra los **viernes alrededor de las 19:00 h**, "
-                "superando los **32 000 MW**.\n\n"
-                "En contraste, los **fines de semana** muestran una demanda notablemente más baja y estable."
-            )
-            fig1 = px.imshow(
-                heatmap_data,
-                labels=dict(x="Hora del día", y="Día de la semana", color="Demanda promedio (MW)"),
-                x=heatmap_data.columns,
-                y=heatmap_data.index,
-                color_continuous_scale="YlGnBu",
-                aspect="auto",
-            )
-            fig1.update_layout(title="Demanda promedio por día y hora")
+            por_anio = conteo.groupby('year')['anomalias'].sum()
+            st.warning(f"El año con más horas anómalas es {por_anio.idxmax()} ({por_anio.max()} horas).")
+            if current_year in por_anio.index:
+                st.caption(f"El año {current_year} aún no ha terminado: sus horas anómalas no son comparables con las "
+                           "de un año completo.")
+        else:
+            st.info("No se han detectado anomalías de demanda en el periodo consultado.")
+    else:
+        st.info(
+            "Selecciona el modo 'Histórico' para ver la comparativa de años y las anomalías por año, o 'Año específico' para el histograma de demanda con outliers.")
+
+def vista_visualizacion(consulta, version):
+    st.subheader("Visualización")
+    if not resumen_datos(consulta, version)[0]:
+        st.info("No hay datos para la consulta elegida en la barra lateral.")
+        return
+
+    if consulta.tabla == "demanda":
+        vista_demanda(consulta, version)
+
+    elif consulta.tabla == "balance":
+        mostrar_grafico(figura_balance(consulta, version), "balance")
+        st.markdown(
+            "**Balance eléctrico diario por categoría**\n\n"
+            "Este gráfico representa el balance energético entre las distintas fuentes y usos diarios. Cada barra agrupa los componentes "
+            "principales del sistema: generación, consumo, pérdidas y exportaciones.\n\n"
+            "Es útil para entender si hay superávit, déficit o equilibrio en la red cada día, y cómo se distribuye el uso de energía entre sectores."
+        )
 
+    elif consulta.tabla == "generacion":
+        mostrar_grafico(figura_generacion(consulta, version), "generación")
+        st.markdown(
+            "**Generación agregada por tipo**\n\n"
+            "Se visualiza la evolución de la generación eléctrica por fuente: renovables (eólica, solar, hidroeléctrica) y no renovables "
+            "(gas, nuclear, etc.).\n\n"
+            "Esta gráfica permite observar patrones como aumentos de producción renovable en días soleados o ventosos, así como la estabilidad "
+            "de tecnologías de base como la nuclear. Es clave para analizar la transición energética."
+        )
 
-            st.plotly_chart(fig1, use_container_width=True)
+    elif consulta.tabla == "intercambios":
+        st.subheader("Mapa Coroplético de Intercambios Eléctricos")
 
-            # --- BOXPLOT ---
-            df_box = df.copy()
+        st.markdown(
+            "**Intercambios eléctricos internacionales**\n\n"
+            "Este mapa muestra el **saldo neto de energía** (exportaciones menos importaciones) entre España y los países vecinos: "
+            "**Francia, Portugal, Marruecos y Andorra**.\n\n"
+            "Los valores positivos indican que **España exporta más energía de la que importa**, mientras que los negativos reflejan lo contrario.\n\n"
+            "Este análisis es clave para comprender el papel de España como nodo energético regional, identificar dependencias o excedentes, "
+            "y analizar cómo varían los flujos en situaciones especiales como picos de demanda o apagones."
+        )
 
-            df_box["month"] = df_box["datetime"].dt.month
-            st.markdown(
-                "**Distribución de Demanda por mes (2025)**\n\n"
-                "La demanda eléctrica presenta **mayor variabilidad y valores más altos en los primeros tres meses del año**, "
-                "especialmente en **enero**.\n\n"
-                "En **abril**, se observa una mayor cantidad de valores atípicos a la baja, lo cual coincide con el "
-                "**apagón nacional del 28/04/2025**, donde España estuvo sin luz durante aproximadamente 8 a 10 horas.\n\n"
-                "A partir de **mayo**, la demanda se estabiliza ligeramente, con una reducción progresiva en la mediana mensual."
-            )
-            fig2 = px.box(
-                df_box,
-                x="month",
-                y="value",
-                title="Distribución de Demanda por mes",
-                labels={"value": "Demanda (MWh)", "hour": "Hora del Día"}
-            )
+        world_map = mapa_saldos(consulta, version)
+
+        st.markdown(
+            "**Mapa de intercambios internacionales de energía – Contexto del apagón del 28 de abril de 2025**\n\n"
+            "Este mapa revela cómo se comportaron los **flujos internacionales de energía** en torno al **apagón del 28 de abril de 2025**.\n\n"
+            "Una **disminución en los intercambios con Francia o Marruecos** podría indicar una disrupción en el suministro internacional "
+            "o un corte de emergencia.\n\n"
+            "Si **España aparece como exportadora neta incluso durante el apagón**, esto sugiere que el problema no fue de generación, "
+            "sino posiblemente **interno** (fallo en la red o desconexión de carga).\n\n"
+            "La inclusión de **Andorra y Marruecos** proporciona un contexto más completo del comportamiento eléctrico en la península "
+            "y el norte de África.\n\n"
+            "Este gráfico es crucial para analizar si los intercambios internacionales actuaron de forma inusual, lo cual puede dar pistas "
+            "sobre causas externas o coordinación regional durante el evento."
+        )
 
+        # Mostrar en Streamlit (el tamaño medido es el HTML del mapa, GeoJSON incluido)
+        with perfil.etapa("envío: mapa") as registro:
+            # Sin objetos de vuelta: el mapa no dispara reruns al moverlo o hacer zoom
+            st_folium(world_map, width=1285, returned_objects=[])
+        perfil.medir_envio(registro, world_map)
+
+    elif consulta.tabla == "intercambios_baleares":
+        st.markdown(
+            "**Intercambios de energía con Baleares (Primer semestre 2025)**\n\n"
+            "Durante el primer semestre de **2025**, las **salidas de energía hacia Baleares** superan consistentemente a las entradas, "
+            "lo que indica que el sistema peninsular actúa mayormente como **exportador neto de energía**.\n\n"
+            "Ambos flujos muestran una **tendencia creciente hacia junio**, especialmente las salidas, lo que podría reflejar un aumento "
+            "en la demanda en Baleares o una mejora en la capacidad exportadora del sistema."
+        )
+        fig, n_original, n_grafico, resolucion = figura_baleares(consulta, version)
+        mostrar_grafico(fig, "baleares")
+        nota_remuestreo(n_original, n_grafico, resolucion)
+
+    else:
+        fig, n_original, n_grafico, resolucion = figura_serie(consulta, version)
+        mostrar_grafico(fig, "serie")
+        nota_remuestreo(n_original, n_grafico, resolucion)
+
+# Tabla de las anomalías de la consulta, las más recientes primero
+def vista_anomalias(consulta, version):
+    st.subheader("Anomalías detectadas")
+    anomalias = consulta.anomalias(version)
+    if anomalias.empty:
+        st.info("No se han detectado anomalías para la consulta elegida en la barra lateral.")
+        return
+    altas = (anomalias["sentido"] == "alta").sum()
+    st.write(f"{len(anomalias)} valores anómalos: {altas} por encima y {len(anomalias) - altas} por debajo de lo "
+             "esperado para su hora de la semana y categoría.")
+    st.dataframe(anomalias.sort_values("datetime", ascending=False), use_container_width=True)
+
+def vista_extras(consulta, version):
+    if consulta.tabla != "demanda":
+        vista_anomalias(consulta, version)
+        return
+
+    # --- HEATMAP ---
+    st.markdown(
+        "**Demanda promedio por día y hora**\n\n"
+        "La demanda eléctrica promedio es más alta entre semana, especialmente de **lunes a viernes**, "
+        "con picos concentrados entre las **7:00 y 21:00 horas**. El máximo se registra los **viernes alrededor de las 19:00 h**, "
+        "superando los **32 000 MW**.\n\n"
+        "En contraste, los **fines de semana** muestran una demanda notablemente más baja y estable."
+    )
+    mostrar_grafico(figura_heatmap(consulta, version), "mapa de calor")
+
+    # --- BOXPLOT ---
+    st.markdown(
+        "**Distribución de Demanda por mes**\n\n"
+        "Cada caja resume la demanda horaria de un mes. Los puntos fuera de los bigotes son extremos del mes, "
+        "no necesariamente anomalías: las anomalías (tabla inferior) tienen en cuenta la hora de la semana."
+    )
+    mostrar_grafico(figura_boxplot(consulta, version), "boxplot mensual")
+
+    vista_anomalias(consulta, version)
 
-            st.plotly_chart(fig2, use_container_width=True)
+def main():
+    global perfil
+    perfil = Perfilador(activo=PERFIL_DASHBOARD or st.query_params.get("perfil") == "1")
+    st.title("Análisis de la Red Eléctrica Española")
 
+    consulta = controles_consulta()
+    vista = st.radio("Vista:", VISTAS, horizontal=True, key="vista_radio", label_visibility="collapsed")
+
+    # Solo se ejecuta la vista elegida; la descripción no necesita ni la versión de los datos
+    if vista == "Descripción":
+        vista_descripcion()
+    else:
+        version = consulta.version()
+        if vista == "Consulta de datos":
+            vista_consulta(consulta, version)
+        elif vista == "Visualización":
+            vista_visualizacion(consulta, version)
         else:
-            st.markdown("Nada que ver... de momento")
+            vista_extras(consulta, version)
+
+    if perfil.activo:
+        mostrar_panel_rendimiento(tabla=consulta.tabla, geo=consulta.geo, modo=consulta.modo, vista=vista)
 
 if __name__ == "__main__":
     main()
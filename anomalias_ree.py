@@ -0,0 +1,164 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+# Detección de anomalías en las series ingeridas. Cada punto se compara con una línea base estacional: los valores
+# de la misma hora de la semana (día de la semana y hora peninsular) y categoría en las ANOMALIAS_SEMANAS semanas
+# anteriores. Se calculan tres puntuaciones:
+#   - iqr: cuántos rangos intercuartílicos se sale el valor del intervalo [Q1, Q3] de la línea base
+#   - z: distancia a la media de la línea base, en desviaciones típicas
+#   - residuo: residuo respecto a la mediana de la línea base, dividido por la escala robusta (1,4826 · MAD) de los
+#     residuos de la categoría en las mismas semanas
+# Un punto es anómalo si al menos ANOMALIAS_MIN_METODOS puntuaciones superan su umbral (con líneas base de pocas
+# semanas, un solo método da bastantes falsos positivos en series con ruido; con 1 basta cualquiera de los tres).
+# No se guarda estado de la línea base entre ejecuciones: después de cada ejecución el worker recalcula las
+# anomalías del rango escrito con una ventana que incluye las 2 · ANOMALIAS_SEMANAS semanas anteriores (ver
+# `actualizar_anomalias`) y las guarda en la tabla `anomalias`, de la que leen el dashboard y las alertas. No depende
+# de Streamlit: las funciones de lectura y escritura reciben el cliente de Supabase.
+ANOMALIAS_ACTIVAS = os.getenv("ANOMALIAS_ACTIVAS", "1") == "1"
+ANOMALIAS_SEMANAS = int(os.getenv("ANOMALIAS_SEMANAS", "12"))
+# Observaciones mínimas de la línea base (semanas con dato) para puntuar un punto
+ANOMALIAS_MIN_SEMANAS = int(os.getenv("ANOMALIAS_MIN_SEMANAS", "4"))
+ANOMALIAS_MIN_METODOS = int(os.getenv("ANOMALIAS_MIN_METODOS", "2"))
+UMBRAL_IQR = float(os.getenv("ANOMALIAS_UMBRAL_IQR", "3"))
+UMBRAL_Z = float(os.getenv("ANOMALIAS_UMBRAL_Z", "4"))
+UMBRAL_RESIDUO = float(os.getenv("ANOMALIAS_UMBRAL_RESIDUO", "3.5"))
+# Escala mínima de las puntuaciones (IQR, desviación típica y MAD), como fracción del valor esperado: con una línea
+# base constante la escala es 0 (o ruido numérico) y cualquier desviación daría una puntuación infinita o ninguna
+ANOMALIAS_ESCALA_MINIMA = float(os.getenv("ANOMALIAS_ESCALA_MINIMA", "0.01"))
+
+METODOS = ("iqr", "z", "residuo")
+
+# La hora de la semana se toma en hora peninsular: el consumo sigue al reloj local, así que en UTC el patrón se
+# desplazaría una hora durante las semanas posteriores a cada cambio de horario
+ZONA_ESTACIONAL = "Europe/Madrid"
+
+# Tabla de anomalías (ver `Supabase_schema`) y clave del upsert
+TABLA_ANOMALIAS = "anomalias"
+CLAVE_ANOMALIAS = "tabla,geo,datetime,primary_category,sub_category"
+COLUMNAS_ANOMALIAS = ["datetime", "primary_category", "sub_category", "value", "esperado",
+                      "puntuacion_iqr", "puntuacion_z", "puntuacion_residuo", "metodos", "sentido"]
+
+# ------------------------------ PUNTUACIÓN ------------------------------
+
+# Estadístico de una ventana móvil por grupos, devuelto con el índice original de la serie
+def por_grupos(ventana, estadistico, *args):
+    return getattr(ventana, estadistico)(*args).reset_index(level=0, drop=True).sort_index()
+
+# Función que añade a `df` (datetime, value, primary_category y, si la tiene, sub_category) la línea base de cada
+# punto y sus tres puntuaciones. La línea base solo usa observaciones anteriores al punto, así que puntuar un rango
+# ya ingerido da lo mismo que haberlo puntuado según llegaba. Sin histórico suficiente, las puntuaciones son NaN.
+def puntuar_serie(df, semanas=ANOMALIAS_SEMANAS, min_semanas=ANOMALIAS_MIN_SEMANAS):
+    categorias = [columna for columna in ("primary_category", "sub_category") if columna in df.columns]
+    df = df.sort_values("datetime", kind="stable").reset_index(drop=True)
+    fechas = df["datetime"].dt.tz_convert("UTC")
+    locales = df["datetime"].dt.tz_convert(ZONA_ESTACIONAL)
+    valores = df["value"].astype("float64")
+
+    # Línea base por categoría y hora de la semana: las `semanas` observaciones anteriores del mismo grupo
+    id_categoria = df.groupby(categorias, dropna=False, sort=False, observed=True).ngroup()
+    id_grupo = pd.Series(list(zip(id_categoria, locales.dt.dayofweek * 24 + locales.dt.hour))).factorize()[0]
+    anteriores = valores.groupby(id_grupo).shift(1)
+    ventana = anteriores.groupby(id_grupo).rolling(semanas, min_periods=min_semanas)
+    q1 = por_grupos(ventana, "quantile", 0.25)
+    q3 = por_grupos(ventana, "quantile", 0.75)
+    mediana = por_grupos(ventana, "median")
+    media = por_grupos(ventana, "mean")
+    desviacion = por_grupos(ventana, "std")
+
+    escala_minima = ANOMALIAS_ESCALA_MINIMA * mediana.abs()
+    iqr = np.maximum(q3 - q1, escala_minima)
+    puntuacion_iqr = np.maximum(valores - q3, q1 - valores).clip(lower=0) / iqr.where(iqr > 0)
+    desviacion = np.maximum(desviacion, escala_minima)
+    puntuacion_z = (valores - media) / desviacion.where(desviacion > 0)
+
+    # Escala robusta de los residuos de cada categoría en las `semanas` semanas anteriores al punto. La ventana es
+    # temporal, así que el resultado sale indexado por fecha en el orden de los grupos y se recoloca por posición.
+    residuo = valores - mediana
+    absolutos = pd.Series(residuo.abs().groupby(id_categoria).shift(1).to_numpy(), index=fechas)
+    medianas = (absolutos.groupby(id_categoria.to_numpy())
+                .rolling(f"{7 * semanas}D", min_periods=min_semanas).median())
+    mad = pd.Series(np.nan, index=df.index)
+    mad.iloc[np.argsort(id_categoria.to_numpy(), kind="stable")] = medianas.to_numpy()
+    escala = np.maximum(1.4826 * mad, escala_minima)
+    puntuacion_residuo = residuo / escala.where(escala > 0)
+
+    return df.assign(esperado=mediana, puntuacion_iqr=puntuacion_iqr, puntuacion_z=puntuacion_z,
+                     puntuacion_residuo=puntuacion_residuo)
+
+# Función que devuelve los puntos anómalos de `df` con datetime >= `desde` (todos si es None): sus puntuaciones, los
+# métodos que los marcan (p. ej. "iqr,residuo") y el sentido ("alta" o "baja") respecto al valor esperado
+def detectar_anomalias(df, desde=None, semanas=ANOMALIAS_SEMANAS, min_semanas=ANOMALIAS_MIN_SEMANAS):
+    if df.empty:
+        return pd.DataFrame(columns=COLUMNAS_ANOMALIAS)
+    puntuado = puntuar_serie(df, semanas, min_semanas)
+    if desde is not None:
+        puntuado = puntuado[puntuado["datetime"] >= pd.Timestamp(desde)]
+    marcas = pd.DataFrame({
+        "iqr": puntuado["puntuacion_iqr"] > UMBRAL_IQR,
+        "z": puntuado["puntuacion_z"].abs() > UMBRAL_Z,
+        "residuo": puntuado["puntuacion_residuo"].abs() > UMBRAL_RESIDUO,
+    })
+    marcados = marcas.sum(axis=1) >= ANOMALIAS_MIN_METODOS
+    anomalos = puntuado[marcados].copy()
+    anomalos["metodos"] = marcas[marcados].apply(
+        lambda fila: ",".join(metodo for metodo in METODOS if fila[metodo]), axis=1)
+    anomalos["sentido"] = np.where(anomalos["value"] >= anomalos["esperado"], "alta", "baja")
+    if "sub_category" not in anomalos.columns:
+        anomalos["sub_category"] = None
+    return anomalos[COLUMNAS_ANOMALIAS].reset_index(drop=True)
+
+# ------------------------------ LECTURA Y ESCRITURA ------------------------------
+
+# Función que lee de una tabla de datos las filas de un ámbito con datetime en [desde, hasta], paginando por clave
+# sobre (datetime, record_id) como `consulta_ree`
+def leer_serie(cliente, tabla, geo, desde, hasta, page_size=1000):
+    filas, ultimo = [], None
+    while True:
+        query = (
+            cliente.table(tabla)
+            .select("record_id,datetime,value,primary_category,sub_category")
+            .eq("geo", geo)
+            .gte("datetime", pd.Timestamp(desde).isoformat())
+            .lte("datetime", pd.Timestamp(hasta).isoformat())
+        )
+        if ultimo is not None:
+            ultimo_dt, ultimo_id = ultimo
+            query = query.or_(f'datetime.gt."{ultimo_dt}",and(datetime.eq."{ultimo_dt}",record_id.gt.{ultimo_id})')
+        data = query.order("datetime").order("record_id").limit(page_size).execute().data
+        filas.extend(data)
+        if len(data) < page_size:
+            break
+        ultimo = (data[-1]["datetime"], data[-1]["record_id"])
+    df = pd.DataFrame(filas, columns=["record_id", "datetime", "value", "primary_category", "sub_category"])
+    df["datetime"] = pd.to_datetime(df["datetime"], utc=True)
+    df["value"] = pd.to_numeric(df["value"])
+    return df.drop(columns="record_id")
+
+# Función que sustituye las anomalías guardadas de una tabla y ámbito en [desde, hasta] por las detectadas: se
+# borran las anteriores (un dato revisado puede dejar de ser anómalo) y se escriben las nuevas por lotes
+def guardar_anomalias(cliente, tabla, geo, desde, hasta, anomalias, tam_lote=500):
+    (cliente.table(TABLA_ANOMALIAS).delete()
+     .eq("tabla", tabla).eq("geo", geo)
+     .gte("datetime", pd.Timestamp(desde).isoformat()).lte("datetime", pd.Timestamp(hasta).isoformat())
+     .execute())
+    if anomalias.empty:
+        return
+    filas = anomalias.assign(tabla=tabla, geo=geo, datetime=anomalias["datetime"].map(pd.Timestamp.isoformat),
+                             detectado_en=datetime.now(timezone.utc).isoformat())
+    filas = filas.astype(object).where(pd.notnull(filas), None).to_dict(orient="records")
+    for i in range(0, len(filas), tam_lote):
+        cliente.table(TABLA_ANOMALIAS).upsert(filas[i:i + tam_lote], on_conflict=CLAVE_ANOMALIAS).execute()
+
+# Función que usa el worker: recálculo por ventana de las anomalías de [desde, hasta]. Lee el rango y las
+# 2 · `semanas` semanas anteriores (la línea base necesita `semanas` y la escala de los residuos del principio del
+# rango, otras tantas), puntúa toda la ventana y guarda las anomalías del rango. El coste depende del rango escrito
+# más un histórico fijo, no de toda la serie. Devuelve el DataFrame de anomalías detectadas.
+def actualizar_anomalias(cliente, tabla, geo, desde, hasta, semanas=ANOMALIAS_SEMANAS):
+    desde, hasta = pd.Timestamp(desde), pd.Timestamp(hasta)
+    df = leer_serie(cliente, tabla, geo, desde - timedelta(weeks=2 * semanas), hasta)
+    anomalias = detectar_anomalias(df, desde, semanas)
+    guardar_anomalias(cliente, tabla, geo, desde, hasta, anomalias)
+    return anomalias
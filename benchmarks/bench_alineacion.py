@@ -0,0 +1,66 @@
+# Micro-benchmark de la alineación estacional de la comparativa de demanda: la versión anterior (.apply con
+# `dt.replace(year=2000)` por fila) frente a `alinear_por_dia_del_anio`, vectorizada, para N años horarios.
+#
+#   python benchmarks/bench_alineacion.py [--repeticiones 5]
+import argparse
+import os
+import sys
+import time as tiempo
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformaciones_ree import alinear_por_dia_del_anio  # noqa: E402
+
+
+# Serie horaria sintética (UTC, como en Supabase) desde el 1 de enero de `primer_anio` durante `anios` años
+def demanda_sintetica(primer_anio, anios):
+    fechas = pd.date_range(f"{primer_anio}-01-01", f"{primer_anio + anios}-01-01", freq="h",
+                           inclusive="left", tz="UTC")
+    valores = 25000.0 + 5000.0 * np.sin(np.arange(len(fechas)) * 2 * np.pi / 24)
+    return pd.DataFrame({"datetime": fechas, "value": valores})
+
+
+# Implementación anterior, por filas, para comparar. `replace(year=2000)` no falla con el 29 de febrero porque
+# 2000 es bisiesto, pero el resto de fechas de los años no bisiestos quedan un día desplazadas respecto a los bisiestos
+def alineacion_por_filas(df, anios):
+    df = df.copy()
+    df["year"] = df["datetime"].dt.year
+    df = df[df["year"].isin(anios)].copy()
+    df["sort_key"] = df["datetime"].apply(lambda dt: dt.replace(year=2000))
+    return df.sort_values("sort_key")
+
+
+def alineacion_vectorizada(df, anios):
+    return alinear_por_dia_del_anio(df, anios=anios).sort_values("sort_key")
+
+
+def medir(funcion, df, anios, repeticiones):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = tiempo.perf_counter()
+        resultado = funcion(df, anios)
+        mejor = min(mejor, tiempo.perf_counter() - t0)
+    return len(resultado), mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de la alineación estacional por día del año")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'caso':<22}{'filas':>9}{'por filas (s)':>16}{'vectorizada (s)':>18}{'mejora':>9}")
+    for anios in (2, 3, 5, 10):
+        primer_anio = 2025 - anios
+        df = demanda_sintetica(primer_anio, anios)
+        seleccion = list(range(primer_anio, primer_anio + anios))
+        filas, t_filas = medir(alineacion_por_filas, df, seleccion, args.repeticiones)
+        _, t_vectorizada = medir(alineacion_vectorizada, df, seleccion, args.repeticiones)
+        print(f"{f'{anios} años, horario':<22}{filas:>9}{t_filas:>16.4f}{t_vectorizada:>18.4f}"
+              f"{t_filas / t_vectorizada:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Benchmark del dashboard con AppTest de Streamlit contra los mismos sustitutos que `bench_ree` (REE servida por
+# `ree_stub` y Supabase por `supabase_local`, con las RPC de agregación emuladas). Ingiere `--anios` años, abre la
+# app en modo "Histórico" sobre `--tabla` y mide el tiempo de un rerun de cada vista con los datos y las figuras ya
+# en caché (el mínimo y la mediana de `--repeticiones` reruns, tras uno de calentamiento). Con `--app` se mide otra
+# versión del script, p. ej. una anterior sacada con `git show <commit>:Streamlit_REE_auto.py > /tmp/app.py`; si no
+# tiene selector de vista, se mide el rerun de la app completa.
+#
+#   python benchmarks/bench_dashboard.py [--anios 3] [--tabla demanda] [--repeticiones 5] [--app ruta]
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time as tiempo
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import consulta_ree  # noqa: E402
+import ingesta_ree  # noqa: E402
+from ree_stub import arrancar_stub  # noqa: E402
+from supabase_local import SupabaseLocal  # noqa: E402
+
+
+# Widget por clave, esté en la barra lateral o en el cuerpo de la app (None si no existe)
+def widget(app, tipo, clave):
+    for raiz in (app.sidebar, app.main):
+        for elemento in getattr(raiz, tipo):
+            if elemento.key == clave:
+                return elemento
+    return None
+
+
+def medir_reruns(app, repeticiones):
+    app.run()
+    if app.exception:
+        raise RuntimeError(app.exception)
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = tiempo.perf_counter()
+        app.run()
+        tiempos.append(tiempo.perf_counter() - t0)
+    return min(tiempos), statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de reruns del dashboard con sustitutos locales")
+    parser.add_argument("--anios", type=int, default=3, help="años ingeridos antes de medir")
+    parser.add_argument("--tabla", default="demanda", help="tabla consultada en modo Histórico")
+    parser.add_argument("--repeticiones", type=int, default=5, help="reruns medidos por vista")
+    parser.add_argument("--app", default=os.path.join(RAIZ, "Streamlit_REE_auto.py"), help="script de la app")
+    parser.add_argument("--puerto", type=int, default=8766)
+    args = parser.parse_args()
+
+    proceso, base_url = arrancar_stub(args.puerto, 0)
+    supabase_local = SupabaseLocal()
+    cache_dir = tempfile.mkdtemp(prefix="bench_dashboard_cache_")
+
+    # AppTest ejecuta la app en este proceso, así que usa los mismos módulos redirigidos a los sustitutos
+    ingesta_ree.BASE_URL = base_url
+    ingesta_ree.limitador_ree.tasa = 1000
+    ingesta_ree.supabase = supabase_local
+    consulta_ree.supabase = supabase_local
+    consulta_ree.CACHE_DIR = cache_dir
+    try:
+        t0 = tiempo.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ingesta_ree.get_data_for_last_x_years(args.anios, ingesta_ree.REE_MAX_WORKERS)
+        print(f"ingesta de {args.anios} años: {tiempo.perf_counter() - t0:.1f} s")
+
+        app = AppTest.from_file(args.app, default_timeout=600)
+        app.run()
+        widget(app, "radio", "query_mode_radio").set_value("Histórico")
+        widget(app, "selectbox", "query_table_select").set_value(args.tabla)
+        selector = widget(app, "radio", "vista_radio")
+        vistas = list(selector.options) if selector is not None else [None]
+
+        print(f"{'vista':<22}{'mín. s':>9}{'mediana s':>11}")
+        for vista in vistas:
+            if vista is not None:
+                widget(app, "radio", "vista_radio").set_value(vista)
+            minimo, mediana = medir_reruns(app, args.repeticiones)
+            print(f"{vista or 'app completa':<22}{minimo:>9.3f}{mediana:>11.3f}")
+    finally:
+        proceso.terminate()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
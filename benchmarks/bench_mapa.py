@@ -0,0 +1,84 @@
+# Micro-benchmark del mapa de intercambios: la versión anterior (json.load del GeoJSON de todo el mundo en cada
+# render y folium.Choropleth sobre todos los países) frente a `mapa_ree` (subconjunto recortado y simplificado,
+# guardado en disco, y una capa GeoJson ya coloreada). Mide tiempo de construcción y tamaño del HTML enviado.
+#
+#   python benchmarks/bench_mapa.py [--geojson world_countries_with_andorra.json] [--repeticiones 3]
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time as tiempo
+
+import folium
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mapa_ree import GEOJSON_MUNDO, PAISES_INTERCAMBIO, cargar_geojson_intercambios, mapa_intercambios  # noqa: E402
+
+# Saldos de ejemplo (MWh) para colorear los países
+SALDOS = {"francia": -30328.9, "portugal": 12544.0, "marruecos": 8021.5, "andorra": 310.2}
+
+
+# Implementación anterior: lectura del fichero completo y Choropleth sobre el mundo entero
+def mapa_anterior(ruta_mundo):
+    with open(ruta_mundo, "r", encoding="utf-8") as f:
+        world_geo = json.load(f)
+    df_map = pd.DataFrame({"Country": [PAISES_INTERCAMBIO[p] for p in SALDOS], "Total": list(SALDOS.values())})
+    world_map = folium.Map(location=[40, 20], zoom_start=4)
+    folium.Choropleth(
+        geo_data=world_geo,
+        data=df_map,
+        columns=["Country", "Total"],
+        key_on="feature.properties.name",
+        fill_color="RdBu",
+        fill_opacity=0.7,
+        line_opacity=0.2,
+        legend_name="Saldo neto de energía (MWh)"
+    ).add_to(world_map)
+    return world_map
+
+
+def mapa_nuevo(ruta_mundo, ruta_cache):
+    geojson = cargar_geojson_intercambios(ruta_mundo, ruta_cache)
+    return mapa_intercambios(geojson, {PAISES_INTERCAMBIO[p]: v for p, v in SALDOS.items()})
+
+
+def medir(funcion, *args, repeticiones=3):
+    mejor_construccion, mejor_render = float("inf"), float("inf")
+    for _ in range(repeticiones):
+        t0 = tiempo.perf_counter()
+        mapa = funcion(*args)
+        t1 = tiempo.perf_counter()
+        html = mapa.get_root().render()
+        t2 = tiempo.perf_counter()
+        mejor_construccion = min(mejor_construccion, t1 - t0)
+        mejor_render = min(mejor_render, t2 - t1)
+    return mejor_construccion, mejor_render, len(html.encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark del mapa de intercambios")
+    parser.add_argument("--geojson", default=GEOJSON_MUNDO, help="GeoJSON de países del mundo (propiedad `name`)")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+    if not os.path.exists(args.geojson):
+        sys.exit(f"No existe el GeoJSON '{args.geojson}' (indícalo con --geojson)")
+
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_cache = os.path.join(directorio, "geo_intercambios.json")
+        t0 = tiempo.perf_counter()
+        cargar_geojson_intercambios(args.geojson, ruta_cache)
+        print(f"Subconjunto construido en {tiempo.perf_counter() - t0:.3f} s "
+              f"({os.path.getsize(args.geojson) / 1e6:.2f} MB -> {os.path.getsize(ruta_cache) / 1e3:.1f} KB)")
+
+        print(f"{'versión':<12}{'construcción (s)':>18}{'render (s)':>12}{'HTML (KB)':>12}")
+        for nombre, funcion, argumentos in (("anterior", mapa_anterior, (args.geojson,)),
+                                            ("mapa_ree", mapa_nuevo, (args.geojson, ruta_cache))):
+            construccion, render, tamano = medir(funcion, *argumentos, repeticiones=args.repeticiones)
+            print(f"{nombre:<12}{construccion:>18.4f}{render:>12.4f}{tamano / 1e3:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Micro-benchmark del parseo de respuestas de REE: parser por filas anterior (un dict por entrada + DataFrame
+# + pasadas .dt + uuid4 por fila) frente al parser columnar `parsear_respuesta` + `construir_dataframe`.
+#
+#   python benchmarks/bench_parser.py [--repeticiones 5]
+import argparse
+import copy
+import os
+import sys
+import time as tiempo
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+from ingesta_ree import COLUMNAS_INGESTA, construir_dataframe, parsear_respuesta  # noqa: E402
+
+
+# Respuesta sintética con la misma forma que la API de REE: `categorias` es una lista de
+# (título, [subcategorías] o None) y se generan `n` valores por bloque cada `paso`
+def respuesta_sintetica(categorias, inicio, n, paso):
+    def valores():
+        return [
+            {"value": 25000.0 + i % 97, "percentage": 0.5,
+             "datetime": (inicio + i * paso).strftime("%Y-%m-%dT%H:%M:%S.000+01:00")}
+            for i in range(n)
+        ]
+
+    included = []
+    for titulo, subcategorias in categorias:
+        if subcategorias:
+            contenido = [{"attributes": {"title": sub, "values": valores()}} for sub in subcategorias]
+            included.append({"attributes": {"title": titulo, "content": contenido}})
+        else:
+            included.append({"attributes": {"title": titulo, "values": valores()}})
+    return {"included": included}
+
+
+# Implementación anterior, por filas, para comparar
+def parser_por_filas(name, response_data):
+    data = []
+    for item in response_data.get("included", []):
+        attrs = item.get("attributes", {})
+        category = attrs.get("title")
+        if "content" in attrs:
+            for sub in attrs["content"]:
+                sub_attrs = sub.get("attributes", {})
+                sub_cat = sub_attrs.get("title")
+                for entry in sub_attrs.get("values", []):
+                    entry["primary_category"] = category
+                    entry["sub_category"] = sub_cat
+                    data.append(entry)
+        else:
+            for entry in attrs.get("values", []):
+                entry["primary_category"] = category
+                entry["sub_category"] = None
+                data.append(entry)
+
+    df = pd.DataFrame(data)
+    df['datetime'] = pd.to_datetime(df['datetime'], utc=True)
+    df['year'] = df['datetime'].dt.year
+    df['month'] = df['datetime'].dt.month
+    df['day'] = df['datetime'].dt.day
+    df['hour'] = df['datetime'].dt.hour
+    df['extraction_timestamp'] = datetime.utcnow()
+    df['endpoint'] = name
+    df['record_id'] = [str(uuid.uuid4()) for _ in range(len(df))]
+    return df[COLUMNAS_INGESTA]
+
+
+def parser_columnar(name, response_data):
+    return construir_dataframe(name, parsear_respuesta(response_data))
+
+
+# Solo el parseo, sin columnas de calendario ni record_id (que ahora son uuid5 deterministas)
+def solo_parseo(name, response_data):
+    return parsear_respuesta(response_data)
+
+
+def medir(funcion, name, respuesta, repeticiones):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        # El parser por filas modifica la respuesta, así que cada repetición trabaja sobre una copia
+        copia = copy.deepcopy(respuesta)
+        t0 = tiempo.perf_counter()
+        df = funcion(name, copia)
+        mejor = min(mejor, tiempo.perf_counter() - t0)
+    return len(df), mejor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark del parseo de respuestas de REE")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    inicio = datetime(2024, 1, 1)
+    casos = {
+        # Un mes de demanda horaria
+        "demanda (1 mes, horario)": ("demanda", respuesta_sintetica(
+            [("Demanda", None)], inicio, 744, timedelta(hours=1))),
+        # Un año de demanda horaria
+        "demanda (1 año, horario)": ("demanda", respuesta_sintetica(
+            [("Demanda", None)], inicio, 8784, timedelta(hours=1))),
+        # Un año de balance diario con varias categorías y subcategorías
+        "balance (1 año, diario)": ("balance", respuesta_sintetica(
+            [("Renovable", ["Hidráulica", "Eólica", "Solar fotovoltaica", "Solar térmica", "Otras renovables"]),
+             ("No-Renovable", ["Nuclear", "Ciclo combinado", "Carbón", "Cogeneración", "Residuos"]),
+             ("Almacenamiento", ["Turbinación bombeo", "Consumos bombeo", "Baterías"]),
+             ("Demanda", ["Enlace Península-Baleares", "Saldo I. internacionales", "Demanda en b.c."])],
+            inicio, 366, timedelta(days=1))),
+    }
+
+    print(f"{'caso':<28}{'filas':>8}{'por filas (filas/s)':>22}{'columnar (filas/s)':>22}{'mejora':>9}"
+          f"{'solo parseo (filas/s)':>24}")
+    for nombre, (endpoint, respuesta) in casos.items():
+        filas, t_filas = medir(parser_por_filas, endpoint, respuesta, args.repeticiones)
+        _, t_columnar = medir(parser_columnar, endpoint, respuesta, args.repeticiones)
+        _, t_parseo = medir(solo_parseo, endpoint, respuesta, args.repeticiones)
+        print(f"{nombre:<28}{filas:>8}{filas / t_filas:>22,.0f}{filas / t_columnar:>22,.0f}"
+              f"{t_filas / t_columnar:>8.1f}x{filas / t_parseo:>24,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Benchmark de los caminos de ingesta y consulta contra sustitutos locales: la API de REE la sirve `ree_stub`
+# (respuestas grabadas en fixtures/, extendidas a la ventana pedida) y Supabase `supabase_local` (SQLite).
+# Mide get_data, get_data_for_last_x_years, actualizar_datos_desde_api y get_data_from_supabase para
+# 1 mes, 1 año y 3 años, e informa de tiempo, filas/s, memoria pico (tracemalloc) y número de peticiones.
+#
+#   python benchmarks/bench_ree.py [--latencia-ree-ms 20] [--latencia-supabase-ms 5] [--rps 50] [--sin-memoria]
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time as tiempo
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+import consulta_ree  # noqa: E402
+import ingesta_ree  # noqa: E402
+from ree_stub import arrancar_stub, estadisticas_stub  # noqa: E402
+from supabase_local import SupabaseLocal  # noqa: E402
+
+TAMANOS = {"1 mes": timedelta(days=31), "1 año": timedelta(days=365), "3 años": timedelta(days=3 * 365)}
+
+
+class Banco:
+    def __init__(self, base_url, supabase_local, medir_memoria):
+        self.base_url = base_url
+        self.supabase = supabase_local
+        self.medir_memoria = medir_memoria
+        self.resultados = []
+
+    def medir(self, operacion, tamano, funcion):
+        ree_antes = estadisticas_stub(self.base_url)
+        self.supabase.reiniciar_estadisticas()
+        if self.medir_memoria:
+            tracemalloc.start()
+        t0 = tiempo.perf_counter()
+        # Las funciones de ingesta imprimen el progreso; aquí solo interesa el resultado
+        with contextlib.redirect_stdout(io.StringIO()):
+            filas = funcion()
+        transcurrido = tiempo.perf_counter() - t0
+        pico = 0
+        if self.medir_memoria:
+            pico = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        ree_despues = estadisticas_stub(self.base_url)
+        peticiones_supabase = self.supabase.estadisticas["lecturas"] + self.supabase.estadisticas["escrituras"]
+        self.resultados.append({
+            "operacion": operacion,
+            "tamano": tamano,
+            "segundos": transcurrido,
+            "filas": filas,
+            "filas_s": filas / transcurrido if transcurrido else 0,
+            "pico_mb": pico / 2 ** 20,
+            "peticiones_ree": ree_despues["peticiones"] - ree_antes["peticiones"],
+            "mb_ree": (ree_despues["bytes"] - ree_antes["bytes"]) / 2 ** 20,
+            "peticiones_supabase": peticiones_supabase,
+        })
+        r = self.resultados[-1]
+        print(f"{operacion:<34}{tamano:>8}{r['segundos']:>9.2f}{filas:>10}{r['filas_s']:>12,.0f}"
+              f"{r['pico_mb'] if self.medir_memoria else float('nan'):>10.1f}"
+              f"{r['peticiones_ree']:>9}{r['mb_ree']:>8.2f}{peticiones_supabase:>10}")
+
+
+# get_data sobre las ventanas del planificador (una petición por ventana; el stub rechaza las que superan el límite)
+def get_data_ventana(duracion):
+    fin = datetime.now().replace(second=0, microsecond=0)
+    filas = 0
+    for name, endpoint_info in ingesta_ree.ENDPOINTS.items():
+        for inicio, fin_ventana in ingesta_ree.planificar_ventanas(endpoint_info, fin - duracion, fin):
+            params = {
+                "start_date": inicio.strftime("%Y-%m-%dT%H:%M"),
+                "end_date": fin_ventana.strftime("%Y-%m-%dT%H:%M"),
+            }
+            filas += len(ingesta_ree.get_data(name, endpoint_info, params).datos)
+    return filas
+
+
+def fijar_marcas(supabase_local, duracion):
+    marca = (datetime.now(timezone.utc) - duracion).isoformat()
+    supabase_local.table("sync_estado").upsert(
+        [{"tabla": tabla, "geo": geo, "ultimo_datetime": marca, "actualizado_en": marca}
+         for tabla in ingesta_ree.ENDPOINTS for geo in ingesta_ree.ambitos_endpoint(tabla)],
+        on_conflict="tabla,geo",
+    ).execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta y consulta con sustitutos locales")
+    parser.add_argument("--latencia-ree-ms", type=float, default=20, help="latencia simulada por petición a REE")
+    parser.add_argument("--latencia-supabase-ms", type=float, default=5, help="latencia simulada por petición a Supabase")
+    parser.add_argument("--rps", type=float, default=50, help="límite de peticiones por segundo a REE durante el benchmark")
+    parser.add_argument("--workers", type=int, default=ingesta_ree.REE_MAX_WORKERS)
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--sin-memoria", action="store_true", help="no medir memoria pico (tracemalloc ralentiza)")
+    parser.add_argument("--geos", default="peninsular,canarias,baleares",
+                        help="ámbitos del backfill con varios ámbitos (separados por comas)")
+    args = parser.parse_args()
+
+    proceso, base_url = arrancar_stub(args.puerto, args.latencia_ree_ms)
+    supabase_local = SupabaseLocal(args.latencia_supabase_ms)
+    cache_dir = tempfile.mkdtemp(prefix="bench_ree_cache_")
+
+    # Redirigimos la ingesta y la consulta a los sustitutos locales
+    ingesta_ree.BASE_URL = base_url
+    ingesta_ree.limitador_ree.tasa = args.rps
+    ingesta_ree.supabase = supabase_local
+    consulta_ree.supabase = supabase_local
+    consulta_ree.CACHE_DIR = cache_dir
+
+    banco = Banco(base_url, supabase_local, not args.sin_memoria)
+    print(f"{'operación':<34}{'tamaño':>8}{'seg':>9}{'filas':>10}{'filas/s':>12}{'pico MB':>10}"
+          f"{'pet. REE':>9}{'MB REE':>8}{'pet. SB':>10}")
+    try:
+        for tamano, duracion in TAMANOS.items():
+            banco.medir("get_data (ventanas planificadas)", tamano, lambda: get_data_ventana(duracion))
+
+        for num_years, tamano in ((1, "1 año"), (3, "3 años")):
+            banco.medir("get_data_for_last_x_years", tamano,
+                        lambda: ingesta_ree.get_data_for_last_x_years(num_years, args.workers).filas_descargadas)
+
+        # Mismo backfill para varios ámbitos: las peticiones comparten hilos y límite de tasa
+        geos = [geo.strip() for geo in args.geos.split(",") if geo.strip()]
+        banco.medir(f"get_data_for_last_x_years ({len(geos)} geos)", "1 año",
+                    lambda: ingesta_ree.get_data_for_last_x_years(1, args.workers, geos).filas_descargadas)
+
+        for tamano, duracion in TAMANOS.items():
+            fijar_marcas(supabase_local, duracion)
+
+            def sincronizar():
+                ingesta_ree.actualizar_datos_desde_api(args.workers)
+                return supabase_local.estadisticas["filas_escritas"]
+
+            banco.medir("actualizar_datos_desde_api", tamano, sincronizar)
+
+        ahora = datetime.now(timezone.utc)
+        for tamano, duracion in TAMANOS.items():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            banco.medir("get_data_from_supabase (sin caché)", tamano,
+                        lambda: len(consulta_ree.get_data_from_supabase("demanda", ahora - duracion, ahora)))
+            banco.medir("get_data_from_supabase (con caché)", tamano,
+                        lambda: len(consulta_ree.get_data_from_supabase("demanda", ahora - duracion, ahora)))
+    finally:
+        proceso.terminate()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
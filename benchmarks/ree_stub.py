@@ -0,0 +1,156 @@
+# Sustituto local de la API de REE para los benchmarks. Sirve las respuestas grabadas de `fixtures/<endpoint>.json`
+# y las extiende a la ventana pedida: para cada bloque (categoría/subcategoría) se genera un valor por hora o por
+# día entre start_date y end_date, repitiendo cíclicamente los valores grabados. Como la API real, rechaza con un 400
+# los rangos mayores que LIMITES_VENTANA para el time_trunc pedido. Se ejecuta en un proceso aparte para no competir
+# por el GIL con el código medido.
+import gzip
+import json
+import os
+import sys
+import threading
+import time as tiempo
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+from ingesta_ree import ENDPOINTS  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+ZONA_REE = ZoneInfo("Europe/Madrid")
+PASOS = {"hour": timedelta(hours=1), "day": timedelta(days=1), "month": None}
+LIMITES_VENTANA = {"hour": timedelta(days=31), "day": timedelta(days=366)}
+
+
+def cargar_fixtures():
+    fixtures = {}
+    for nombre, endpoint in ENDPOINTS.items():
+        ruta = os.path.join(FIXTURES_DIR, f"{nombre}.json")
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                fixtures[endpoint.path] = json.load(f)
+    return fixtures
+
+
+def instantes(inicio, fin, time_trunc):
+    if time_trunc == "month":
+        actual = inicio.replace(day=1, hour=0, minute=0)
+        while actual <= fin:
+            yield actual
+            actual = (actual + timedelta(days=32)).replace(day=1)
+        return
+    paso = PASOS[time_trunc]
+    actual = inicio.replace(minute=0) if time_trunc == "hour" else inicio.replace(hour=0, minute=0)
+    while actual <= fin:
+        yield actual
+        actual += paso
+
+
+def formatear(instante):
+    offset = instante.replace(tzinfo=ZONA_REE).strftime("%z")
+    return f"{instante:%Y-%m-%dT%H:%M:%S}.000{offset[:3]}:{offset[3:]}"
+
+
+def extender_valores(valores, fechas):
+    return [
+        {"value": valores[i % len(valores)]["value"], "percentage": valores[i % len(valores)].get("percentage"),
+         "datetime": fecha}
+        for i, fecha in enumerate(fechas)
+    ]
+
+
+def extender(plantilla, inicio, fin, time_trunc):
+    fechas = [formatear(instante) for instante in instantes(inicio, fin, time_trunc)]
+    respuesta = json.loads(json.dumps(plantilla))
+    for item in respuesta.get("included", []):
+        attrs = item["attributes"]
+        if "content" in attrs:
+            for sub in attrs["content"]:
+                sub["attributes"]["values"] = extender_valores(sub["attributes"]["values"], fechas)
+        else:
+            attrs["values"] = extender_valores(attrs["values"], fechas)
+    return respuesta
+
+
+class ManejadorREE(BaseHTTPRequestHandler):
+    fixtures = {}
+    latencia = 0.0
+    estadisticas = {"peticiones": 0, "bytes": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def enviar(self, estado, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            datos = gzip.compress(datos, compresslevel=1)
+            cabecera_gzip = True
+        else:
+            cabecera_gzip = False
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        if cabecera_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+        return len(datos)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/__estadisticas":
+            with self.lock:
+                self.enviar(200, dict(self.estadisticas))
+            return
+
+        if self.latencia:
+            tiempo.sleep(self.latencia)
+        path = url.path.split("/es/datos/", 1)[-1]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        plantilla = self.fixtures.get(path)
+        if plantilla is None:
+            enviados = self.enviar(404, {"errors": [{"code": 404, "detail": f"Endpoint desconocido: {path}"}]})
+        else:
+            inicio = datetime.strptime(params["start_date"], "%Y-%m-%dT%H:%M")
+            fin = datetime.strptime(params["end_date"], "%Y-%m-%dT%H:%M")
+            time_trunc = params.get("time_trunc", "day")
+            limite = LIMITES_VENTANA.get(time_trunc)
+            if limite is not None and fin - inicio > limite:
+                enviados = self.enviar(400, {"errors": [{"code": 400, "detail": f"Rango demasiado grande para {time_trunc}"}]})
+            else:
+                enviados = self.enviar(200, extender(plantilla, inicio, fin, time_trunc))
+        with self.lock:
+            self.estadisticas["peticiones"] += 1
+            self.estadisticas["bytes"] += enviados
+
+
+def servir(puerto, latencia_ms):
+    ManejadorREE.fixtures = cargar_fixtures()
+    ManejadorREE.latencia = latencia_ms / 1000
+    ThreadingHTTPServer(("127.0.0.1", puerto), ManejadorREE).serve_forever()
+
+
+# Arranca el stub en otro proceso y devuelve (proceso, base_url) con el mismo formato que ingesta_ree.BASE_URL
+def arrancar_stub(puerto=8765, latencia_ms=0):
+    proceso = Process(target=servir, args=(puerto, latencia_ms), daemon=True)
+    proceso.start()
+    base = f"http://127.0.0.1:{puerto}"
+    for _ in range(100):
+        try:
+            urlopen(f"{base}/__estadisticas", timeout=1).read()
+            break
+        except OSError:
+            tiempo.sleep(0.05)
+    return proceso, f"{base}/es/datos/"
+
+
+def estadisticas_stub(base_url):
+    base = base_url.split("/es/datos/", 1)[0]
+    return json.loads(urlopen(f"{base}/__estadisticas", timeout=5).read())
@@ -0,0 +1,382 @@
+# Sustituto de Supabase respaldado por SQLite (en memoria) para los benchmarks. Implementa el subconjunto del
+# cliente de PostgREST que usan `ingesta_ree` y `consulta_ree`: select con filtros gte/gt/lte/lt/eq, or_ (con
+# and(...) anidado), order, limit y range; insert y upsert con on_conflict (con NULLS NOT DISTINCT, como el índice
+# de la clave natural; como en PostgREST, el upsert solo actualiza las columnas enviadas), delete con filtros y las
+# RPC que usan la ingesta y el dashboard. Las de particiones y rollups no hacen nada (SQLite no tiene ni unas ni
+# otros) y las agregaciones del dashboard (`Supabase_vistas`) se emulan con GROUP BY sobre la tabla de datos, así
+# que devuelven lo mismo que el servidor salvo la mediana de `estadisticas_diarias`, que aquí es la de todos los
+# valores del día. Cuenta peticiones y filas devueltas.
+import re
+import sqlite3
+import threading
+import statistics
+import time as tiempo
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+
+def normalizar_fecha(valor):
+    # PostgREST devuelve los timestamptz como "YYYY-MM-DDTHH:MM:SS+00:00"; se guardan así para poder comparar texto
+    if valor is None:
+        return None
+    fecha = datetime.fromisoformat(str(valor).replace("Z", "+00:00"))
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha.astimezone(timezone.utc).isoformat()
+
+
+COLUMNAS_FECHA = {"datetime", "ultimo_datetime", "actualizado_en", "extraction_timestamp", "detectado_en"}
+
+
+def valor_sql(columna, valor):
+    valor = valor.strip('"') if isinstance(valor, str) else valor
+    return normalizar_fecha(valor) if columna in COLUMNAS_FECHA else valor
+
+
+def dividir_nivel_superior(texto):
+    partes, profundidad, actual, en_comillas = [], 0, "", False
+    for caracter in texto:
+        if caracter == '"':
+            en_comillas = not en_comillas
+        elif not en_comillas and caracter == "(":
+            profundidad += 1
+        elif not en_comillas and caracter == ")":
+            profundidad -= 1
+        elif not en_comillas and caracter == "," and profundidad == 0:
+            partes.append(actual)
+            actual = ""
+            continue
+        actual += caracter
+    partes.append(actual)
+    return partes
+
+
+OPERADORES = {"eq": "=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "neq": "!="}
+
+
+def condicion_postgrest(texto, parametros):
+    for prefijo, union in (("and(", " AND "), ("or(", " OR ")):
+        if texto.startswith(prefijo):
+            internas = [condicion_postgrest(parte, parametros) for parte in dividir_nivel_superior(texto[len(prefijo):-1])]
+            return "(" + union.join(internas) + ")"
+    columna, operador, valor = re.match(r"^([^.]+)\.([a-z]+)\.(.*)$", texto).groups()
+    parametros.append(valor_sql(columna, valor))
+    return f'"{columna}" {OPERADORES[operador]} ?'
+
+
+class Respuesta:
+    def __init__(self, data):
+        self.data = data
+
+
+class LlamadaSinEfecto:
+    def execute(self):
+        return Respuesta(None)
+
+
+class LlamadaRpc:
+    def __init__(self, cliente, funcion, params):
+        self.cliente = cliente
+        self.funcion = funcion
+        self.params = params
+
+    def execute(self):
+        return self.cliente._ejecutar_rpc(self.funcion, self.params)
+
+
+# Partes de una fecha (texto ISO en UTC, como se guardan) en hora peninsular, como agrupan los rollups del servidor;
+# se registran como funciones de SQLite para las agregaciones
+ZONA_ROLLUPS = ZoneInfo("Europe/Madrid")
+
+
+def local(valor):
+    return datetime.fromisoformat(valor).astimezone(ZONA_ROLLUPS)
+
+
+def dia_local(valor):
+    return local(valor).date().isoformat()
+
+
+def dia_semana_local(valor):
+    return local(valor).isoweekday()
+
+
+def hora_local(valor):
+    return local(valor).hour
+
+
+class Mediana:
+    def __init__(self):
+        self.valores = []
+
+    def step(self, valor):
+        if valor is not None:
+            self.valores.append(valor)
+
+    def finalize(self):
+        return statistics.median(self.valores) if self.valores else None
+
+
+# Tablas de control con sus columnas y clave, como en `Supabase_schema`: se crean de antemano porque la primera
+# escritura no siempre lleva todas las columnas (p. ej. `sync_estado` sin `ultimo_datetime`) y las tablas de datos
+# se crean con las columnas del primer upsert
+TABLAS_DECLARADAS = {
+    "sync_estado": (["tabla", "geo", "ultimo_datetime", "actualizado_en"], "tabla,geo"),
+    "sync_meses": (["tabla", "geo", "mes", "actualizado_en"], "tabla,geo,mes"),
+    "anomalias": (["tabla", "geo", "datetime", "primary_category", "sub_category", "value", "esperado",
+                   "puntuacion_iqr", "puntuacion_z", "puntuacion_residuo", "metodos", "sentido", "detectado_en"],
+                  "tabla,geo,datetime,primary_category,sub_category"),
+}
+
+
+class ErrorPostgrest(Exception):
+    pass
+
+
+# Primer día del periodo de cada resolución de `serie_rollup`, a partir del día ("YYYY-MM-DD")
+INICIO_PERIODO = {"dia": "{dia}", "mes": "substr({dia}, 1, 7) || '-01'", "anio": "substr({dia}, 1, 4) || '-01-01'"}
+
+
+class Consulta:
+    def __init__(self, cliente, tabla):
+        self.cliente = cliente
+        self.tabla = tabla
+        self.columnas = "*"
+        self.condiciones = []
+        self.parametros = []
+        self.orden = []
+        self.limite = None
+        self.desplazamiento = None
+        self.escritura = None
+        self.borrado = False
+
+    # --- lectura ---
+    def select(self, columnas="*"):
+        self.columnas = columnas
+        return self
+
+    def _filtro(self, columna, operador, valor):
+        self.condiciones.append(f'"{columna}" {OPERADORES[operador]} ?')
+        self.parametros.append(valor_sql(columna, valor))
+        return self
+
+    def eq(self, columna, valor):
+        return self._filtro(columna, "eq", valor)
+
+    def gt(self, columna, valor):
+        return self._filtro(columna, "gt", valor)
+
+    def gte(self, columna, valor):
+        return self._filtro(columna, "gte", valor)
+
+    def lt(self, columna, valor):
+        return self._filtro(columna, "lt", valor)
+
+    def lte(self, columna, valor):
+        return self._filtro(columna, "lte", valor)
+
+    def or_(self, filtros):
+        self.condiciones.append(condicion_postgrest(f"or({filtros})", self.parametros))
+        return self
+
+    def order(self, columna, desc=False):
+        self.orden.append(f'"{columna}" {"DESC" if desc else "ASC"}')
+        return self
+
+    def limit(self, n):
+        self.limite = n
+        return self
+
+    def range(self, inicio, fin):
+        self.desplazamiento, self.limite = inicio, fin - inicio + 1
+        return self
+
+    # --- escritura ---
+    def insert(self, filas):
+        self.escritura = (filas if isinstance(filas, list) else [filas], None)
+        return self
+
+    def upsert(self, filas, on_conflict=None):
+        self.escritura = (filas if isinstance(filas, list) else [filas], on_conflict)
+        return self
+
+    def delete(self):
+        self.borrado = True
+        return self
+
+    def execute(self):
+        return self.cliente._ejecutar(self)
+
+
+class SupabaseLocal:
+    def __init__(self, latencia_ms=0):
+        self.conexion = sqlite3.connect(":memory:", check_same_thread=False)
+        self.lock = threading.Lock()
+        self.latencia = latencia_ms / 1000
+        self.columnas_tabla = {}
+        self.estadisticas = {"lecturas": 0, "escrituras": 0, "filas_leidas": 0, "filas_escritas": 0}
+        self.conexion.create_function("dia", 1, dia_local, deterministic=True)
+        self.conexion.create_function("dia_semana", 1, dia_semana_local, deterministic=True)
+        self.conexion.create_function("hora", 1, hora_local, deterministic=True)
+        self.conexion.create_aggregate("mediana", 1, Mediana)
+        self.rpcs = {
+            "demanda_media_dia_hora": self._demanda_media_dia_hora,
+            "estadisticas_diarias": self._estadisticas_diarias,
+            "saldo_intercambios": self._saldo_intercambios,
+            "serie_rollup": self._serie_rollup,
+        }
+        for tabla, (columnas, on_conflict) in TABLAS_DECLARADAS.items():
+            self._asegurar_tabla(tabla, columnas, on_conflict)
+
+    def table(self, nombre):
+        return Consulta(self, nombre)
+
+    def rpc(self, nombre, params):
+        # Las tablas de SQLite no están particionadas ni tienen rollups (su coste queda fuera de la medida)
+        if nombre in ("crear_particiones_mensuales", "refrescar_rollups"):
+            return LlamadaSinEfecto()
+        return LlamadaRpc(self, self.rpcs[nombre], params)
+
+    def reiniciar_estadisticas(self):
+        self.estadisticas = dict.fromkeys(self.estadisticas, 0)
+
+    @staticmethod
+    def _expresiones_clave(on_conflict):
+        return ", ".join(f'ifnull("{c.strip()}", char(0))' for c in on_conflict.split(","))
+
+    def _asegurar_tabla(self, tabla, columnas, on_conflict):
+        existentes = self.columnas_tabla.setdefault(tabla, [])
+        if not existentes:
+            definicion = ", ".join(f'"{c}"' for c in columnas)
+            self.conexion.execute(f'CREATE TABLE IF NOT EXISTS "{tabla}" ({definicion})')
+            existentes.extend(columnas)
+        for columna in columnas:
+            if columna not in existentes:
+                self.conexion.execute(f'ALTER TABLE "{tabla}" ADD COLUMN "{columna}"')
+                existentes.append(columna)
+        if on_conflict:
+            claves = [c.strip() for c in on_conflict.split(",")]
+            nombre_indice = f"{tabla}_{'_'.join(claves)}_uk"
+            self.conexion.execute(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS "{nombre_indice}" ON "{tabla}" ({self._expresiones_clave(on_conflict)})')
+        if "datetime" in existentes:
+            self.conexion.execute(f'CREATE INDEX IF NOT EXISTS "{tabla}_datetime_idx" ON "{tabla}" ("datetime")')
+
+    def _ejecutar(self, consulta):
+        if self.latencia:
+            tiempo.sleep(self.latencia)
+        with self.lock:
+            if consulta.borrado:
+                return self._borrar(consulta)
+            if consulta.escritura is not None:
+                return self._escribir(consulta)
+            return self._leer(consulta)
+
+    def _ejecutar_rpc(self, funcion, params):
+        if self.latencia:
+            tiempo.sleep(self.latencia)
+        with self.lock:
+            self.estadisticas["lecturas"] += 1
+            filas = funcion(**params)
+            self.estadisticas["filas_leidas"] += len(filas)
+            return Respuesta(filas)
+
+    # Filas de una consulta de agregación sobre `tabla` en [desde, hasta] y un ámbito, como lista de diccionarios.
+    # `sql` lleva "{tabla}" y "{rango}" (las condiciones de ámbito y fechas). Sin datos, la tabla aún no existe.
+    def _agregar(self, sql, tabla, desde, hasta, geo, *parametros):
+        if tabla not in self.columnas_tabla:
+            return []
+        rango = '"geo" = ? AND "datetime" >= ? AND "datetime" <= ?'
+        cursor = self.conexion.execute(sql.format(tabla=tabla, rango=rango),
+                                       [geo, normalizar_fecha(desde), normalizar_fecha(hasta), *parametros])
+        nombres = [d[0] for d in cursor.description]
+        return [dict(zip(nombres, fila)) for fila in cursor.fetchall()]
+
+    def _demanda_media_dia_hora(self, desde, hasta, geo="peninsular"):
+        return self._agregar(
+            'SELECT dia_semana("datetime") AS dia_semana, hora("datetime") AS hora, avg("value") AS media '
+            'FROM "{tabla}" WHERE {rango} GROUP BY 1, 2 ORDER BY 1, 2', "demanda", desde, hasta, geo)
+
+    def _estadisticas_diarias(self, tabla, desde, hasta, geo="peninsular"):
+        return self._agregar(
+            'SELECT dia("datetime") AS fecha, avg("value") AS media, mediana("value") AS mediana, '
+            'min("value") AS minimo, max("value") AS maximo FROM "{tabla}" WHERE {rango} GROUP BY 1 ORDER BY 1',
+            tabla, desde, hasta, geo)
+
+    def _saldo_intercambios(self, desde, hasta, geo="peninsular"):
+        return self._agregar(
+            'SELECT "primary_category" AS pais, sum("value") AS saldo FROM "{tabla}" '
+            'WHERE {rango} AND "sub_category" = ? GROUP BY 1 ORDER BY 1', "intercambios", desde, hasta, geo, "saldo")
+
+    # Como en el servidor, cada periodo que se solapa con [desde, hasta] se agrega completo
+    def _serie_rollup(self, tabla, resolucion, desde, hasta, geo="peninsular"):
+        periodo = INICIO_PERIODO[resolucion].format(dia='dia("datetime")')
+        inicio = self.conexion.execute(f"SELECT {INICIO_PERIODO[resolucion].format(dia='?')}",
+                                       [dia_local(normalizar_fecha(desde))]).fetchone()[0]
+        if tabla not in self.columnas_tabla:
+            return []
+        cursor = self.conexion.execute(
+            f'SELECT {periodo} AS periodo, "primary_category", "sub_category", sum("value") AS suma, '
+            f'avg("value") AS media, min("value") AS minimo, max("value") AS maximo FROM "{tabla}" '
+            f'WHERE "geo" = ? AND "datetime" >= ? AND dia("datetime") >= ? AND dia("datetime") <= ? '
+            f'GROUP BY 1, 2, 3 ORDER BY 1, 2, 3',
+            # La primera condición solo acota la lectura por el índice: el día local empieza como pronto a las 22:00 UTC
+            # del día anterior
+            [geo, (date.fromisoformat(inicio) - timedelta(days=1)).isoformat(), inicio,
+             dia_local(normalizar_fecha(hasta))])
+        nombres = [d[0] for d in cursor.description]
+        return [dict(zip(nombres, fila)) for fila in cursor.fetchall()]
+
+    def _escribir(self, consulta):
+        filas, on_conflict = consulta.escritura
+        if not filas:
+            return Respuesta([])
+        columnas = list(dict.fromkeys(c for fila in filas for c in fila))
+        self._asegurar_tabla(consulta.tabla, columnas, on_conflict)
+        marcadores = ", ".join("?" for _ in columnas)
+        sql = f'INSERT INTO "{consulta.tabla}" ({", ".join(chr(34) + c + chr(34) for c in columnas)}) VALUES ({marcadores})'
+        if on_conflict:
+            claves = {c.strip() for c in on_conflict.split(",")}
+            actualizadas = [c for c in columnas if c not in claves]
+            sql += f" ON CONFLICT ({self._expresiones_clave(on_conflict)}) " + (
+                "DO UPDATE SET " + ", ".join(f'"{c}" = excluded."{c}"' for c in actualizadas)
+                if actualizadas else "DO NOTHING")
+        self.conexion.executemany(sql, [[valor_sql(c, fila.get(c)) for c in columnas] for fila in filas])
+        self.estadisticas["escrituras"] += 1
+        self.estadisticas["filas_escritas"] += len(filas)
+        return Respuesta(filas)
+
+    def _borrar(self, consulta):
+        self.estadisticas["escrituras"] += 1
+        if consulta.tabla not in self.columnas_tabla:
+            return Respuesta([])
+        sql = f'DELETE FROM "{consulta.tabla}"'
+        if consulta.condiciones:
+            sql += " WHERE " + " AND ".join(consulta.condiciones)
+        self.conexion.execute(sql, consulta.parametros)
+        return Respuesta([])
+
+    def _leer(self, consulta):
+        self.estadisticas["lecturas"] += 1
+        if consulta.tabla not in self.columnas_tabla:
+            return Respuesta([])
+        columnas = [c.strip() for c in consulta.columnas.split(",")]
+        # Como PostgREST, una columna que no existe es un error (SQLite tomaría "columna" por un literal de texto)
+        desconocidas = [c for c in columnas if c != "*" and c not in self.columnas_tabla[consulta.tabla]]
+        if desconocidas:
+            raise ErrorPostgrest(f"column {consulta.tabla}.{desconocidas[0]} does not exist")
+        seleccion = "*" if columnas == ["*"] else ", ".join(f'"{c}"' for c in columnas)
+        sql = f'SELECT {seleccion} FROM "{consulta.tabla}"'
+        if consulta.condiciones:
+            sql += " WHERE " + " AND ".join(consulta.condiciones)
+        if consulta.orden:
+            sql += " ORDER BY " + ", ".join(consulta.orden)
+        if consulta.limite is not None:
+            sql += f" LIMIT {consulta.limite}"
+            if consulta.desplazamiento:
+                sql += f" OFFSET {consulta.desplazamiento}"
+        cursor = self.conexion.execute(sql, consulta.parametros)
+        nombres = [d[0] for d in cursor.description]
+        filas = [dict(zip(nombres, fila)) for fila in cursor.fetchall()]
+        self.estadisticas["filas_leidas"] += len(filas)
+        return Respuesta(filas)
@@ -0,0 +1,267 @@
+import pandas as pd
+from datetime import timedelta
+import threading
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Capa de consulta del dashboard: lectura de Supabase (paginada y en paralelo), funciones de agregación del
+# servidor y caché local en disco. No depende de Streamlit, así que también la usan los benchmarks.
+from ingesta_ree import supabase, ENDPOINTS, GEO_PREDETERMINADO
+import anomalias_ree as anomalias
+
+# Caché local en disco (Arrow IPC, una partición por tabla, ámbito geográfico y mes) delante de get_data_from_supabase.
+# Un mes se considera cerrado (y por tanto cacheable) cuando han pasado CACHE_DIAS_CIERRE días desde su final,
+# para dar margen a que REE revise los últimos datos. Cada partición guarda la versión del mes en `sync_meses`
+# (última escritura del worker) y se descarta si ha cambiado, así que un mes leído a medias no se queda así.
+CACHE_DIR = os.getenv("REE_CACHE_DIR", ".cache_ree")
+CACHE_DIAS_CIERRE = int(os.getenv("REE_CACHE_DIAS_CIERRE", "3"))
+
+# Lectura de Supabase: número de subrangos (meses) descargados en paralelo
+SUPABASE_MAX_WORKERS_LECTURA = int(os.getenv("SUPABASE_MAX_WORKERS_LECTURA", "4"))
+
+# Resoluciones de los rollups (ver `serie_rollup` en `Supabase_vistas`) con la duración aproximada de su periodo en
+# días, y número máximo de periodos por categoría que se piden para una gráfica
+RESOLUCIONES_ROLLUP = {"dia": 1, "mes": 30.44, "anio": 365.25}
+ROLLUP_MAX_PERIODOS = int(os.getenv("ROLLUP_MAX_PERIODOS", "400"))
+
+# Columnas que se piden a Supabase por tabla, según el registro de endpoints (record_id hace falta para paginar;
+# year/month/day/hour se derivan localmente de datetime)
+COLUMNAS_CONSULTA = {
+    endpoint.tabla: ",".join(("record_id",) + endpoint.columnas) for endpoint in ENDPOINTS.values()
+}
+
+# ------------------------------ CONSULTA SUPABASE ------------------------------
+
+# Función que descarga un subrango [start_iso, end_iso) con paginación por clave (keyset) sobre (datetime, record_id):
+# cada página continúa a partir de la última fila recibida, así que su coste no crece con el número de páginas
+# como ocurre con offset/limit. Solo se leen las filas del ámbito geográfico `geo`.
+def descargar_subrango_supabase(table_name, start_iso, end_iso, page_size=1000, geo=GEO_PREDETERMINADO):
+    columnas = COLUMNAS_CONSULTA.get(table_name, "*")
+    all_data = []
+    ultimo = None
+    while True:
+        query = (
+            supabase.table(table_name)
+            .select(columnas)
+            .eq("geo", geo)
+            .gte("datetime", start_iso)
+            .lt("datetime", end_iso)
+        )
+        if ultimo is not None:
+            ultimo_dt, ultimo_id = ultimo
+            query = query.or_(f'datetime.gt."{ultimo_dt}",and(datetime.eq."{ultimo_dt}",record_id.gt.{ultimo_id})')
+        response = query.order("datetime").order("record_id").limit(page_size).execute()
+
+        data = response.data
+        if not data:
+            break
+        all_data.extend(data)
+        if len(data) < page_size:
+            break
+        ultimo = (data[-1]["datetime"], data[-1]["record_id"])
+    return all_data
+
+# Función que descarga de Supabase las filas de una tabla con datetime en [start_iso, end_iso). El rango se divide
+# en meses que se descargan en paralelo, de modo que las cargas de varios años escalan con el número de hilos.
+def descargar_de_supabase(table_name, start_iso, end_iso, page_size=1000, max_workers=SUPABASE_MAX_WORKERS_LECTURA,
+                          geo=GEO_PREDETERMINADO):
+    inicio, fin = pd.Timestamp(start_iso), pd.Timestamp(end_iso)
+    cortes = [inicio, *(mes for mes in pd.date_range(inicio, fin, freq="MS") if inicio < mes < fin), fin]
+    subrangos = list(zip(cortes[:-1], cortes[1:]))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(subrangos)))) as executor:
+        partes = list(executor.map(
+            lambda rango: descargar_subrango_supabase(table_name, rango[0].isoformat(), rango[1].isoformat(), page_size,
+                                                      geo),
+            subrangos,
+        ))
+
+    all_data = [fila for parte in partes for fila in parte]
+    if not all_data:
+        return pd.DataFrame()
+    df = pd.DataFrame(all_data)
+    df["datetime"] = pd.to_datetime(df["datetime"], utc=True)
+    return df
+
+# Función que llama a una función de agregación del servidor (ver `Supabase_vistas`) y devuelve un DataFrame.
+# El rango [start_date, end_date + 1 día] es el mismo que usa get_data_from_supabase.
+def consultar_agregado(nombre_rpc, start_date, end_date, **params):
+    params["desde"] = start_date.isoformat()
+    params["hasta"] = (end_date + timedelta(days=1)).isoformat()
+    response = supabase.rpc(nombre_rpc, params).execute()
+    return pd.DataFrame(response.data or [])
+
+# Función que lee las anomalías que guarda el worker de ingesta (tabla `anomalias`, ver `anomalias_ree.py`) de una
+# tabla y ámbito en el mismo rango que get_data_from_supabase. Son pocas filas, así que se pagina por desplazamiento.
+def consultar_anomalias(table_name, start_date, end_date, geo=GEO_PREDETERMINADO, page_size=1000):
+    filas = []
+    while True:
+        data = (
+            supabase.table(anomalias.TABLA_ANOMALIAS)
+            .select(",".join(anomalias.COLUMNAS_ANOMALIAS))
+            .eq("tabla", table_name)
+            .eq("geo", geo)
+            .gte("datetime", start_date.isoformat())
+            .lt("datetime", (end_date + timedelta(days=1)).isoformat())
+            .order("datetime").order("primary_category").order("sub_category")
+            .range(len(filas), len(filas) + page_size - 1)
+            .execute().data
+        )
+        filas.extend(data)
+        if len(data) < page_size:
+            break
+    df = pd.DataFrame(filas, columns=anomalias.COLUMNAS_ANOMALIAS)
+    df["datetime"] = pd.to_datetime(df["datetime"], utc=True)
+    return df
+
+# Función que elige la resolución del rollup para un rango: la más fina que no pase de `max_periodos` periodos, de
+# modo que un año se ve por días y tres años por meses
+def resolucion_rollup(start_date, end_date, max_periodos=ROLLUP_MAX_PERIODOS):
+    dias = (end_date - start_date).total_seconds() / 86400
+    for resolucion, duracion in RESOLUCIONES_ROLLUP.items():
+        if dias / duracion <= max_periodos:
+            return resolucion
+    return "anio"
+
+# Función que devuelve la "versión" de los datos de una tabla y ámbito: la fecha de la última escritura del worker de
+# ingesta en `sync_estado`. Sirve para invalidar las cachés de consultas cuando llegan datos nuevos.
+def version_datos(table_name, geo=GEO_PREDETERMINADO):
+    response = (supabase.table("sync_estado").select("actualizado_en")
+                .eq("tabla", table_name).eq("geo", geo).execute())
+    return response.data[0]["actualizado_en"] if response.data else None
+
+# Función que devuelve la versión de cada mes (UTC) de una tabla y ámbito según `sync_meses`, como {"YYYY-MM":
+# actualizado_en}. Los meses sin escrituras registradas no aparecen. None si no se puede leer: sin versiones no se
+# usa la caché de disco.
+def versiones_meses(table_name, geo=GEO_PREDETERMINADO):
+    try:
+        response = (supabase.table("sync_meses").select("mes,actualizado_en")
+                    .eq("tabla", table_name).eq("geo", geo).execute())
+    except Exception as e:
+        print(f"⚠️ No se pudieron leer las versiones de '{table_name}' [{geo}], no se usa la caché de disco: {e}")
+        return None
+    return {str(fila["mes"])[:7]: str(fila["actualizado_en"]) for fila in response.data}
+
+# ------------------------------ FORMATO COMPACTO ------------------------------
+
+# Columnas que se descartan del DataFrame de consulta: record_id solo hace falta para paginar en Supabase y
+# year/month/day/hour (o extraction_timestamp, en particiones antiguas) se derivan de datetime cuando se necesitan
+COLUMNAS_DESCARTADAS = ["record_id", "extraction_timestamp", "year", "month", "day", "hour"]
+
+# Función que deja el DataFrame de consulta en formato compacto: categorías como `category` (unas pocas decenas
+# de valores distintos repetidos en cada fila) y valores numéricos en float32 (unas 7 cifras significativas, de sobra
+# para las gráficas; los agregados se calculan en el servidor). Es el formato que se guarda en la caché de disco y
+# el que mantiene el dashboard en memoria.
+def compactar_frame(df):
+    df = df.drop(columns=COLUMNAS_DESCARTADAS, errors="ignore")
+    for columna in ("primary_category", "sub_category"):
+        if columna in df.columns:
+            df[columna] = df[columna].astype("category")
+    for columna in ("value", "percentage"):
+        if columna in df.columns:
+            df[columna] = pd.to_numeric(df[columna]).astype("float32")
+    return df
+
+# ------------------------------ CACHÉ LOCAL ------------------------------
+
+def a_utc(fecha):
+    fecha = pd.Timestamp(fecha)
+    return fecha.tz_convert("UTC") if fecha.tzinfo else fecha.tz_localize("UTC")
+
+def ruta_particion(table_name, mes_inicio, geo=GEO_PREDETERMINADO):
+    return os.path.join(CACHE_DIR, table_name, geo, f"{mes_inicio:%Y-%m}.arrow")
+
+# Función que indica si un mes (en UTC) ya no va a recibir datos nuevos y se puede guardar en disco
+def mes_cerrado(mes_inicio):
+    mes_fin = mes_inicio + pd.offsets.MonthBegin(1)
+    return mes_fin + timedelta(days=CACHE_DIAS_CIERRE) < pd.Timestamp.now(tz="UTC")
+
+# Clave de los metadatos de la partición con la versión del mes ("" si no tiene escrituras registradas)
+CLAVE_VERSION = b"version_mes"
+
+# Guardamos en un fichero temporal y lo renombramos, para que otra sesión nunca lea una partición a medias. Un mes
+# cerrado sin filas se guarda igualmente (partición vacía), para no volver a pedirlo en cada lectura.
+def guardar_particion(table_name, mes_inicio, df_mes, version, geo=GEO_PREDETERMINADO):
+    ruta = ruta_particion(table_name, mes_inicio, geo)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    tabla = pa.Table.from_pandas(df_mes.reset_index(drop=True), preserve_index=False)
+    tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), CLAVE_VERSION: version.encode()})
+    feather.write_feather(tabla, temporal, compression="uncompressed")
+    os.replace(temporal, ruta)
+
+# Las particiones se guardan sin comprimir para poder leerlas mapeando el fichero en memoria. Devuelve None si no
+# existe, está corrupta o su versión no es `version` (el worker ha escrito en ese mes desde que se guardó).
+def leer_particion(table_name, mes_inicio, version, geo=GEO_PREDETERMINADO):
+    ruta = ruta_particion(table_name, mes_inicio, geo)
+    if not os.path.exists(ruta):
+        return None
+    try:
+        tabla = feather.read_table(ruta, memory_map=True)
+    except Exception as e:
+        print(f"⚠️ Partición de caché corrupta '{ruta}', se vuelve a descargar: {e}")
+        return None
+    if (tabla.schema.metadata or {}).get(CLAVE_VERSION) != version.encode():
+        return None
+    return tabla.to_pandas()
+
+# Función de consulta con caché: los meses cerrados que ya están en disco con su versión actual se leen localmente y
+# solo se piden a Supabase los meses que faltan, que han cambiado o que siguen abiertos (agrupados en rangos
+# contiguos, una consulta por rango).
+def get_data_from_supabase(table_name, start_date, end_date, page_size=1000, geo=GEO_PREDETERMINADO):
+    end_date += timedelta(days=1)
+    inicio = a_utc(start_date)
+    fin = a_utc(end_date)
+
+    meses = pd.date_range(inicio.normalize().replace(day=1), fin, freq="MS", tz="UTC")
+    # Las versiones se leen antes de descargar: si el worker escribe entretanto, la partición se guarda con la
+    # versión anterior y se descarta en la siguiente lectura
+    versiones = versiones_meses(table_name, geo) if any(mes_cerrado(mes) for mes in meses) else None
+    partes = []
+    pendientes = []
+    for mes_inicio in meses:
+        df_mes = None
+        if versiones is not None and mes_cerrado(mes_inicio):
+            df_mes = leer_particion(table_name, mes_inicio, versiones.get(f"{mes_inicio:%Y-%m}", ""), geo)
+        if df_mes is None:
+            pendientes.append(mes_inicio)
+        elif not df_mes.empty:
+            partes.append(df_mes)
+
+    # Agrupamos los meses pendientes consecutivos para descargarlos en una sola consulta
+    rangos = []
+    for mes_inicio in pendientes:
+        if rangos and rangos[-1][1] == mes_inicio:
+            rangos[-1][1] = mes_inicio + pd.offsets.MonthBegin(1)
+        else:
+            rangos.append([mes_inicio, mes_inicio + pd.offsets.MonthBegin(1)])
+
+    for rango_inicio, rango_fin in rangos:
+        df_rango = descargar_de_supabase(table_name, rango_inicio.isoformat(), rango_fin.isoformat(), page_size,
+                                         geo=geo)
+        if df_rango.empty:
+            df_rango = pd.DataFrame({"datetime": pd.Series([], dtype="datetime64[ns, UTC]")})
+        else:
+            df_rango = compactar_frame(df_rango)
+            partes.append(df_rango)
+        if versiones is None:
+            continue
+        # Guardamos en disco los meses cerrados del rango descargado, también los que no tienen filas
+        for mes_inicio in pd.date_range(rango_inicio, rango_fin, freq="MS", inclusive="left"):
+            if not mes_cerrado(mes_inicio):
+                continue
+            df_mes = df_rango[(df_rango["datetime"] >= mes_inicio)
+                              & (df_rango["datetime"] < mes_inicio + pd.offsets.MonthBegin(1))]
+            try:
+                guardar_particion(table_name, mes_inicio, df_mes, versiones.get(f"{mes_inicio:%Y-%m}", ""), geo)
+            except Exception as e:
+                print(f"⚠️ No se pudo guardar en caché '{table_name}' {mes_inicio:%Y-%m}: {e}")
+
+    if not partes:
+        return pd.DataFrame()
+    # Al concatenar meses con categorías distintas se pierde el tipo `category`, así que se vuelve a compactar.
+    # Las columnas de calendario no se incluyen: quien las necesite las deriva de datetime (`.dt.year`, ...).
+    df = compactar_frame(pd.concat(partes, ignore_index=True))
+    return df[(df["datetime"] >= inicio) & (df["datetime"] <= fin)].sort_values("datetime", ignore_index=True)
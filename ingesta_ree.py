@@ -0,0 +1,1038 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from supabase import create_client, Client
+import schedule
+import threading
+import time as tiempo
+import uuid
+import hashlib
+import random
+import argparse
+import queue
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import anomalias_ree as anomalias
+import metricas_ree as metricas
+
+# Cargar las variables de entorno desde el archivo .env
+load_dotenv()
+
+# Constantes de configuración de la API REE
+BASE_URL = "https://apidatos.ree.es/es/datos/"
+
+HEADERS = {
+    "accept": "application/json",
+    "accept-encoding": "gzip, deflate",
+    "content-type": "application/json"
+}
+
+# Ámbitos geográficos (sistemas eléctricos) que se pueden ingerir, con sus parámetros de la API de REE. Sin
+# parámetros geográficos la API devuelve el total nacional. Cada dato se guarda con su ámbito en la columna `geo`,
+# que forma parte de la clave natural.
+AMBITOS_GEO = {
+    "nacional": {},
+    "peninsular": {"geo_trunc": "electric_system", "geo_limit": "peninsular", "geo_ids": "8741"},
+    "canarias": {"geo_trunc": "electric_system", "geo_limit": "canarias", "geo_ids": "8742"},
+    "baleares": {"geo_trunc": "electric_system", "geo_limit": "baleares", "geo_ids": "8743"},
+    "ceuta": {"geo_trunc": "electric_system", "geo_limit": "ceuta", "geo_ids": "8744"},
+    "melilla": {"geo_trunc": "electric_system", "geo_limit": "melilla", "geo_ids": "8745"},
+}
+# Ámbito de los datos anteriores a la columna `geo` y el que consulta el dashboard por defecto
+GEO_PREDETERMINADO = "peninsular"
+# Ámbitos que ingiere el worker (separados por comas); todas las peticiones comparten el mismo límite de tasa
+INGESTA_GEOS = [geo.strip() for geo in os.getenv("INGESTA_GEOS", GEO_PREDETERMINADO).split(",") if geo.strip()]
+
+# La API de REE interpreta start_date/end_date en hora peninsular
+ZONA_REE = ZoneInfo("Europe/Madrid")
+
+# Días hacia atrás que descarga la sincronización incremental para una tabla que aún no tiene marca de agua
+SYNC_DIAS_SIN_MARCA = int(os.getenv("SYNC_DIAS_SIN_MARCA", "7"))
+
+COLUMNAS_INGESTA = ['record_id', 'value', 'percentage', 'datetime', 'geo',
+                    'primary_category', 'sub_category', 'endpoint', 'extraction_timestamp']
+
+# Clave natural de las tablas de datos (índice único NULLS NOT DISTINCT, ver `Supabase_schema`): destino del upsert
+CLAVE_NATURAL = "datetime,geo,primary_category,sub_category"
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# Escritura en Supabase: tamaño de cada lote de upsert y número de lotes enviados en paralelo
+SUPABASE_TAM_LOTE = int(os.getenv("SUPABASE_TAM_LOTE", "500"))
+SUPABASE_MAX_WORKERS = int(os.getenv("SUPABASE_MAX_WORKERS", "4"))
+
+# Espacio de nombres de los record_id deterministas (uuid5). No cambiarlo: la migración SQL usa el mismo valor.
+NAMESPACE_REGISTROS = uuid.UUID("ca4b65d9-ae52-5ea7-9270-418ec95b751f")
+
+# Límite de peticiones a la API de REE (compartido por todos los hilos) y número de hilos del backfill
+REE_PETICIONES_POR_SEGUNDO = float(os.getenv("REE_PETICIONES_POR_SEGUNDO", "2"))
+REE_RAFAGA = int(os.getenv("REE_RAFAGA", "4"))
+REE_MAX_WORKERS = int(os.getenv("REE_MAX_WORKERS", "4"))
+
+# Tamaño de las colas entre las etapas del motor de descarga (ventanas descargadas pendientes de validar o escribir)
+INGESTA_COLA_MAX = int(os.getenv("INGESTA_COLA_MAX", "8"))
+
+# Reintentos ante 429/5xx o errores de red, con espera exponencial (en segundos) y jitter
+REE_MAX_REINTENTOS = int(os.getenv("REE_MAX_REINTENTOS", "5"))
+REE_BACKOFF_BASE = float(os.getenv("REE_BACKOFF_BASE", "1"))
+REE_BACKOFF_MAX = float(os.getenv("REE_BACKOFF_MAX", "60"))
+
+# Tamaño máximo (MB) de las respuestas que guarda la caché de validadores para responder a los 304; al superarlo se
+# descartan las menos usadas y una respuesta que por sí sola no cabe no se guarda
+REE_VALIDADORES_MB = float(os.getenv("REE_VALIDADORES_MB", "32"))
+
+# Timeout (conexión, lectura) de las peticiones a REE; los endpoints horarios declaran uno mayor en el registro
+TIMEOUT_REE_DEFECTO = (5, 30)
+TIMEOUT_REE_HORARIO = (5, 90)
+
+# Tamaño máximo de cada petición a REE según el time_trunc del endpoint, en meses naturales: la API limita el rango
+# de cada consulta según la granularidad (en torno a un mes de datos horarios y un año de datos diarios). Si aun así
+# rechaza o trunca una respuesta, la ventana se divide o se completa (ver `descargar_ventana`) hasta VENTANA_MINIMA.
+VENTANA_MESES = {"hour": 1, "day": 12, "month": 120, "year": 120}
+VENTANA_MINIMA = {"hour": timedelta(days=1), "day": timedelta(days=31), "month": timedelta(days=366),
+                  "year": timedelta(days=366)}
+
+# ------------------------------ REGISTRO DE ENDPOINTS ------------------------------
+
+# Formas de respuesta que sabe leer `parsear_respuesta` (ver EXTRACTORES_BLOQUES):
+#   - "plana": cada elemento de `included` es una categoría con su lista de valores
+#   - "anidada": cada categoría tiene subcategorías en `content`, cada una con su lista de valores
+ESTRUCTURAS = ("plana", "anidada")
+
+# Columnas de datos que lee el dashboard según la estructura (las tablas tienen todas la misma definición)
+COLUMNAS_PLANAS = ("value", "percentage", "datetime", "primary_category")
+COLUMNAS_ANIDADAS = COLUMNAS_PLANAS + ("sub_category",)
+
+# Definición declarativa de un endpoint de REE: de dónde y cómo se descarga (path, granularidad, ámbitos admitidos
+# y timeout), cómo se parsea (estructura de la respuesta) y dónde y cómo se escribe (tabla, columnas y clave del
+# upsert). Añadir un feed es añadir su entrada a ENDPOINTS y su tabla a `Supabase_schema`; la descarga, el parseo
+# columnar y la escritura por lotes son los mismos para todos.
+@dataclass(frozen=True)
+class Endpoint:
+    path: str
+    time_trunc: str
+    tabla: str
+    estructura: str = "plana"
+    columnas: tuple = COLUMNAS_PLANAS
+    clave: str = CLAVE_NATURAL
+    geos: tuple = None  # ámbitos para los que existe el endpoint (None = todos)
+    timeout: tuple = TIMEOUT_REE_DEFECTO
+
+    def __post_init__(self):
+        if self.estructura not in ESTRUCTURAS:
+            raise ValueError(f"Estructura desconocida '{self.estructura}' en '{self.path}' (válidas: {ESTRUCTURAS})")
+        if self.time_trunc not in VENTANA_MESES:
+            raise ValueError(f"time_trunc desconocido '{self.time_trunc}' en '{self.path}'")
+
+ENDPOINTS = {
+    "demanda": Endpoint("demanda/evolucion", "hour", "demanda", timeout=TIMEOUT_REE_HORARIO),
+    "balance": Endpoint("balance/balance-electrico", "day", "balance",
+                        estructura="anidada", columnas=COLUMNAS_ANIDADAS),
+    "generacion": Endpoint("generacion/evolucion-renovable-no-renovable", "day", "generacion"),
+    # Los intercambios se publican para el sistema peninsular
+    "intercambios": Endpoint("intercambios/todas-fronteras-programados", "day", "intercambios",
+                             estructura="anidada", columnas=COLUMNAS_ANIDADAS, geos=("peninsular",)),
+    "intercambios_baleares": Endpoint("intercambios/enlace-baleares", "day", "intercambios_baleares",
+                                      geos=("peninsular",)),
+    # Precios horarios (PVPC y mercado spot), comunes a la península
+    "precios": Endpoint("mercados/precios-mercados-tiempo-real", "hour", "precios",
+                        geos=("peninsular",), timeout=TIMEOUT_REE_HORARIO),
+    "emisiones_co2": Endpoint("generacion/no-renovables-detalle-emisiones-CO2", "day", "emisiones_co2"),
+    "estructura_generacion": Endpoint("generacion/estructura-generacion", "day", "estructura_generacion"),
+}
+
+# Worker de ingesta: cada cuántos minutos se lanza la sincronización incremental y fichero de bloqueo
+# que garantiza que solo hay un proceso de ingesta activo
+INGESTA_CADA_MINUTOS = int(os.getenv("INGESTA_CADA_MINUTOS", "60"))
+INGESTA_LOCK = os.getenv("INGESTA_LOCK", ".ingesta_ree.lock")
+
+
+# ------------------------------ CLIENTE REE ------------------------------
+
+# Limitador de tasa tipo "token bucket": se recargan `tasa` fichas por segundo hasta un máximo de `capacidad`.
+# Cada petición consume una ficha; si no quedan, el hilo espera lo justo hasta que se recargue la siguiente.
+class LimitadorTasa:
+    def __init__(self, tasa, capacidad=1):
+        self.tasa = tasa
+        self.capacidad = max(1, capacidad)
+        self._fichas = float(self.capacidad)
+        self._ultima_recarga = tiempo.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self._lock:
+                ahora = tiempo.monotonic()
+                self._fichas = min(self.capacidad, self._fichas + (ahora - self._ultima_recarga) * self.tasa)
+                self._ultima_recarga = ahora
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                espera = (1 - self._fichas) / self.tasa
+            tiempo.sleep(espera)
+
+limitador_ree = LimitadorTasa(REE_PETICIONES_POR_SEGUNDO, REE_RAFAGA)
+
+# Resultado de una consulta a REE: distingue entre "ok" (hay datos), "sin_datos" (respuesta válida pero vacía)
+# y "error" (la petición falló incluso tras los reintentos)
+@dataclass
+class ResultadoREE:
+    estado: str
+    datos: pd.DataFrame = field(default_factory=pd.DataFrame)
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.estado == "ok"
+
+class ErrorREE(Exception):
+    pass
+
+# Cliente HTTP reutilizable para la API de REE: una única sesión con pool de conexiones keep-alive (se ahorra
+# el handshake TCP/TLS en cada petición), reintentos con backoff exponencial + jitter que respetan Retry-After
+# y peticiones condicionales (ETag / Last-Modified) para no volver a descargar respuestas que no han cambiado.
+class ClienteREE:
+    ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+    def __init__(self, limitador, max_reintentos=REE_MAX_REINTENTOS, backoff_base=REE_BACKOFF_BASE,
+                 backoff_max=REE_BACKOFF_MAX, tam_pool=REE_MAX_WORKERS,
+                 max_bytes_validadores=int(REE_VALIDADORES_MB * 2 ** 20)):
+        self.limitador = limitador
+        self.max_reintentos = max_reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, tam_pool))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Caché LRU de validadores: clave de la petición -> (etag, last_modified, json, bytes de la respuesta),
+        # acotada por el total de bytes de las respuestas guardadas
+        self._validadores = OrderedDict()
+        self._bytes_validadores = 0
+        self._max_bytes_validadores = max_bytes_validadores
+        self._lock = threading.Lock()
+
+    def _espera_backoff(self, intento, response=None):
+        # Si el servidor indica cuánto esperar (Retry-After en segundos o como fecha HTTP), lo respetamos
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                try:
+                    fecha = parsedate_to_datetime(retry_after)
+                    return min(self.backoff_max, max(0.0, (fecha - datetime.now(timezone.utc)).total_seconds()))
+                except (TypeError, ValueError):
+                    pass
+        # "Full jitter": espera aleatoria entre 0 y base * 2^intento, acotada
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+
+    def get_json(self, url, params, timeout=TIMEOUT_REE_DEFECTO, endpoint="desconocido"):
+        clave = (url, tuple(sorted(params.items())))
+        with self._lock:
+            validador = self._validadores.get(clave)
+
+        cabeceras = {}
+        if validador:
+            etag, last_modified, _, _ = validador
+            if etag:
+                cabeceras["If-None-Match"] = etag
+            if last_modified:
+                cabeceras["If-Modified-Since"] = last_modified
+
+        ultimo_error = None
+        for intento in range(self.max_reintentos + 1):
+            self.limitador.adquirir()
+            response = None
+            try:
+                response = self.session.get(url, params=params, headers=cabeceras, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                ultimo_error = f"{type(e).__name__}: {e}"
+                motivo = type(e).__name__
+            else:
+                if response.status_code == 304 and validador:
+                    metricas.ree_no_modificadas.incrementar(endpoint=endpoint)
+                    return validador[2]
+                if response.status_code == 200:
+                    metricas.ree_bytes.incrementar(len(response.content), endpoint=endpoint)
+                    try:
+                        payload = response.json()
+                    except ValueError as e:
+                        raise ErrorREE(f"Respuesta no JSON de {url}: {e}")
+                    self._guardar_validador(clave, response, payload)
+                    return payload
+                ultimo_error = f"HTTP {response.status_code}"
+                motivo = ultimo_error
+                if response.status_code not in self.ESTADOS_REINTENTABLES:
+                    raise ErrorREE(f"{ultimo_error} en {url}")
+
+            if intento < self.max_reintentos:
+                metricas.ree_reintentos.incrementar(endpoint=endpoint, motivo=motivo)
+                tiempo.sleep(self._espera_backoff(intento, response))
+
+        raise ErrorREE(f"{ultimo_error} en {url} tras {self.max_reintentos} reintentos")
+
+    def _guardar_validador(self, clave, response, payload):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        tam = len(response.content)
+        with self._lock:
+            anterior = self._validadores.pop(clave, None)
+            if anterior:
+                self._bytes_validadores -= anterior[3]
+            if (not etag and not last_modified) or tam > self._max_bytes_validadores:
+                return
+            self._validadores[clave] = (etag, last_modified, payload, tam)
+            self._bytes_validadores += tam
+            while self._bytes_validadores > self._max_bytes_validadores:
+                _, (_, _, _, tam_descartado) = self._validadores.popitem(last=False)
+                self._bytes_validadores -= tam_descartado
+
+cliente_ree = ClienteREE(limitador_ree)
+
+# Función para consultar un endpoint, según los parámetros dados, de la API de REE. Registra en `metricas_ree`
+# la latencia, el resultado y las filas obtenidas.
+def get_data(endpoint_name, endpoint_info, params):
+    t0 = tiempo.monotonic()
+    resultado = consultar_endpoint(endpoint_name, endpoint_info, params)
+    metricas.ree_latencia.observar(tiempo.monotonic() - t0, endpoint=endpoint_name)
+    metricas.ree_peticiones.incrementar(endpoint=endpoint_name, resultado=resultado.estado)
+    metricas.filas_parseadas.incrementar(len(resultado.datos), tabla=endpoint_name)
+    return resultado
+
+def consultar_endpoint(endpoint_name, endpoint_info, params):
+    params["time_trunc"] = endpoint_info.time_trunc
+    url = BASE_URL + endpoint_info.path
+
+    try:
+        response_data = cliente_ree.get_json(url, params, timeout=endpoint_info.timeout, endpoint=endpoint_name)
+    except ErrorREE as e:
+        return ResultadoREE("error", error=str(e))
+
+    try:
+        data = parsear_respuesta(response_data, endpoint_info.estructura)
+    except (KeyError, TypeError, ValueError) as e:
+        return ResultadoREE("error", error=f"Respuesta de '{endpoint_name}' con formato inesperado: {e}")
+
+    return ResultadoREE("ok" if not data.empty else "sin_datos", data)
+
+# Conversión vectorizada de las fechas de REE ("2024-01-01T00:00:00.000+01:00") a datetime64[ns, UTC].
+# pd.to_datetime es lento cuando hay offsets mezclados (+01:00 / +02:00 por el horario de verano), así que se lee
+# la hora local y el offset directamente de los códigos de los caracteres. Si algún texto no tiene exactamente
+# ese formato se recurre a pd.to_datetime.
+def parsear_fechas_ree(textos):
+    arr = np.array(textos)
+    if arr.dtype.kind == "U" and arr.dtype.itemsize // 4 == 29:
+        codigos = arr.view(np.uint32).reshape(-1, 29)
+        if ((codigos[:, 10] == ord("T")).all() and (codigos[:, 19] == ord(".")).all()
+                and np.isin(codigos[:, 23], (ord("+"), ord("-"))).all() and (codigos[:, 26] == ord(":")).all()):
+            digitos = codigos.astype(np.int64) - ord("0")
+            offset_min = (digitos[:, 24] * 10 + digitos[:, 25]) * 60 + digitos[:, 27] * 10 + digitos[:, 28]
+            offset_min = np.where(codigos[:, 23] == ord("-"), -offset_min, offset_min)
+            local = arr.astype("U19").astype("datetime64[s]")
+            utc = (local - offset_min.astype("timedelta64[m]")).astype("datetime64[ns]")
+            return pd.DatetimeIndex(utc).tz_localize("UTC")
+    return pd.to_datetime(textos, utc=True, format="ISO8601").as_unit("ns")
+
+# Extractores de los bloques de valores (primary_category, sub_category, values) de una respuesta, uno por
+# estructura declarada en el registro de endpoints
+def bloques_planos(response_data):
+    return [
+        (item.get("attributes", {}).get("title"), None, item.get("attributes", {}).get("values", []))
+        for item in response_data.get("included", [])
+    ]
+
+def bloques_anidados(response_data):
+    return [
+        (item.get("attributes", {}).get("title"), sub.get("attributes", {}).get("title"),
+         sub.get("attributes", {}).get("values", []))
+        for item in response_data.get("included", [])
+        for sub in item.get("attributes", {}).get("content", [])
+    ]
+
+# Sin estructura declarada se decide por elemento: anidada si tiene "content"
+def bloques_autodetectados(response_data):
+    bloques = []
+    for item in response_data.get("included", []):
+        extractor = bloques_anidados if "content" in item.get("attributes", {}) else bloques_planos
+        bloques.extend(extractor({"included": [item]}))
+    return bloques
+
+EXTRACTORES_BLOQUES = {"plana": bloques_planos, "anidada": bloques_anidados}
+
+# Parser columnar de la respuesta JSON de REE. En vez de crear y modificar un dict por fila, recorre cada bloque
+# de valores (una categoría o subcategoría) una sola vez y construye directamente columnas tipadas:
+# value/percentage float64, datetime datetime64[ns, UTC] y categorías como Categorical (códigos repetidos por bloque).
+# `estructura` es la del registro de endpoints; sin ella se detecta en la propia respuesta.
+def parsear_respuesta(response_data, estructura=None):
+    extractor = EXTRACTORES_BLOQUES.get(estructura, bloques_autodetectados)
+    bloques = [bloque for bloque in extractor(response_data) if bloque[2]]
+    if not bloques:
+        return pd.DataFrame(columns=["value", "percentage", "datetime", "primary_category", "sub_category"])
+
+    valores = [entry for _, _, values in bloques for entry in values]
+    longitudes = np.fromiter((len(values) for _, _, values in bloques), dtype=np.int64, count=len(bloques))
+
+    def categorica(nombres):
+        categorias = list(dict.fromkeys(n for n in nombres if n is not None))
+        codigos = np.array([categorias.index(n) if n is not None else -1 for n in nombres], dtype=np.int32)
+        return pd.Categorical.from_codes(np.repeat(codigos, longitudes), categories=categorias)
+
+    return pd.DataFrame({
+        "value": np.array([entry.get("value") for entry in valores], dtype=np.float64),
+        "percentage": np.array([entry.get("percentage") for entry in valores], dtype=np.float64),
+        "datetime": parsear_fechas_ree([entry["datetime"] for entry in valores]),
+        "primary_category": categorica([bloque[0] for bloque in bloques]),
+        "sub_category": categorica([bloque[1] for bloque in bloques]),
+    })
+
+# Función que genera los record_id deterministas a partir de la clave natural
+# (endpoint, datetime, primary_category, sub_category, geo): el mismo dato siempre produce el mismo id.
+# El ámbito solo se añade al nombre fuera de GEO_PREDETERMINADO, así que los ids de los datos ya ingeridos no cambian.
+def generar_record_ids(endpoint, datetimes, primary_categories, sub_categories, geo=GEO_PREDETERMINADO):
+    fechas = np.datetime_as_string(
+        datetimes.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy(dtype="datetime64[s]"), unit="s")
+    primarias = pd.Series(primary_categories).astype(object).fillna("")
+    subs = pd.Series(sub_categories).astype(object).fillna("")
+    sufijo = "" if geo == GEO_PREDETERMINADO else f"|{geo}"
+    return [
+        uuid5_texto(f"{endpoint}|{fecha}Z|{primaria}|{sub}{sufijo}")
+        for fecha, primaria, sub in zip(fechas, primarias, subs)
+    ]
+
+# Equivalente a str(uuid.uuid5(NAMESPACE_REGISTROS, nombre)) pero sin construir objetos UUID (unas 3 veces más rápido)
+def uuid5_texto(nombre):
+    digest = bytearray(hashlib.sha1(NAMESPACE_REGISTROS.bytes + nombre.encode()).digest()[:16])
+    digest[6] = (digest[6] & 0x0F) | 0x50
+    digest[8] = (digest[8] & 0x3F) | 0x80
+    h = digest.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+# Función para insertar cada DataFrame en Supabase. Los registros se dividen en lotes que se envían en paralelo
+# como upsert sobre `clave` (la del registro de endpoints), así que volver a ingerir el mismo periodo no crea filas nuevas.
+def insertar_en_supabase(nombre_tabla, df, tam_lote=SUPABASE_TAM_LOTE, max_workers=SUPABASE_MAX_WORKERS,
+                         clave=CLAVE_NATURAL):
+    # Un mismo upsert no puede tocar dos veces la misma fila, así que quitamos duplicados de la clave
+    df = df.drop_duplicates(subset=clave.split(","), keep="last").copy()
+
+    # Convertimos fechas a string ISO
+    for col in ["datetime", "extraction_timestamp"]:
+        if col in df.columns:
+            df[col] = df[col].astype(str)
+
+    # Reemplazamos NaN por None (JSON no admite NaN; p. ej. sub_category vacía en columnas categóricas)
+    df = df.astype(object).where(pd.notnull(df), None)
+
+    # Convertir a lista de diccionarios y dividir en lotes
+    data = df.to_dict(orient="records")
+    lotes = [data[i:i + tam_lote] for i in range(0, len(data), tam_lote)]
+
+    def enviar_lote(lote):
+        t0 = tiempo.monotonic()
+        try:
+            supabase.table(nombre_tabla).upsert(lote, on_conflict=clave).execute()
+        finally:
+            metricas.supabase_latencia.observar(tiempo.monotonic() - t0, tabla=nombre_tabla)
+        return len(lote)
+
+    escritas = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(lotes)))) as executor:
+        for futuro in as_completed([executor.submit(enviar_lote, lote) for lote in lotes]):
+            try:
+                escritas += futuro.result()
+            except Exception as e:
+                metricas.lotes_fallidos.incrementar(tabla=nombre_tabla)
+                print(f"❌ Error al insertar en '{nombre_tabla}': {e}")
+    metricas.filas_escritas.incrementar(escritas, tabla=nombre_tabla)
+
+    if escritas:
+        print(f"✅ Insertados en '{nombre_tabla}': {escritas} filas ({len(lotes)} lotes)")
+    return escritas
+
+# Función para completar el DataFrame tipado de `parsear_respuesta` con las columnas de ingesta
+def construir_dataframe(name, df, geo=GEO_PREDETERMINADO):
+    df = df.copy()
+
+    # Obtenemos nuevas columnas y las reordenamos (year/month/day/hour no se guardan: se derivan de datetime)
+    df['extraction_timestamp'] = datetime.utcnow()
+    df['endpoint'] = name
+    df['geo'] = geo
+    df['record_id'] = generar_record_ids(name, df['datetime'], df['primary_category'], df['sub_category'], geo)
+    return df[COLUMNAS_INGESTA]
+
+# ------------------------------ FUNCIONES DE DESCARGA ------------------------------
+# Función que divide el intervalo [inicio, fin] en ventanas de `meses` meses naturales, alineadas con el calendario
+# (con meses=12, años naturales; con meses=1, meses naturales)
+def ventanas_entre(inicio, fin, meses=1):
+    ventanas = []
+    window_start = inicio
+    while window_start <= fin:
+        # Calculamos el final del bloque de meses, asegurándonos de no exceder la fecha final
+        block_end = inicio_bloque_siguiente(window_start, meses) - timedelta(minutes=1)
+        ventanas.append((window_start, min(block_end, fin)))
+        window_start = block_end + timedelta(minutes=1)
+    return ventanas
+
+# Función que devuelve el inicio del siguiente bloque de `meses` meses naturales posterior a `fecha`
+def inicio_bloque_siguiente(fecha, meses=1):
+    siguiente = ((fecha.year * 12 + fecha.month - 1) // meses + 1) * meses
+    return datetime(siguiente // 12, siguiente % 12 + 1, 1)
+
+# Función que devuelve los ámbitos que se ingieren para un endpoint: los pedidos (por defecto INGESTA_GEOS) que
+# el endpoint admite
+def ambitos_endpoint(name, geos=None):
+    admitidos = ENDPOINTS[name].geos
+    return [geo for geo in (geos or INGESTA_GEOS) if admitidos is None or geo in admitidos]
+
+# Función que comprueba que los ámbitos pedidos existen en AMBITOS_GEO
+def validar_ambitos(geos):
+    desconocidos = [geo for geo in geos if geo not in AMBITOS_GEO]
+    if desconocidos:
+        raise ValueError(f"Ámbitos geográficos desconocidos: {', '.join(desconocidos)} "
+                         f"(disponibles: {', '.join(AMBITOS_GEO)})")
+    return geos
+
+# Planificador de peticiones: ventanas del mayor tamaño que admite la API para la granularidad del endpoint
+def planificar_ventanas(endpoint_info, inicio, fin):
+    return ventanas_entre(inicio, fin, VENTANA_MESES[endpoint_info.time_trunc])
+
+# Función que divide en dos mitades (alineadas al periodo del endpoint) una ventana mayor que VENTANA_MINIMA.
+# Devuelve None si la ventana ya no se puede dividir más.
+def dividir_ventana(inicio, fin, time_trunc):
+    if fin - inicio <= VENTANA_MINIMA.get(time_trunc, timedelta(days=1)):
+        return None
+    mitad = inicio_periodo(inicio + (fin - inicio) / 2, time_trunc)
+    return [(inicio, mitad - timedelta(minutes=1)), (mitad, fin)]
+
+# Función que devuelve el inicio del periodo siguiente a `fecha` (ya truncada al periodo) según el time_trunc
+def periodo_siguiente(fecha, time_trunc):
+    if time_trunc == "hour":
+        return fecha + timedelta(hours=1)
+    if time_trunc == "day":
+        return fecha + timedelta(days=1)
+    return inicio_bloque_siguiente(fecha, 12 if time_trunc == "year" else 1)
+
+# Función que descarga un endpoint para un ámbito y una ventana concretos (se ejecuta dentro de los hilos de descarga)
+def descargar_ventana(name, endpoint_info, geo, inicio, fin):
+    params = {
+        "start_date": inicio.strftime("%Y-%m-%dT%H:%M"),
+        "end_date": fin.strftime("%Y-%m-%dT%H:%M"),
+        **AMBITOS_GEO[geo],
+    }
+    resultado = get_data(name, endpoint_info, params)
+    time_trunc = endpoint_info.time_trunc
+
+    # Petición rechazada (p. ej. rango demasiado grande o tiempo de espera agotado): se divide la ventana en dos.
+    # Un fallo no es lo mismo que un periodo sin datos: si ya no se puede dividir, se propaga para que quede registrado
+    if resultado.estado == "error":
+        mitades = dividir_ventana(inicio, fin, time_trunc)
+        if mitades is None:
+            raise ErrorREE(resultado.error)
+        print(f"✂️ '{name}' [{geo}] {inicio:%Y-%m-%d}/{fin:%Y-%m-%d} rechazada ({resultado.error}), se divide en dos")
+        return unir_partes([descargar_ventana(name, endpoint_info, geo, *mitad) for mitad in mitades])
+    if not resultado.ok:
+        return None
+
+    df = construir_dataframe(name, resultado.datos, geo)
+    # Respuesta truncada: en una ventana grande, si falta al menos un periodo completo al final, se pide el resto
+    if dividir_ventana(inicio, fin, time_trunc) is not None:
+        ultimo = df["datetime"].max().tz_convert(ZONA_REE).tz_localize(None).to_pydatetime()
+        siguiente = periodo_siguiente(ultimo, time_trunc)
+        if periodo_siguiente(siguiente, time_trunc) <= fin:
+            print(f"✂️ '{name}' [{geo}] {inicio:%Y-%m-%d}/{fin:%Y-%m-%d} truncada en {ultimo:%Y-%m-%d %H:%M}, "
+                  f"se pide el resto")
+            return unir_partes([df, descargar_ventana(name, endpoint_info, geo, siguiente, fin)])
+    return df
+
+# Función que concatena los DataFrames de las partes de una ventana dividida (None si ninguna tiene datos)
+def unir_partes(partes):
+    partes = [parte for parte in partes if parte is not None and not parte.empty]
+    return pd.concat(partes, ignore_index=True) if partes else None
+
+# ------------------------------ MARCAS DE AGUA (SYNC INCREMENTAL) ------------------------------
+# Función que lee de la tabla `sync_estado` el último datetime ingerido por (tabla, ámbito), tal como está guardado.
+# Los pares con fila pero sin marca (`registrar_escritura` crea la fila en la primera escritura, aunque ninguna ventana
+# contigua haya terminado bien) aparecen con None. Devuelve None si no se puede leer: sin las marcas guardadas no se
+# sabe si una marca nueva las haría retroceder.
+def leer_marcas_guardadas():
+    try:
+        response = supabase.table("sync_estado").select("tabla, geo, ultimo_datetime").execute()
+    except Exception as e:
+        print(f"⚠️ No se pudo leer 'sync_estado': {e}")
+        return None
+    return {(fila["tabla"], fila.get("geo") or GEO_PREDETERMINADO):
+            pd.Timestamp(fila["ultimo_datetime"]) if fila["ultimo_datetime"] else None
+            for fila in response.data}
+
+# Función que devuelve el punto de partida de la sync incremental por (tabla, ámbito): la marca guardada o, si un par
+# no tiene fila en `sync_estado` (se pobló antes de que existiera), el máximo `datetime` que ya contiene. Un par con
+# fila y marca nula no usa el máximo: sus datos pueden tener un hueco detrás, así que se trata como sin marca (None).
+def leer_marcas_sync(geos=None, guardadas=None):
+    marcas = dict(guardadas or {})
+    for tabla, endpoint_info in ENDPOINTS.items():
+        for geo in ambitos_endpoint(tabla, geos):
+            if (tabla, geo) in marcas:
+                continue
+            try:
+                response = (
+                    supabase.table(endpoint_info.tabla)
+                    .select("datetime")
+                    .eq("geo", geo)
+                    .order("datetime", desc=True)
+                    .limit(1)
+                    .execute()
+                )
+                if response.data:
+                    marcas[(tabla, geo)] = pd.Timestamp(response.data[0]["datetime"])
+            except Exception as e:
+                print(f"⚠️ No se pudo leer el último dato de '{tabla}' [{geo}]: {e}")
+    return marcas
+
+# Función que registra una escritura en `sync_estado`: actualiza solo `actualizado_en`, que es la versión de los datos
+# con la que el dashboard invalida sus cachés. Se llama en cada escritura correcta, también cuando la marca de agua no
+# avanza (una sync que reescribe valores revisados del último periodo o un backfill de meses antiguos). Con
+# `datetimes`, guarda además en `sync_meses` la versión de cada mes (UTC) escrito, con la que la caché de disco del
+# dashboard descarta los meses que han cambiado desde que los guardó.
+def registrar_escritura(tabla, geo, datetimes=None):
+    ahora = datetime.now(timezone.utc).isoformat()
+    try:
+        supabase.table("sync_estado").upsert({
+            "tabla": tabla,
+            "geo": geo,
+            "actualizado_en": ahora,
+        }, on_conflict="tabla,geo").execute()
+        if datetimes is not None and len(datetimes):
+            meses = pd.DatetimeIndex(datetimes).tz_convert("UTC").tz_localize(None).to_period("M").unique()
+            supabase.table("sync_meses").upsert([
+                {"tabla": tabla, "geo": geo, "mes": mes.start_time.date().isoformat(), "actualizado_en": ahora}
+                for mes in meses
+            ], on_conflict="tabla,geo,mes").execute()
+    except Exception as e:
+        print(f"⚠️ No se pudo registrar la escritura de '{tabla}' [{geo}] en 'sync_estado': {e}")
+
+# Función para avanzar la marca de agua de una tabla y ámbito (nunca retrocede, p. ej. al rellenar años antiguos)
+def guardar_marca_sync(tabla, geo, ultimo_datetime, marca_actual=None):
+    ultimo_datetime = pd.Timestamp(ultimo_datetime)
+    if marca_actual is not None and marca_actual >= ultimo_datetime:
+        return
+    supabase.table("sync_estado").upsert({
+        "tabla": tabla,
+        "geo": geo,
+        "ultimo_datetime": ultimo_datetime.isoformat(),
+        "actualizado_en": datetime.now(timezone.utc).isoformat(),
+    }, on_conflict="tabla,geo").execute()
+
+# Función que crea, si no existen, las particiones mensuales de las tablas que cubren [desde, hasta] (ver
+# `crear_particiones_mensuales` en `Supabase_schema`). Las fechas son hora peninsular sin zona; se amplía un día
+# por cada lado para cubrir la diferencia con UTC.
+def asegurar_particiones(desde, hasta):
+    try:
+        supabase.rpc("crear_particiones_mensuales", {
+            "desde": (desde - timedelta(days=1)).isoformat(),
+            "hasta": (hasta + timedelta(days=1)).isoformat(),
+        }).execute()
+    except Exception as e:
+        print(f"⚠️ No se pudieron crear las particiones entre {desde:%Y-%m-%d} y {hasta:%Y-%m-%d}: {e}")
+
+# Función que recalcula los rollups de una tabla y ámbito (ver `refrescar_rollups` en `Supabase_schema`) para los días,
+# meses y años que tocan las filas escritas entre `desde` y `hasta`. Devuelve False si falló.
+def actualizar_rollups(tabla, geo, desde, hasta):
+    t0 = tiempo.monotonic()
+    try:
+        supabase.rpc("refrescar_rollups", {
+            "tabla": tabla,
+            "geo": geo,
+            "desde": pd.Timestamp(desde).isoformat(),
+            "hasta": pd.Timestamp(hasta).isoformat(),
+        }).execute()
+        return True
+    except Exception as e:
+        metricas.rollups_fallidos.incrementar(tabla=tabla)
+        print(f"❌ No se pudieron actualizar los rollups de '{tabla}' [{geo}]: {e}")
+        return False
+    finally:
+        metricas.rollups_latencia.observar(tiempo.monotonic() - t0, tabla=tabla)
+
+# Función que recalcula las anomalías (ver `anomalias_ree.py`) de las filas escritas de una tabla y ámbito entre
+# `desde` y `hasta` y las guarda en la tabla `anomalias`. Devuelve cuántas se detectaron. Si falla, los datos ya
+# están escritos: la ventana no se da por errónea y las anomalías se recalculan cuando se vuelva a escribir el rango.
+def actualizar_anomalias(tabla, geo, desde, hasta):
+    t0 = tiempo.monotonic()
+    try:
+        detectadas = anomalias.actualizar_anomalias(supabase, tabla, geo, desde, hasta)
+    except Exception as e:
+        metricas.anomalias_fallidas.incrementar(tabla=tabla)
+        print(f"⚠️ No se pudieron actualizar las anomalías de '{tabla}' [{geo}]: {e}")
+        return 0
+    finally:
+        metricas.anomalias_latencia.observar(tiempo.monotonic() - t0, tabla=tabla)
+    for sentido, grupo in detectadas.groupby("sentido"):
+        metricas.ultima_anomalia.fijar(grupo["datetime"].max().timestamp(), tabla=tabla, geo=geo, sentido=sentido)
+    registrar_escritura(tabla, geo)
+    if not detectadas.empty:
+        print(f"🔎 {len(detectadas)} anomalías en '{tabla}' [{geo}] entre {desde:%Y-%m-%d} y {hasta:%Y-%m-%d}")
+    return len(detectadas)
+
+# Función que trunca una fecha (hora peninsular, sin zona) al inicio de su periodo según el time_trunc del endpoint
+def inicio_periodo(fecha, time_trunc):
+    if time_trunc == "hour":
+        return fecha.replace(minute=0, second=0, microsecond=0)
+    return fecha.replace(hour=0, minute=0, second=0, microsecond=0)
+
+# ------------------------------ MOTOR DE DESCARGA ------------------------------
+# Resumen de una ejecución del motor de descarga (sustituye al DataFrame concatenado que devolvía el backfill)
+@dataclass
+class ResumenIngesta:
+    ventanas: int = 0
+    ventanas_con_error: int = 0
+    filas_descargadas: int = 0
+    filas_descartadas: int = 0
+    filas_escritas: int = 0
+    anomalias: int = 0
+    segundos: float = 0.0
+    filas_por_tabla: dict = field(default_factory=dict)
+
+# Marca de fin de cola entre etapas del motor de descarga
+FIN_COLA = object()
+
+# Función que valida el lote descargado de una ventana antes de escribirlo: descarta filas sin fecha o sin categoría,
+# filas fuera de la ventana pedida (hora peninsular) y duplicados de la clave del endpoint. Devuelve (df, descartadas).
+def validar_lote(df, inicio, fin, clave=CLAVE_NATURAL):
+    n = len(df)
+    desde = pd.Timestamp(inicio).tz_localize(ZONA_REE, ambiguous=True, nonexistent="shift_forward")
+    hasta = pd.Timestamp(fin).tz_localize(ZONA_REE, ambiguous=False, nonexistent="shift_forward")
+    df = df[df["datetime"].notna() & df["primary_category"].notna()
+            & (df["datetime"] >= desde) & (df["datetime"] <= hasta)]
+    df = df.drop_duplicates(subset=clave.split(","), keep="last")
+    return df, n - len(df)
+
+# Función que escribe el lote de una ventana en la tabla de su endpoint, actualiza sus rollups y cambia la versión de
+# los datos (`registrar_escritura`). Devuelve el último datetime escrito si se escribió entero y con los rollups al
+# día (marca de agua de la sync) o None si falló algo: la ventana se volverá a pedir, y a resumir, en la siguiente
+# sincronización.
+def escribir_lote(endpoint_info, geo, df):
+    df = df.drop(columns=["endpoint"], errors="ignore")
+    if insertar_en_supabase(endpoint_info.tabla, df, clave=endpoint_info.clave) != len(df):
+        return None
+    if not actualizar_rollups(endpoint_info.tabla, geo, df["datetime"].min(), df["datetime"].max()):
+        return None
+    registrar_escritura(endpoint_info.tabla, geo, df["datetime"])
+    return df["datetime"].max()
+
+# Motor de descarga en flujo: las tareas (name, endpoint_info, geo, inicio, fin), una por endpoint, ámbito y ventana,
+# pasan por tres etapas conectadas por colas acotadas (INGESTA_COLA_MAX elementos), de modo que la memoria no
+# depende del número de ventanas:
+#   1. descarga + parseo: `max_workers` hilos, todos limitados por el mismo `limitador_ree` (añadir ámbitos añade
+#      tareas a la misma cola; el tiempo total lo marcan los hilos y el límite de tasa, no el número de ámbitos)
+#   2. validación: un hilo (`validar_lote`)
+#   3. escritura: el hilo principal escribe cada ventana en su tabla en cuanto llega (y actualiza sus rollups),
+#      mientras se sigue descargando
+# Si la escritura se retrasa, las colas se llenan y las descargas esperan. Al terminar, la marca de agua de cada
+# tabla y ámbito avanza solo hasta la última ventana escrita sin huecos: si una ventana falla, la siguiente sincronización
+# volverá a pedirla. Antes de guardar las marcas se recalculan las anomalías del rango escrito de cada tabla y ámbito
+# (una pasada por tabla y ámbito, no por ventana, para leer el histórico de la línea base una sola vez).
+def ejecutar_descargas(tareas, max_workers=REE_MAX_WORKERS, descripcion="Descarga", tam_cola=None, marcas=None):
+    tam_cola = tam_cola or INGESTA_COLA_MAX
+    total = len(tareas)
+    resumen = ResumenIngesta()
+    if not tareas:
+        return resumen
+    # Las marcas guardadas se leen antes de escribir nada: después, el máximo de la tabla ya incluiría las ventanas de
+    # esta ejecución, también las posteriores a una que falle
+    if marcas is None:
+        marcas = leer_marcas_guardadas()
+    print(f"[{datetime.now()}] ⏳ {descripcion}: {total} peticiones con {max_workers} hilos")
+    asegurar_particiones(min(tarea[3] for tarea in tareas), max(tarea[4] for tarea in tareas))
+
+    cola_tareas = queue.Queue()
+    for tarea in tareas:
+        cola_tareas.put(tarea)
+    cola_descargas = queue.Queue(maxsize=tam_cola)
+    cola_validadas = queue.Queue(maxsize=tam_cola)
+
+    def descargar():
+        while True:
+            try:
+                tarea = cola_tareas.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                cola_descargas.put((tarea, descargar_ventana(*tarea), None))
+            except Exception as e:
+                cola_descargas.put((tarea, None, e))
+
+    def validar():
+        while True:
+            elemento = cola_descargas.get()
+            if elemento is FIN_COLA:
+                cola_validadas.put(FIN_COLA)
+                return
+            tarea, df, error = elemento
+            descartadas = 0
+            if df is not None and error is None:
+                try:
+                    df, descartadas = validar_lote(df, tarea[3], tarea[4], tarea[1].clave)
+                except Exception as e:
+                    df, error = None, e
+            cola_validadas.put((tarea, df, error, descartadas))
+
+    def cerrar_descargas(hilos):
+        for hilo in hilos:
+            hilo.join()
+        cola_descargas.put(FIN_COLA)
+
+    hilos_descarga = [threading.Thread(target=descargar, daemon=True) for _ in range(max(1, min(max_workers, total)))]
+    for hilo in hilos_descarga:
+        hilo.start()
+    threading.Thread(target=validar, daemon=True).start()
+    threading.Thread(target=cerrar_descargas, args=(hilos_descarga,), daemon=True).start()
+
+    t0 = tiempo.monotonic()
+    # (tabla, ámbito) -> {inicio de ventana: (escrita correctamente, último datetime escrito)}
+    ventanas_por_tabla = {}
+    # (tabla, ámbito) -> (tabla de Supabase, primer y último datetime escritos)
+    rangos_escritos = {}
+    while True:
+        elemento = cola_validadas.get()
+        if elemento is FIN_COLA:
+            break
+        (name, endpoint_info, geo, inicio, _), df, error, descartadas = elemento
+        resumen.ventanas += 1
+        resumen.filas_descartadas += descartadas
+        metricas.filas_descartadas.incrementar(descartadas, tabla=name)
+        correcta, ultimo = error is None, None
+        if error is not None:
+            print(f"❌ Error descargando '{name}' [{geo}] {inicio:%Y-%m-%d %H:%M}: {error}")
+        elif df is not None and not df.empty:
+            resumen.filas_descargadas += len(df)
+            ultimo = escribir_lote(endpoint_info, geo, df)
+            correcta = ultimo is not None
+            if correcta:
+                resumen.filas_escritas += len(df)
+                resumen.filas_por_tabla[name] = resumen.filas_por_tabla.get(name, 0) + len(df)
+                _, desde, hasta = rangos_escritos.get((name, geo), (None, df["datetime"].min(), ultimo))
+                rangos_escritos[(name, geo)] = (endpoint_info.tabla, min(desde, df["datetime"].min()), max(hasta, ultimo))
+        if not correcta:
+            resumen.ventanas_con_error += 1
+        ventanas_por_tabla.setdefault((name, geo), {})[inicio] = (correcta, ultimo)
+
+        # Progreso y rendimiento acumulado
+        transcurrido = tiempo.monotonic() - t0
+        print(f"[{resumen.ventanas}/{total}] {name} [{geo}] {inicio:%Y-%m-%d} · "
+              f"{resumen.ventanas / transcurrido:.2f} peticiones/s · {resumen.filas_descargadas / transcurrido:.0f} filas/s")
+
+    resumen.segundos = tiempo.monotonic() - t0
+    print(f"✅ {descripcion} completada: {resumen.filas_escritas} filas escritas en {resumen.segundos:.1f} s"
+          + (f" ({resumen.filas_descartadas} descartadas en la validación)" if resumen.filas_descartadas else "")
+          + (f", {resumen.ventanas_con_error} ventanas con error" if resumen.ventanas_con_error else ""))
+
+    # Cada escritura cambia la versión de los datos que usa el dashboard para invalidar sus cachés; al terminar las
+    # anomalías se vuelve a cambiar, para que las lea junto con los datos que las produjeron
+    if anomalias.ANOMALIAS_ACTIVAS:
+        for (_, geo), (tabla, desde, hasta) in rangos_escritos.items():
+            resumen.anomalias += actualizar_anomalias(tabla, geo, desde, hasta)
+
+    if marcas is None and ventanas_por_tabla:
+        print("⚠️ Sin las marcas guardadas en 'sync_estado' no se avanza ninguna marca; se repetirá en la siguiente sync")
+        ventanas_por_tabla = {}
+    for (tabla, geo), ventanas in ventanas_por_tabla.items():
+        ultimo_contiguo = None
+        for inicio in sorted(ventanas):
+            correcta, ultimo = ventanas[inicio]
+            if not correcta:
+                break
+            if ultimo is not None:
+                ultimo_contiguo = ultimo
+        if ultimo_contiguo is not None:
+            try:
+                guardar_marca_sync(tabla, geo, ultimo_contiguo, marcas.get((tabla, geo)))
+            except Exception as e:
+                print(f"⚠️ No se pudo guardar la marca de '{tabla}' [{geo}]: {e}")
+            else:
+                marca = max(pd.Timestamp(ultimo_contiguo), marcas.get((tabla, geo)) or pd.Timestamp(ultimo_contiguo))
+                metricas.ultima_sync.fijar(tiempo.time(), tabla=tabla, geo=geo)
+                metricas.ultimo_dato.fijar(marca.timestamp(), tabla=tabla, geo=geo)
+
+    return resumen
+
+# Función de extracción de datos de los últimos x años, devuelve un ResumenIngesta. Ejecutar una vez al inicio para poblar la base de datos.
+# `geos` son los ámbitos geográficos a descargar (por defecto INGESTA_GEOS).
+def get_data_for_last_x_years(num_years=3, max_workers=REE_MAX_WORKERS, geos=None):
+    geos = validar_ambitos(geos or INGESTA_GEOS)
+    # Las ventanas se expresan en hora peninsular, igual que en la sincronización incremental
+    current_date = datetime.now(ZONA_REE).replace(tzinfo=None)
+    # Calculamos el año de inicio a partir del año actual
+    inicio = datetime(current_date.year - num_years, 1, 1)
+    tareas = [
+        (name, endpoint_info, geo, window_start, window_end)
+        for name, endpoint_info in ENDPOINTS.items()
+        for geo in ambitos_endpoint(name, geos)
+        for window_start, window_end in planificar_ventanas(endpoint_info, inicio, current_date)
+    ]
+    return ejecutar_descargas(tareas, max_workers, descripcion=f"Backfill de {num_years} años")
+
+# Función de sincronización incremental: para cada tabla y ámbito se descarga solo desde su marca de agua hasta ahora.
+# Se vuelve a pedir el último periodo ya ingerido (puede estar incompleto o revisado; el upsert lo sobrescribe),
+# los huecos de varios días se recuperan en una sola pasada y se omiten las tablas que ya están al día.
+def actualizar_datos_desde_api(max_workers=REE_MAX_WORKERS, geos=None):
+    geos = validar_ambitos(geos or INGESTA_GEOS)
+    print(f"[{datetime.now()}] ⏳ Ejecutando sincronización incremental desde API...")
+    current_date = datetime.now(ZONA_REE).replace(tzinfo=None)
+    guardadas = leer_marcas_guardadas()
+    marcas = leer_marcas_sync(geos, guardadas)
+
+    tareas = []
+    for name, endpoint_info in ENDPOINTS.items():
+        time_trunc = endpoint_info.time_trunc
+        for geo in ambitos_endpoint(name, geos):
+            marca = marcas.get((name, geo))
+            if marca is None:
+                start_date = inicio_periodo(current_date - timedelta(days=SYNC_DIAS_SIN_MARCA), time_trunc)
+            else:
+                start_date = inicio_periodo(marca.tz_convert(ZONA_REE).to_pydatetime().replace(tzinfo=None), time_trunc)
+                if start_date >= inicio_periodo(current_date, time_trunc):
+                    print(f"⏭️ '{name}' [{geo}] ya está al día (último dato: {marca})")
+                    continue
+            tareas.extend((name, endpoint_info, geo, inicio, fin)
+                          for inicio, fin in planificar_ventanas(endpoint_info, start_date, current_date))
+
+    return ejecutar_descargas(tareas, max_workers, descripcion="Sincronización incremental", marcas=guardadas)
+
+# Función que recalcula las anomalías de todos los endpoints y ámbitos desde el 1 de enero de hace `num_years` años,
+# sin descargar nada. Para bases de datos pobladas antes de existir la tabla `anomalias` (el backfill y la
+# sincronización ya las calculan para lo que escriben). Devuelve un ResumenIngesta con las anomalías detectadas.
+def recalcular_anomalias(num_years=3, geos=None):
+    geos = validar_ambitos(geos or INGESTA_GEOS)
+    resumen = ResumenIngesta()
+    t0 = tiempo.monotonic()
+    ahora = pd.Timestamp.now(tz="UTC")
+    desde = pd.Timestamp(ahora.year - num_years, 1, 1, tz="UTC")
+    for name, endpoint_info in ENDPOINTS.items():
+        for geo in ambitos_endpoint(name, geos):
+            resumen.anomalias += actualizar_anomalias(endpoint_info.tabla, geo, desde, ahora)
+    resumen.segundos = tiempo.monotonic() - t0
+    print(f"✅ Anomalías recalculadas desde {desde:%Y-%m-%d}: {resumen.anomalias} detectadas en {resumen.segundos:.1f} s")
+    return resumen
+
+# ------------------------------ WORKER DE INGESTA ------------------------------
+# Bloqueo de instancia única: se toma un lock exclusivo sobre un fichero y se mantiene mientras viva el proceso.
+# Si otro proceso de ingesta ya lo tiene, se sale sin hacer nada.
+class BloqueoInstancia:
+    def __init__(self, ruta=INGESTA_LOCK):
+        self.ruta = ruta
+        self._fichero = None
+
+    def __enter__(self):
+        self._fichero = open(self.ruta, "a+")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                msvcrt.locking(self._fichero.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fichero.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._fichero.close()
+            raise RuntimeError(f"Ya hay otro proceso de ingesta en marcha (lock: {self.ruta})")
+        self._fichero.seek(0)
+        self._fichero.truncate()
+        self._fichero.write(str(os.getpid()))
+        self._fichero.flush()
+        return self
+
+    def __exit__(self, *exc):
+        # Al cerrar el fichero el sistema operativo libera el lock
+        self._fichero.close()
+        return False
+
+# Función que ejecuta un comando de la ingesta (sync o backfill) y registra en `metricas_ree` su duración y
+# resultado; es correcta si no lanza excepciones ni deja ventanas con error
+def ejecutar_con_metricas(comando, funcion, *args):
+    t0 = tiempo.monotonic()
+    correcta = False
+    try:
+        resumen = funcion(*args)
+        correcta = resumen is None or resumen.ventanas_con_error == 0
+        return resumen
+    finally:
+        metricas.registrar_ejecucion(comando, t0, correcta)
+
+# Una sincronización del programador: un fallo se registra en las métricas y en el log, pero no detiene el servicio
+def sincronizacion_programada(geos=None):
+    try:
+        ejecutar_con_metricas("sync", actualizar_datos_desde_api, REE_MAX_WORKERS, geos)
+    except Exception as e:
+        print(f"❌ Error en la sincronización programada: {e}")
+
+# Programador para sincronizar los datos desde la API cada `cada_minutos` minutos (la primera vez, al arrancar)
+def iniciar_programador_api(cada_minutos=INGESTA_CADA_MINUTOS, geos=None):
+    sincronizacion_programada(geos)
+    schedule.every(cada_minutos).minutes.do(sincronizacion_programada, geos)
+    while True:
+        schedule.run_pending()
+        tiempo.sleep(min(60, cada_minutos * 60))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingesta de datos de la API de REE en Supabase")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    # Ámbitos geográficos, comunes a los tres comandos
+    opciones_geo = argparse.ArgumentParser(add_help=False)
+    opciones_geo.add_argument("--geos", type=lambda texto: [geo.strip() for geo in texto.split(",") if geo.strip()],
+                              default=INGESTA_GEOS,
+                              help=f"ámbitos separados por comas ({', '.join(AMBITOS_GEO)})")
+
+    servicio = subparsers.add_parser("servicio", parents=[opciones_geo],
+                                     help="Sincronización incremental periódica (modo demonio)")
+    servicio.add_argument("--cada-minutos", type=int, default=INGESTA_CADA_MINUTOS)
+    servicio.add_argument("--puerto-metricas", type=int, default=metricas.METRICAS_PUERTO,
+                          help="puerto del endpoint /metrics (0 = desactivado)")
+
+    subparsers.add_parser("sync", parents=[opciones_geo], help="Una única sincronización incremental")
+
+    backfill = subparsers.add_parser("backfill", parents=[opciones_geo], help="Carga inicial de los últimos años")
+    backfill.add_argument("--anios", type=int, default=3)
+    backfill.add_argument("--workers", type=int, default=REE_MAX_WORKERS)
+
+    recalculo = subparsers.add_parser("anomalias", parents=[opciones_geo],
+                                      help="Recalcula las anomalías de los últimos años sin descargar datos")
+    recalculo.add_argument("--anios", type=int, default=3)
+
+    args = parser.parse_args(argv)
+    try:
+        validar_ambitos(args.geos)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        with BloqueoInstancia():
+            if args.comando == "servicio":
+                metricas.servir_metricas(args.puerto_metricas)
+                iniciar_programador_api(args.cada_minutos, args.geos)
+            elif args.comando == "sync":
+                ejecutar_con_metricas("sync", actualizar_datos_desde_api, REE_MAX_WORKERS, args.geos)
+            elif args.comando == "backfill":
+                ejecutar_con_metricas("backfill", get_data_for_last_x_years, args.anios, args.workers, args.geos)
+            elif args.comando == "anomalias":
+                ejecutar_con_metricas("anomalias", recalcular_anomalias, args.anios, args.geos)
+    except RuntimeError as e:
+        print(f"⚠️ {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import json
+import os
+
+import folium
+import numpy as np
+from branca.colormap import linear
+
+# Mapa de intercambios internacionales. En lugar de dibujar un Choropleth sobre el GeoJSON de todo el mundo, se
+# construye una sola vez un subconjunto con los países del mapa (recortado a la zona y simplificado) que se guarda
+# en disco, y el mapa se dibuja con una capa GeoJson ya coloreada. No depende de Streamlit.
+GEOJSON_MUNDO = os.getenv("GEOJSON_MUNDO", "world_countries_with_andorra.json")
+GEOJSON_INTERCAMBIOS = os.getenv("GEOJSON_INTERCAMBIOS", "geo_intercambios.json")
+
+# Países con los que REE publica intercambios (categoría en la tabla -> nombre en el GeoJSON); España se dibuja
+# sin color como referencia
+PAISES_INTERCAMBIO = {
+    "francia": "France",
+    "portugal": "Portugal",
+    "andorra": "Andorra",
+    "marruecos": "Morocco",
+}
+PAISES_MAPA = list(PAISES_INTERCAMBIO.values()) + ["Spain"]
+
+# Zona del mapa (lon_min, lat_min, lon_max, lat_max): se descartan los polígonos que caen fuera, como los
+# territorios de ultramar de Francia o las islas atlánticas de Portugal
+CAJA_RECORTE = (-20.0, 20.0, 15.0, 55.0)
+# Tolerancia de la simplificación (en grados, ~1 km) y decimales de las coordenadas (~100 m)
+TOLERANCIA_SIMPLIFICACION = float(os.getenv("GEOJSON_TOLERANCIA", "0.01"))
+DECIMALES_COORDENADAS = 3
+
+# ------------------------------ GEOMETRÍA ------------------------------
+
+# Ramer-Douglas-Peucker: conserva los puntos de la línea que se separan más de `tolerancia` del tramo que los une.
+# Iterativo (con una pila) y vectorizado por tramo. Devuelve los puntos conservados.
+def simplificar_linea(puntos, tolerancia):
+    puntos = np.asarray(puntos, dtype=float)
+    if len(puntos) <= 4:
+        return puntos
+    conservar = np.zeros(len(puntos), dtype=bool)
+    conservar[[0, -1]] = True
+    pila = [(0, len(puntos) - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1:
+            continue
+        a, b = puntos[i], puntos[j]
+        tramo = puntos[i + 1:j]
+        dx, dy = b - a
+        norma = np.hypot(dx, dy)
+        if norma == 0:  # anillo cerrado: distancia al punto inicial
+            distancias = np.hypot(tramo[:, 0] - a[0], tramo[:, 1] - a[1])
+        else:
+            distancias = np.abs(dx * (tramo[:, 1] - a[1]) - dy * (tramo[:, 0] - a[0])) / norma
+        k = int(np.argmax(distancias))
+        if distancias[k] > tolerancia:
+            k += i + 1
+            conservar[k] = True
+            pila.extend([(i, k), (k, j)])
+    return puntos[conservar]
+
+# Un anillo necesita al menos 4 puntos (el último repite el primero): los que quedan por debajo se dejan sin simplificar
+def simplificar_anillo(anillo, tolerancia):
+    simplificado = simplificar_linea(anillo, tolerancia)
+    if len(simplificado) < 4:
+        simplificado = np.asarray(anillo, dtype=float)
+    return np.round(simplificado, DECIMALES_COORDENADAS).tolist()
+
+def poligono_en_caja(poligono, caja=CAJA_RECORTE):
+    exterior = np.asarray(poligono[0], dtype=float)
+    lon_min, lat_min, lon_max, lat_max = caja
+    return not (exterior[:, 0].max() < lon_min or exterior[:, 0].min() > lon_max
+                or exterior[:, 1].max() < lat_min or exterior[:, 1].min() > lat_max)
+
+# Función que recorta (por polígonos) y simplifica una geometría Polygon/MultiPolygon. None si no queda nada.
+def reducir_geometria(geometria, tolerancia=TOLERANCIA_SIMPLIFICACION, caja=CAJA_RECORTE):
+    if geometria["type"] == "Polygon":
+        poligonos = [geometria["coordinates"]]
+    elif geometria["type"] == "MultiPolygon":
+        poligonos = geometria["coordinates"]
+    else:
+        return None
+    poligonos = [
+        [simplificar_anillo(anillo, tolerancia) for anillo in poligono]
+        for poligono in poligonos if poligono_en_caja(poligono, caja)
+    ]
+    if not poligonos:
+        return None
+    if len(poligonos) == 1:
+        return {"type": "Polygon", "coordinates": poligonos[0]}
+    return {"type": "MultiPolygon", "coordinates": poligonos}
+
+# ------------------------------ GEOJSON DEL MAPA ------------------------------
+
+# Función que construye el GeoJSON del mapa a partir del de todo el mundo: solo PAISES_MAPA, recortado y
+# simplificado, y solo con la propiedad `name`
+def construir_geojson_intercambios(geojson_mundo, paises=PAISES_MAPA, tolerancia=TOLERANCIA_SIMPLIFICACION):
+    features = []
+    for feature in geojson_mundo["features"]:
+        nombre = feature.get("properties", {}).get("name")
+        if nombre not in paises:
+            continue
+        geometria = reducir_geometria(feature["geometry"], tolerancia)
+        if geometria is not None:
+            features.append({"type": "Feature", "properties": {"name": nombre}, "geometry": geometria})
+    return {"type": "FeatureCollection", "features": features}
+
+# Función que devuelve el GeoJSON del mapa: lo lee de GEOJSON_INTERCAMBIOS si existe y es más reciente que el del
+# mundo, o lo construye y lo guarda (en un fichero temporal que se renombra, como las particiones de la caché)
+def cargar_geojson_intercambios(ruta_mundo=None, ruta_cache=None):
+    ruta_mundo = ruta_mundo or GEOJSON_MUNDO
+    ruta_cache = ruta_cache or GEOJSON_INTERCAMBIOS
+    if os.path.exists(ruta_cache) and (
+            not os.path.exists(ruta_mundo) or os.path.getmtime(ruta_cache) >= os.path.getmtime(ruta_mundo)):
+        with open(ruta_cache, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    with open(ruta_mundo, "r", encoding="utf-8") as f:
+        geojson = construir_geojson_intercambios(json.load(f))
+    temporal = f"{ruta_cache}.{os.getpid()}.tmp"
+    try:
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(geojson, f, separators=(",", ":"))
+        os.replace(temporal, ruta_cache)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar el GeoJSON del mapa en '{ruta_cache}': {e}")
+    return geojson
+
+# ------------------------------ MAPA ------------------------------
+
+# Función que convierte el saldo por país (columnas `pais` y `saldo`, de la función `saldo_intercambios` del
+# servidor) en un diccionario {nombre en el GeoJSON: saldo}
+def saldos_por_pais(df_saldo):
+    saldos = {}
+    for pais, saldo in zip(df_saldo["pais"].astype(str), df_saldo["saldo"]):
+        nombre = PAISES_INTERCAMBIO.get(pais.lower())
+        if nombre is not None:
+            saldos[nombre] = float(saldo)
+    return saldos
+
+# Función que dibuja el mapa de saldos: una capa GeoJson con el color ya calculado en cada país (escala RdBu
+# simétrica alrededor de 0), un tooltip con el saldo y la leyenda. El HTML resultante ocupa unos pocos KB.
+def mapa_intercambios(geojson, saldos, leyenda="Saldo neto de energía (MWh)"):
+    limite = max((abs(valor) for valor in saldos.values()), default=0) or 1
+    escala = linear.RdBu_11.scale(-limite, limite)
+    escala.caption = leyenda
+
+    features = []
+    for feature in geojson["features"]:
+        nombre = feature["properties"]["name"]
+        saldo = saldos.get(nombre)
+        propiedades = {"name": nombre, "saldo": "-" if saldo is None else f"{saldo:,.0f}",
+                       "color": "#cccccc" if saldo is None else escala(saldo)}
+        features.append({**feature, "properties": propiedades})
+
+    mapa = folium.Map(location=[39, -3], zoom_start=5, prefer_canvas=True)
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        style_function=lambda feature: {"fillColor": feature["properties"]["color"], "fillOpacity": 0.7,
+                                        "color": "#555555", "weight": 1},
+        tooltip=folium.GeoJsonTooltip(fields=["name", "saldo"], aliases=["País", "Saldo (MWh)"]),
+    ).add_to(mapa)
+    escala.add_to(mapa)
+    return mapa
@@ -0,0 +1,225 @@
+import os
+import threading
+import time as tiempo
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Métricas de la ingesta en formato de texto de Prometheus, sin dependencias externas. `ingesta_ree` las actualiza
+# (peticiones a REE, escrituras en Supabase, marcas de agua y ejecuciones del programador) y se exponen por HTTP
+# en /metrics (METRICAS_PUERTO) y/o en un fichero que se reescribe tras cada ejecución (METRICAS_FICHERO, p. ej.
+# para el "textfile collector" de node_exporter). Con ambas variables vacías solo se guardan en memoria.
+METRICAS_PUERTO = int(os.getenv("METRICAS_PUERTO", "0"))
+METRICAS_FICHERO = os.getenv("METRICAS_FICHERO", "")
+
+# Límites (en segundos) de los histogramas de latencia
+CUBOS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# ------------------------------ TIPOS DE MÉTRICAS ------------------------------
+
+def escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def formatear_etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores)) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nombre}="{escapar(valor)}"' for nombre, valor in pares) + "}"
+
+def formatear_numero(valor):
+    valor = float(valor)
+    return str(int(valor)) if valor.is_integer() else repr(valor)
+
+# Clase base de las métricas: un valor por combinación de etiquetas, protegido por un lock
+class Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas):
+        return tuple(str(etiquetas.get(nombre, "")) for nombre in self.etiquetas)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            for clave, valor in sorted(self._valores.items()):
+                lineas.extend(self._lineas(clave, valor))
+        return lineas
+
+    def _lineas(self, clave, valor):
+        return [f"{self.nombre}{formatear_etiquetas(self.etiquetas, clave)} {formatear_numero(valor)}"]
+
+class Contador(Metrica):
+    tipo = "counter"
+
+    def incrementar(self, cantidad=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+class Indicador(Metrica):
+    tipo = "gauge"
+
+    def fijar(self, valor, **etiquetas):
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = valor
+
+# Histograma acumulativo: para cada combinación de etiquetas guarda [conteo por cubo..., suma, número de muestras]
+class Histograma(Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), cubos=CUBOS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.cubos = tuple(sorted(cubos))
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            datos = self._valores.setdefault(clave, [0] * len(self.cubos) + [0.0, 0])
+            for i, limite in enumerate(self.cubos):
+                if valor <= limite:
+                    datos[i] += 1
+            datos[-2] += valor
+            datos[-1] += 1
+
+    def _lineas(self, clave, datos):
+        lineas = []
+        for limite, conteo in zip(self.cubos, datos):
+            etiquetas = formatear_etiquetas(self.etiquetas, clave, ("le", formatear_numero(limite)))
+            lineas.append(f"{self.nombre}_bucket{etiquetas} {conteo}")
+        lineas.append(f"{self.nombre}_bucket{formatear_etiquetas(self.etiquetas, clave, ('le', '+Inf'))} {datos[-1]}")
+        lineas.append(f"{self.nombre}_sum{formatear_etiquetas(self.etiquetas, clave)} {formatear_numero(datos[-2])}")
+        lineas.append(f"{self.nombre}_count{formatear_etiquetas(self.etiquetas, clave)} {datos[-1]}")
+        return lineas
+
+# Registro con todas las métricas de la ingesta
+class RegistroMetricas:
+    def __init__(self):
+        self.metricas = []
+
+    def _registrar(self, metrica):
+        self.metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def indicador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Indicador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), cubos=CUBOS_LATENCIA):
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, cubos))
+
+    def exponer(self):
+        return "\n".join(linea for metrica in self.metricas for linea in metrica.exponer()) + "\n"
+
+# ------------------------------ MÉTRICAS DE LA INGESTA ------------------------------
+
+registro = RegistroMetricas()
+
+# --- API de REE ---
+ree_peticiones = registro.contador(
+    "ree_peticiones_total", "Consultas a la API de REE por endpoint y resultado (ok, sin_datos, error)",
+    ("endpoint", "resultado"))
+ree_latencia = registro.histograma(
+    "ree_latencia_segundos", "Duración de cada consulta a REE, incluidos los reintentos", ("endpoint",))
+ree_bytes = registro.contador(
+    "ree_bytes_total", "Bytes recibidos de la API de REE (sin comprimir)", ("endpoint",))
+ree_reintentos = registro.contador(
+    "ree_reintentos_total", "Reintentos de peticiones a REE por motivo (HTTP 429/5xx o error de red)",
+    ("endpoint", "motivo"))
+ree_no_modificadas = registro.contador(
+    "ree_no_modificadas_total", "Respuestas 304 de REE servidas desde la caché de validadores", ("endpoint",))
+
+# --- Parseo, validación, escritura y rollups ---
+filas_parseadas = registro.contador(
+    "ingesta_filas_parseadas_total", "Filas obtenidas de las respuestas de REE", ("tabla",))
+filas_descartadas = registro.contador(
+    "ingesta_filas_descartadas_total", "Filas descartadas en la validación", ("tabla",))
+filas_escritas = registro.contador(
+    "ingesta_filas_escritas_total", "Filas escritas en Supabase", ("tabla",))
+lotes_fallidos = registro.contador(
+    "supabase_lotes_fallidos_total", "Lotes de upsert en Supabase que fallaron", ("tabla",))
+supabase_latencia = registro.histograma(
+    "supabase_escritura_segundos", "Duración de cada lote de upsert en Supabase", ("tabla",))
+rollups_latencia = registro.histograma(
+    "supabase_rollups_segundos", "Duración de cada actualización de los rollups tras escribir una ventana", ("tabla",))
+rollups_fallidos = registro.contador(
+    "supabase_rollups_fallidos_total", "Actualizaciones de los rollups que fallaron", ("tabla",))
+
+# --- Anomalías ---
+anomalias_latencia = registro.histograma(
+    "ingesta_anomalias_segundos", "Duración de cada recálculo de anomalías de una tabla y ámbito", ("tabla",))
+anomalias_fallidas = registro.contador(
+    "ingesta_anomalias_fallidas_total", "Recálculos de anomalías que fallaron", ("tabla",))
+ultima_anomalia = registro.indicador(
+    "ingesta_ultima_anomalia_timestamp_segundos",
+    "Datetime (epoch) de la anomalía más reciente detectada por sentido (alta, baja); para alertas",
+    ("tabla", "geo", "sentido"))
+
+# --- Sincronización y programador ---
+ultima_sync = registro.indicador(
+    "ingesta_ultima_sync_timestamp_segundos", "Momento (epoch) de la última marca de agua guardada",
+    ("tabla", "geo"))
+ultimo_dato = registro.indicador(
+    "ingesta_ultimo_dato_timestamp_segundos",
+    "Datetime (epoch) del último dato ingerido; el retraso es time() menos este valor", ("tabla", "geo"))
+ejecuciones = registro.contador(
+    "ingesta_ejecuciones_total", "Ejecuciones de la ingesta por comando y resultado", ("comando", "resultado"))
+duracion_ejecucion = registro.histograma(
+    "ingesta_ejecucion_segundos", "Duración de cada ejecución de la ingesta", ("comando",),
+    cubos=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+ultima_ejecucion = registro.indicador(
+    "ingesta_ultima_ejecucion_timestamp_segundos", "Momento (epoch) del final de la última ejecución correcta",
+    ("comando",))
+
+# ------------------------------ EXPOSICIÓN ------------------------------
+
+# Función que escribe las métricas en un fichero (de forma atómica, para no exponer nunca un fichero a medias)
+def escribir_fichero(ruta=None):
+    ruta = ruta or METRICAS_FICHERO
+    if not ruta:
+        return
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(registro.exponer())
+    os.replace(temporal, ruta)
+
+class ManejadorMetricas(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = registro.exponer().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+# Arranca el servidor HTTP de métricas en un hilo aparte y devuelve el servidor (None si el puerto es 0)
+def servir_metricas(puerto=None):
+    puerto = METRICAS_PUERTO if puerto is None else puerto
+    if not puerto:
+        return None
+    servidor = ThreadingHTTPServer(("0.0.0.0", puerto), ManejadorMetricas)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    print(f"📈 Métricas en http://0.0.0.0:{puerto}/metrics")
+    return servidor
+
+# Registra una ejecución completa de la ingesta (sync o backfill) y actualiza el fichero de métricas
+def registrar_ejecucion(comando, inicio, correcta):
+    ejecuciones.incrementar(comando=comando, resultado="ok" if correcta else "error")
+    duracion_ejecucion.observar(tiempo.monotonic() - inicio, comando=comando)
+    if correcta:
+        ultima_ejecucion.fijar(tiempo.time(), comando=comando)
+    try:
+        escribir_fichero()
+    except OSError as e:
+        print(f"⚠️ No se pudo escribir el fichero de métricas: {e}")
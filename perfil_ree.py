@@ -0,0 +1,80 @@
+import json
+import os
+import time as tiempo
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+# Perfilado opcional del dashboard: tiempos por etapa de una ejecución del script (consulta, agregados, transformaciones,
+# construcción y envío de cada figura) y tamaño de lo que se envía al navegador. Desactivado no mide nada y sus
+# métodos no hacen trabajo extra. No depende de Streamlit: el dashboard decide cuándo activarlo y cómo mostrarlo.
+PERFIL_LOG = os.getenv("PERFIL_LOG", ".perfil_dashboard.jsonl")
+
+class Perfilador:
+    def __init__(self, activo=False):
+        self.activo = activo
+        self.etapas = []
+        self._inicio = tiempo.perf_counter()
+
+    # Mide la duración del bloque `with` como una etapa; devuelve el registro para poder añadirle el tamaño
+    @contextmanager
+    def etapa(self, nombre):
+        if not self.activo:
+            yield {}
+            return
+        registro = {"etapa": nombre, "segundos": 0.0, "bytes": None}
+        t0 = tiempo.perf_counter()
+        try:
+            yield registro
+        finally:
+            registro["segundos"] = tiempo.perf_counter() - t0
+            self.etapas.append(registro)
+
+    # Tamaño en bytes de lo que se envía al navegador: el JSON de una figura de Plotly o el HTML de un mapa de folium
+    def medir_envio(self, registro, objeto):
+        if not self.activo:
+            return
+        if hasattr(objeto, "to_json"):
+            registro["bytes"] = len(objeto.to_json())
+        elif hasattr(objeto, "get_root"):
+            registro["bytes"] = len(objeto.get_root().render())
+
+    def resumen(self):
+        resumen = pd.DataFrame(self.etapas, columns=["etapa", "segundos", "bytes"])
+        total = tiempo.perf_counter() - self._inicio
+        return pd.concat([resumen, pd.DataFrame([{"etapa": "total", "segundos": total, "bytes": None}])],
+                         ignore_index=True)
+
+    # Añade la ejecución al log (una línea JSON por ejecución) para seguir la evolución de cada etapa en el tiempo
+    def guardar_log(self, ruta=None, **contexto):
+        if not self.activo or not self.etapas:
+            return
+        ruta = ruta or PERFIL_LOG
+        linea = {
+            "momento": datetime.now(timezone.utc).isoformat(),
+            **{clave: str(valor) for clave, valor in contexto.items()},
+            "total": tiempo.perf_counter() - self._inicio,
+            "etapas": self.etapas,
+        }
+        try:
+            with open(ruta, "a", encoding="utf-8") as f:
+                f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ No se pudo escribir el log de perfilado '{ruta}': {e}")
+
+# Función que lee el log de perfilado y devuelve una fila por etapa y ejecución, para comparar ejecuciones
+def leer_log(ruta=None):
+    ruta = ruta or PERFIL_LOG
+    if not os.path.exists(ruta):
+        return pd.DataFrame(columns=["momento", "etapa", "segundos", "bytes"])
+    filas = []
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                ejecucion = json.loads(linea)
+            except ValueError:
+                continue
+            contexto = {clave: valor for clave, valor in ejecucion.items() if clave not in ("etapas", "total")}
+            filas.extend({**contexto, **etapa} for etapa in ejecucion.get("etapas", []))
+    return pd.DataFrame(filas)
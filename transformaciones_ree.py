@@ -0,0 +1,121 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Transformaciones de DataFrames para las gráficas del dashboard. No dependen de Streamlit.
+
+# Número máximo de puntos que se envían a Plotly por gráfica (repartidos entre sus series)
+PUNTOS_MAXIMOS_GRAFICO = int(os.getenv("PUNTOS_MAXIMOS_GRAFICO", "2000"))
+
+# Resoluciones de agregación disponibles, de más fina a más gruesa
+RESOLUCIONES = [
+    ("h", pd.Timedelta(hours=1), "horaria"),
+    ("D", pd.Timedelta(days=1), "diaria"),
+    ("W", pd.Timedelta(weeks=1), "semanal"),
+    ("MS", pd.Timedelta(days=31), "mensual"),
+]
+
+# ------------------------------ REMUESTREO ------------------------------
+
+# Función que elige la resolución más fina con la que el rango [inicio, fin] cabe en `presupuesto` puntos
+def elegir_resolucion(inicio, fin, presupuesto=PUNTOS_MAXIMOS_GRAFICO):
+    duracion = pd.Timestamp(fin) - pd.Timestamp(inicio)
+    for freq, paso, nombre in RESOLUCIONES:
+        if duracion / paso <= presupuesto:
+            return freq, nombre
+    return RESOLUCIONES[-1][0], RESOLUCIONES[-1][2]
+
+# Largest-Triangle-Three-Buckets: elige `n_salida` puntos de la serie (x, y) conservando su forma visual, incluidos
+# los picos y valles, que una media por intervalos suavizaría. Devuelve los índices de los puntos elegidos.
+def lttb(x, y, n_salida):
+    n = len(x)
+    if n_salida >= n or n_salida < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # El primer y el último punto se conservan; el resto se reparte en n_salida - 2 cubos
+    limites = np.linspace(1, n - 1, n_salida - 1).astype(np.int64)
+    indices = np.empty(n_salida, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    anterior = 0
+    for i in range(n_salida - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        # Punto medio del cubo siguiente (o el último punto, para el último cubo)
+        sig_inicio, sig_fin = fin, limites[i + 2] if i + 2 < len(limites) else n
+        media_x = x[sig_inicio:sig_fin].mean() if sig_fin > sig_inicio else x[-1]
+        media_y = y[sig_inicio:sig_fin].mean() if sig_fin > sig_inicio else y[-1]
+        # Punto del cubo actual que forma el triángulo de mayor área con el anterior elegido y la media siguiente
+        areas = np.abs((x[anterior] - media_x) * (y[inicio:fin] - y[anterior])
+                       - (x[anterior] - x[inicio:fin]) * (media_y - y[anterior]))
+        anterior = inicio + int(np.nanargmax(areas)) if np.isfinite(areas).any() else inicio
+        indices[i + 1] = anterior
+    return indices
+
+# Función que reduce un DataFrame de series temporales a `presupuesto` puntos en total (repartidos entre las series
+# de la columna `color`) antes de pasarlo a Plotly. Devuelve (DataFrame reducido, descripción de la resolución).
+#   - metodo="lttb": selecciona puntos reales con LTTB; mantiene el resto de columnas y los picos de la serie.
+#   - metodo="agregado": media por intervalos de la resolución elegida (horaria, diaria, semanal o mensual); todas
+#     las series comparten los mismos instantes, que es lo que necesitan las áreas apiladas.
+def remuestrear_serie(df, x="datetime", y="value", color=None, presupuesto=PUNTOS_MAXIMOS_GRAFICO, metodo="lttb"):
+    if df.empty or len(df) <= presupuesto:
+        return df, "original"
+
+    grupos = [(None, df)] if color is None else list(df.groupby(color, observed=True, sort=False))
+    por_serie = max(3, presupuesto // max(1, len(grupos)))
+
+    if metodo == "agregado":
+        freq, nombre = elegir_resolucion(df[x].min(), df[x].max(), por_serie)
+        claves = [pd.Grouper(key=x, freq=freq)] + ([color] if color is not None else [])
+        reducido = df.groupby(claves, observed=True)[y].mean().dropna().reset_index()
+        return reducido, f"media {nombre}"
+
+    partes = []
+    for _, grupo in grupos:
+        grupo = grupo.sort_values(x)
+        if len(grupo) <= por_serie:
+            partes.append(grupo)
+            continue
+        valores_x = grupo[x].to_numpy()
+        if not pd.api.types.is_numeric_dtype(grupo[x]):
+            valores_x = grupo[x].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        partes.append(grupo.iloc[lttb(valores_x, grupo[y].to_numpy(dtype=np.float64), por_serie)])
+    return pd.concat(partes, ignore_index=True), "LTTB"
+
+# ------------------------------ ALINEACIÓN ESTACIONAL ------------------------------
+
+# Zona horaria de los días y horas del eje común: la hora peninsular, la misma con la que se agrupan los rollups
+# diarios (`Supabase_schema`) y las líneas base de las anomalías (`anomalias_ree.py`)
+ZONA_ALINEACION = "Europe/Madrid"
+
+# Función que alinea varios años sobre un mismo eje para compararlos: añade `year`, `dia_del_anio` y `sort_key`
+# (la misma fecha y hora trasladada al año 2000). Todo es vectorizado (sin .apply por fila).
+# Los días se numeran con el calendario de un año bisiesto: en los años no bisiestos, del 1 de marzo en adelante
+# se suma un día, de modo que el 1 de marzo cae siempre en el mismo punto del eje y el 29 de febrero solo aparece
+# en los años que lo tienen, en lugar de desplazar al resto una posición.
+def alinear_por_dia_del_anio(df, x="datetime", anios=None):
+    fechas = df[x] if pd.api.types.is_datetime64_any_dtype(df[x]) else pd.to_datetime(df[x])
+    # Las fechas con zona (UTC en las tablas de REE) se pasan a hora peninsular antes de quitarles la zona, para que
+    # los días del eje se corten en la misma medianoche que las estadísticas diarias. Las fechas sin zona (p. ej.
+    # los días de `estadisticas_diarias`) ya son locales.
+    if fechas.dt.tz is not None:
+        fechas = fechas.dt.tz_convert(ZONA_ALINEACION).dt.tz_localize(None)
+
+    year = fechas.dt.year.to_numpy()
+    if anios is not None:
+        mascara = np.isin(year, list(anios))
+        df, fechas, year = df[mascara], fechas[mascara], year[mascara]
+
+    bisiesto = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    dia_del_anio = fechas.dt.dayofyear.to_numpy() + ((~bisiesto) & (fechas.dt.month.to_numpy() > 2))
+    dentro_del_dia = (fechas - fechas.dt.floor("D")).to_numpy()
+
+    alineado = df.copy()
+    alineado["year"] = year
+    alineado["dia_del_anio"] = dia_del_anio
+    alineado["sort_key"] = (np.datetime64("2000-01-01", "ns")
+                            + (dia_del_anio - 1).astype("timedelta64[D]")
+                            + dentro_del_dia)
+    return alineado